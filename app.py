@@ -1,286 +1,24 @@
 # app.py
-# Check-up Takip Sistemi — tek dosya / Streamlit
-import sqlite3, csv, io, zipfile
-from datetime import datetime, date, timedelta
-from contextlib import closing
-from urllib.parse import quote_plus
-from zoneinfo import ZoneInfo
+# Check-up Takip Sistemi — Streamlit arayüzü. Veri ve iş mantığı core.py'de (arayüzsüz, webhook/işçilerle ortak).
+import os, sqlite3
+from datetime import date, timedelta
 import streamlit as st
+from core import (
+    BACKUP_DIR, BACKUP_KEEP, BULK_UPDATED, CHANGE_PATIENT, DATABASE_URL, DB_PATH, DEFAULT_WA_TEMPLATE,
+    HISTORY_MODES, METRICS_ENABLED, REMINDER_LEAD_MIN, SEARCH_LIMIT, STATS_GRAINS, add_patient_test,
+    add_test_to_package, admit_patient, apply_package_to_patient, archive_months, build_ics, cached_export,
+    change_cursor, changes_since, create_package, day_summary, day_tests, delete_package, delete_patient,
+    delete_patient_test, delete_personnel, delete_test_from_package, enqueue_message, enqueue_patient_status,
+    format_status_message, get_package_tests, get_setting, google_calendar_link, ics_feed, import_packages_csv,
+    init_db, is_archived_day, list_packages, list_patient_tests, list_patients, list_personnel, list_snapshots,
+    make_whatsapp_link, metrics, now_tr, outbox_counts, package_stats, percentile, rebuild_stats,
+    rename_package, restore_snapshot, search_patients, set_day_test_status, set_patient_alarm_time,
+    set_personnel_active, set_setting, set_test_statuses, snapshot_bytes, start_reminder_scheduler,
+    start_snapshot_scheduler, test_stats, throughput, timed, timed_run, to_display, to_iso, today_tr_date,
+    update_patient_test_status, upsert_personnel, write_snapshot)
 
-# ================== CONFIG ==================
-st.set_page_config(page_title="Check-up Takip", page_icon="🩺", layout="wide")
-DB_PATH = "checkup.db"
-TR_TZ = ZoneInfo("Europe/Istanbul")
 AUTH_ENABLED = False  # True yaparsan login: admin/admin olur
-
-def now_tr(): return datetime.now(TR_TZ)
-def today_tr_date(): n=now_tr(); return date(n.year, n.month, n.day)
-def to_iso(d:date)->str: return d.strftime("%Y-%m-%d")
-def to_display(d:date)->str: return d.strftime("%d/%m/%Y")
-def now_str()->str: return now_tr().strftime("%Y-%m-%d %H:%M:%S")
-def normalize_phone(p:str)->str:
-    p=(p or "").strip().replace(" ","").replace("-","")
-    if p and not p.startswith("+"): p="+"+p
-    return p
-
-# ================== DB ==================
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    try:
-        conn.execute("PRAGMA foreign_keys=ON")
-        conn.execute("PRAGMA journal_mode=WAL")
-    except Exception:
-        pass
-    return conn
-
-def column_exists(conn,t,c)->bool:
-    with closing(conn.cursor()) as cur:
-        cur.execute(f"PRAGMA table_info({t})")
-        return any(r[1]==c for r in cur.fetchall())
-
-def init_db():
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("""CREATE TABLE IF NOT EXISTS app_settings(
-            key TEXT PRIMARY KEY, val TEXT)""")
-        c.execute("""CREATE TABLE IF NOT EXISTS personnel(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL, phone TEXT NOT NULL UNIQUE,
-            active INTEGER NOT NULL DEFAULT 1,
-            created_at TEXT NOT NULL DEFAULT (datetime('now')))""")
-        c.execute("""CREATE TABLE IF NOT EXISTS patients(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            first_name TEXT NOT NULL, last_name TEXT NOT NULL,
-            age INTEGER, gender TEXT,
-            visit_date TEXT NOT NULL,
-            created_at TEXT NOT NULL DEFAULT (datetime('now')))""")
-        # Şema yükseltmeleri
-        if not column_exists(conn,"patients","department"):
-            c.execute("ALTER TABLE patients ADD COLUMN department TEXT")
-            c.execute("UPDATE patients SET department='Genel' WHERE department IS NULL")
-        if not column_exists(conn,"patients","visit_time"):
-            c.execute("ALTER TABLE patients ADD COLUMN visit_time TEXT")
-        try:
-            c.execute("UPDATE patients SET created_at = COALESCE(created_at, datetime('now'))")
-        except sqlite3.OperationalError:
-            pass
-        # patient_tests
-        c.execute("""CREATE TABLE IF NOT EXISTS patient_tests(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id INTEGER NOT NULL,
-            test_name TEXT NOT NULL,
-            status TEXT NOT NULL DEFAULT 'bekliyor',
-            updated_at TEXT NOT NULL DEFAULT (datetime('now')),
-            FOREIGN KEY(patient_id) REFERENCES patients(id))""")
-        if not column_exists(conn,"patient_tests","status"):
-            c.execute("ALTER TABLE patient_tests ADD COLUMN status TEXT NOT NULL DEFAULT 'bekliyor'")
-        if not column_exists(conn,"patient_tests","updated_at"):
-            c.execute("ALTER TABLE patient_tests ADD COLUMN updated_at TEXT")
-            c.execute("UPDATE patient_tests SET updated_at = COALESCE(updated_at, datetime('now'))")
-        c.execute("""CREATE TABLE IF NOT EXISTS packages(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            created_at TEXT NOT NULL DEFAULT (datetime('now')))""")
-        c.execute("""CREATE TABLE IF NOT EXISTS package_tests(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            package_id INTEGER NOT NULL,
-            test_name TEXT NOT NULL,
-            ord INTEGER NOT NULL DEFAULT 0,
-            FOREIGN KEY(package_id) REFERENCES packages(id))""")
-
-def cleanup_old_patients():
-    """Dünkü ve öncesi hastaları (tetkikleriyle) sil — paketler kalır."""
-    today_iso = to_iso(today_tr_date())
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("SELECT id FROM patients WHERE visit_date < ?", (today_iso,))
-        ids=[r[0] for r in c.fetchall()]
-        if ids:
-            c.executemany("DELETE FROM patient_tests WHERE patient_id=?", [(i,) for i in ids])
-            c.executemany("DELETE FROM patients WHERE id=?", [(i,) for i in ids])
-
-init_db()
-cleanup_old_patients()
-
-# ================== SETTINGS HELPERS ==================
-def get_setting(key, default=""):
-    with closing(get_conn()) as conn, closing(conn.cursor()) as c:
-        c.execute("SELECT val FROM app_settings WHERE key=?", (key,))
-        r=c.fetchone()
-        return r[0] if r else default
-def set_setting(key,val):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("""INSERT INTO app_settings(key,val) VALUES(?,?)
-                     ON CONFLICT(key) DO UPDATE SET val=excluded.val""",(key,val))
-
-# ================== PERSONNEL ==================
-def list_personnel(active_only=True):
-    with closing(get_conn()) as conn, closing(conn.cursor()) as c:
-        q="SELECT id,name,phone,active FROM personnel"
-        if active_only: q+=" WHERE active=1"
-        q+=" ORDER BY name"
-        c.execute(q); return c.fetchall()
-def upsert_personnel(name,phone,active:int):
-    phone=normalize_phone(phone)
-    if phone and not phone.startswith("+"): raise ValueError("Telefon +90… formatında olmalı")
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("SELECT id FROM personnel WHERE phone=?", (phone,))
-        r=c.fetchone()
-        if r:
-            c.execute("UPDATE personnel SET name=?,active=? WHERE id=?",(name.strip(),active,r[0]))
-            return r[0]
-        c.execute("INSERT INTO personnel(name,phone,active) VALUES(?,?,?)",(name.strip(),phone,active))
-        return c.lastrowid
-def set_personnel_active(pid,active:int):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("UPDATE personnel SET active=? WHERE id=?", (active,pid))
-def delete_personnel(pid:int):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("DELETE FROM personnel WHERE id=?", (pid,))
-
-# ================== PATIENTS / TESTS ==================
-def add_patient(fn, ln, age, gender, visit_date_iso):
-    """created_at’i de doldurarak ekler (IntegrityError fix)."""
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("""
-            INSERT INTO patients(
-                first_name,last_name,age,gender,visit_date,
-                department,visit_time,created_at
-            ) VALUES (?,?,?,?,?,?,?,?)
-        """, (fn.strip(), ln.strip(), age, gender,
-              visit_date_iso, "Genel", None, now_str()))
-def delete_patient(pid:int):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("DELETE FROM patient_tests WHERE patient_id=?", (pid,))
-        c.execute("DELETE FROM patients WHERE id=?", (pid,))
-def set_patient_alarm_time(pid:int, hhmm:str|None):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("UPDATE patients SET visit_time=? WHERE id=?", (hhmm,pid))
-def list_patients(visit_date_iso:str|None=None):
-    with closing(get_conn()) as conn, closing(conn.cursor()) as c:
-        if visit_date_iso:
-            c.execute("""SELECT id,first_name,last_name,age,gender,department,visit_time
-                         FROM patients WHERE visit_date=? ORDER BY last_name,first_name""",(visit_date_iso,))
-        else:
-            c.execute("""SELECT id,first_name,last_name,age,gender,department,visit_time
-                         FROM patients ORDER BY visit_date DESC,last_name""")
-        return c.fetchall()
-
-def _migrate_patient_tests_if_needed(conn, cur):
-    if not column_exists(conn,"patient_tests","status"):
-        cur.execute("ALTER TABLE patient_tests ADD COLUMN status TEXT NOT NULL DEFAULT 'bekliyor'")
-    if not column_exists(conn,"patient_tests","updated_at"):
-        cur.execute("ALTER TABLE patient_tests ADD COLUMN updated_at TEXT")
-        cur.execute("UPDATE patient_tests SET updated_at = COALESCE(updated_at, datetime('now'))")
-
-def add_patient_test(pid:int, test_name:str):
-    test_name = (test_name or "").strip()
-    if not test_name:
-        raise ValueError("Tetkik adı boş olamaz.")
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        try:
-            # En güncel şema ile deneriz
-            c.execute("""INSERT INTO patient_tests(patient_id,test_name,status,updated_at)
-                         VALUES(?,?,?,?)""", (pid, test_name, 'bekliyor', now_str()))
-        except sqlite3.IntegrityError:
-            # Eski tabloda NOT NULL/constraint vb. sorun: şemayı onarıp tekrar dene
-            _migrate_patient_tests_if_needed(conn, c)
-            c.execute("""INSERT INTO patient_tests(patient_id,test_name,status,updated_at)
-                         VALUES(?,?,?,?)""", (pid, test_name, 'bekliyor', now_str()))
-        except sqlite3.OperationalError:
-            # Çok eski kurulumlarda sütun farklı olabilir
-            _migrate_patient_tests_if_needed(conn, c)
-            c.execute("""INSERT INTO patient_tests(patient_id,test_name,status,updated_at)
-                         VALUES(?,?,?,?)""", (pid, test_name, 'bekliyor', now_str()))
-
-def list_patient_tests(pid:int):
-    with closing(get_conn()) as conn, closing(conn.cursor()) as c:
-        c.execute("""SELECT id,patient_id,test_name,status,updated_at
-                     FROM patient_tests WHERE patient_id=? ORDER BY updated_at DESC, id DESC""",(pid,))
-        return c.fetchall()
-def update_patient_test_status(tid:int, status:str):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("UPDATE patient_tests SET status=?,updated_at=? WHERE id=?",(status,now_str(),tid))
-def delete_patient_test(tid:int):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("DELETE FROM patient_tests WHERE id=?", (tid,))
-
-# ================== PACKAGES ==================
-def list_packages():
-    with closing(get_conn()) as conn, closing(conn.cursor()) as c:
-        c.execute("SELECT id,name FROM packages ORDER BY name"); return c.fetchall()
-def get_package_tests(pkg_id:int):
-    with closing(get_conn()) as conn, closing(conn.cursor()) as c:
-        c.execute("""SELECT id,test_name,ord FROM package_tests
-                     WHERE package_id=? ORDER BY ord ASC, id ASC""",(pkg_id,))
-        return c.fetchall()
-def create_package(name:str, tests:list[str]):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("INSERT INTO packages(name) VALUES(?)",(name.strip(),))
-        pid=c.lastrowid
-        for i,t in enumerate(tests):
-            if t.strip():
-                c.execute("INSERT INTO package_tests(package_id,test_name,ord) VALUES(?,?,?)",(pid,t.strip(),i))
-        return pid
-def rename_package(pkg_id:int, new_name:str):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("UPDATE packages SET name=? WHERE id=?", (new_name.strip(), pkg_id))
-def add_test_to_package(pkg_id:int, test_name:str, ord_hint:int|None=None):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        if ord_hint is None:
-            c.execute("SELECT COALESCE(MAX(ord),-1)+1 FROM package_tests WHERE package_id=?", (pkg_id,))
-            ord_hint=c.fetchone()[0]
-        c.execute("INSERT INTO package_tests(package_id,test_name,ord) VALUES(?,?,?)",(pkg_id,test_name.strip(),ord_hint))
-def delete_test_from_package(pt_id:int):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("DELETE FROM package_tests WHERE id=?", (pt_id,))
-def delete_package(pkg_id:int):
-    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
-        c.execute("DELETE FROM package_tests WHERE package_id=?", (pkg_id,))
-        c.execute("DELETE FROM packages WHERE id=?", (pkg_id,))
-def apply_package_to_patient(pkg_id:int, patient_id:int):
-    for _id, name, _ord in get_package_tests(pkg_id):
-        add_patient_test(patient_id, name)
-
-# ================== CALENDAR / WHATSAPP LINKS ==================
-def build_ics(patient_name:str, visit_date_iso:str, hhmm:str,
-              duration_min:int=30, remind_min:int=10, location:str="Klinik")->bytes:
-    dt_local=datetime.strptime(f"{visit_date_iso} {hhmm}","%Y-%m-%d %H:%M").replace(tzinfo=TR_TZ)
-    dt_end=dt_local+timedelta(minutes=duration_min)
-    dtstamp=now_tr().strftime("%Y%m%dT%H%M%S")
-    s=dt_local.strftime("%Y%m%dT%H%M%S"); e=dt_end.strftime("%Y%m%dT%H%M%S")
-    uid=f"{abs(hash((patient_name,visit_date_iso,hhmm,dtstamp)))}@checkup"
-    ics=f"""BEGIN:VCALENDAR
-VERSION:2.0
-PRODID:-//checkup//streamlit//TR
-CALSCALE:GREGORIAN
-BEGIN:VEVENT
-UID:{uid}
-DTSTAMP;TZID=Europe/Istanbul:{dtstamp}
-DTSTART;TZID=Europe/Istanbul:{s}
-DTEND;TZID=Europe/Istanbul:{e}
-SUMMARY:Check-up Randevu – {patient_name}
-LOCATION:{location}
-DESCRIPTION:{patient_name} randevusu.
-BEGIN:VALARM
-TRIGGER:-PT{remind_min}M
-ACTION:DISPLAY
-DESCRIPTION:Hatırlatma
-END:VALARM
-END:VEVENT
-END:VCALENDAR
-"""
-    return ics.encode("utf-8")
-def google_calendar_link(patient_name, visit_date_iso, hhmm, duration_min:int=30, location:str="Klinik"):
-    start_local=datetime.strptime(f"{visit_date_iso} {hhmm}","%Y-%m-%d %H:%M").replace(tzinfo=TR_TZ)
-    end_local=start_local+timedelta(minutes=duration_min)
-    fmt="%Y%m%dT%H%M%SZ"
-    s=start_local.astimezone(ZoneInfo("UTC")).strftime(fmt)
-    e=end_local.astimezone(ZoneInfo("UTC")).strftime(fmt)
-    return ("https://www.google.com/calendar/render?action=TEMPLATE"
-            f"&text={quote_plus('Check-up – '+patient_name)}"
-            f"&dates={s}/{e}&location={quote_plus(location)}&details={quote_plus('Check-up randevusu')}")
-
-def make_whatsapp_link(phone,text)->str:
-    return f"https://wa.me/{normalize_phone(phone).replace('+','')}?text={quote_plus(text)}"
+NAV_MODES = ["Tek bölüm (hızlı)","Sekmeler (klasik)"]  # ilk değer varsayılan
 
 # ================== THEME & EFFECTS ==================
 def apply_theme(theme_name:str):
@@ -315,7 +53,7 @@ def apply_theme(theme_name:str):
     css=THEMES.get(theme_name,"")
     if css: st.markdown(css, unsafe_allow_html=True)
 
-st.markdown("""
+BASE_CSS = """
 <style>
 section.main > div { animation: fadeIn .35s ease-in-out; }
 @keyframes fadeIn { from{opacity:0; transform:translateY(6px);} to{opacity:1; transform:none;} }
@@ -330,7 +68,7 @@ section.main > div { animation: fadeIn .35s ease-in-out; }
 .pkg-chip{ display:inline-block; padding:.35rem .6rem; border-radius:999px; background:var(--chip-bg); color:var(--chip-tx);
   margin:.22rem .28rem .22rem 0; font-size:.92rem; }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # ================== AUTH (opsiyonel) ==================
 def do_login_ui():
@@ -344,19 +82,33 @@ def do_login_ui():
             st.session_state.auth={"logged_in":True,"user":"admin"}
             st.experimental_rerun()
         else: st.error("Geçersiz bilgiler.")
-if "auth" not in st.session_state:
-    st.session_state.auth={"logged_in": (not AUTH_ENABLED), "user":"admin"}
-if AUTH_ENABLED and not st.session_state.auth["logged_in"]:
-    do_login_ui(); st.stop()
-
-# ================== THEME APPLY ==================
-apply_theme(get_setting("theme","Sistemle Uyumlu"))
 
 # ================== SIDEBAR ==================
-picked_date=st.sidebar.date_input("📅 Tarih", value=today_tr_date())
-sel_iso=to_iso(picked_date); sel_disp=to_display(picked_date)
-
-with st.sidebar:
+def render_sidebar(reminders)->tuple[str,str]:
+    if "sel_date" not in st.session_state: st.session_state.sel_date=today_tr_date()
+    picked_date=st.sidebar.date_input("📅 Tarih", key="sel_date")
+    with st.sidebar: render_patient_search()
+    with st.sidebar: render_settings(reminders)
+    return to_iso(picked_date), to_display(picked_date)
+
+def _open_patient(pid:int, name:str, day_iso:str, archived:bool):
+    # Widget'lar oluşmadan (on_click) çalışır: gün, bölüm ve hasta seçimi birlikte değişir
+    st.session_state.sel_date=date.fromisoformat(day_iso)
+    st.session_state.nav_section="🧪 Tetkik Takibi"
+    st.session_state["pt_for_tests_arch" if archived else "pt_for_tests"]=(pid, name)
+
+def render_patient_search():
+    q=st.text_input("🔎 Hasta ara", key="patient_q", placeholder="Ad, soyad ya da tetkik",
+                    help="Tüm günlerde ve arşivde arar; ı/i, ş/s, ğ/g, ö/o, ü/u, ç/c farkı gözetilmez.")
+    if not q.strip(): return
+    hits=search_patients(q)
+    if not hits: st.caption("Eşleşen hasta yok."); return
+    for pid,fn,ln,day,arch in hits:
+        st.button(f"{fn} {ln} — {to_display(date.fromisoformat(day))}{' 🗄️' if arch else ''}", key=f"hit_{pid}",
+                  on_click=_open_patient, args=(pid, f"{fn} {ln}", day, bool(arch)), use_container_width=True)
+    if len(hits)>=SEARCH_LIMIT: st.caption(f"İlk {SEARCH_LIMIT} sonuç gösteriliyor; aramayı daraltın.")
+
+def render_settings(reminders):
     st.divider()
     with st.expander("⚙️ Ayarlar", expanded=False):
         st.markdown("#### 🎨 Tema")
@@ -365,11 +117,37 @@ with st.sidebar:
         new_t=st.selectbox("Tema seç", themes, index=themes.index(cur))
         if st.button("Temayı Uygula"): set_setting("theme",new_t); st.rerun()
 
+        st.markdown("#### 🧭 Görünüm")
+        cur_nav=get_setting("nav_mode",NAV_MODES[0])
+        new_nav=st.selectbox("Gezinme", NAV_MODES, index=NAV_MODES.index(cur_nav) if cur_nav in NAV_MODES else 0,
+                             help="Tek bölüm: yalnızca açık bölümün sorguları çalışır. Sekmeler: tüm sekmeler her seferinde yüklenir.")
+        if st.button("Görünümü Uygula"): set_setting("nav_mode",new_nav); st.rerun()
+        cur_poll=int(get_setting("live_poll_s", str(LIVE_POLL_S)) or 0)
+        poll=st.number_input("Canlı güncelleme (sn, 0 = kapalı)", 0, 120, cur_poll, step=1,
+                             help="Tetkik listesi başka oturumların değişikliklerini bu aralıkla yoklar.")
+        if poll!=cur_poll: set_setting("live_poll_s", str(poll))
+
+        st.markdown("#### 🗄️ Geçmiş günler")
+        modes=list(HISTORY_MODES)
+        cur_hist=get_setting("history_mode","archive")
+        new_hist=st.selectbox("Günü biten hastalar", modes, format_func=HISTORY_MODES.get,
+                              index=modes.index(cur_hist) if cur_hist in modes else 0)
+        if st.button("Geçmiş Ayarını Kaydet"): set_setting("history_mode",new_hist); st.rerun()
+
         st.markdown("#### 💬 Mesaj şablonu")
-        default_tpl=("📌 Tetkik Güncellemesi\nHasta: {patient} ({date})\nTamamlanan: {done}\nKalan: {remaining}")
-        tpl=st.text_area("Şablon", value=get_setting("wa_template", default_tpl), height=120,
+        tpl=st.text_area("Şablon", value=get_setting("wa_template", DEFAULT_WA_TEMPLATE), height=120,
                          help="{patient}, {date}, {done}, {remaining}")
         if st.button("Şablonu Kaydet"): set_setting("wa_template",tpl); st.success("Kaydedildi")
+        auto=st.checkbox("Durum değişince varsayılan alıcıya Twilio ile bildir", value=get_setting("auto_notify","0")=="1",
+                         help="Mesajlar kuyruğa alınır; `python outbox.py run` gönderir.")
+        if auto!=(get_setting("auto_notify","0")=="1"): set_setting("auto_notify","1" if auto else "0")
+        cur_lead=float(get_setting("reminder_lead_min", str(REMINDER_LEAD_MIN)) or 0)
+        lead=st.number_input("⏰ Hatırlatma (saatten kaç dk önce)", 0.0, 240.0, cur_lead, step=5.0,
+                             help="Alarm saati olan ve bekleyen tetkiki bulunan hastalar için varsayılan alıcıya gider.")
+        if lead!=cur_lead: set_setting("reminder_lead_min", str(lead)); reminders.notify(None)
+        st.caption((f"{reminders.scheduled()} hatırlatma planlı • {reminders.fired} gönderildi" if reminders.owner
+                    else "Hatırlatmaları başka bir süreç gönderiyor")
+                   + (f" • hata: {reminders.last_error}" if reminders.last_error else ""))
 
         st.markdown("#### 👥 Kişiler (WhatsApp)")
         ppl=list_personnel(active_only=False)
@@ -395,16 +173,26 @@ with st.sidebar:
         if st.button("Kaydet"): set_setting("default_recipient", sel[0] if sel[0] else ""); st.success("Kaydedildi")
 
 # ================== MAIN ==================
-st.title("🩺 Check-up Takip Sistemi")
-tab_hasta, tab_tetkik, tab_paket, tab_ozet, tab_yedek = st.tabs(
-    ["🧑‍⚕️ Hastalar","🧪 Tetkik Takibi","📦 Paketler","📊 Gün Özeti","💾 Yedek"]
-)
+def export_download(label:str, kind:str, file_name:str, gz:bool=False):
+    """Dışa aktarım ancak istenince üretilir; sonrasında jeton değişene kadar önbellekten gelir."""
+    flag=f"export_ready_{kind}"
+    if not st.session_state.get(flag):
+        if not st.button(f"{label} hazırla", key=f"{flag}_btn"): return
+        st.session_state[flag]=True
+    if gz: file_name+=".gz"
+    st.download_button(label, cached_export(kind, gz), file_name,
+                       "application/gzip" if gz else "text/csv", key=f"export_dl_{kind}")
+
+# Her bölüm bir render fonksiyonu; "Tek bölüm" modunda yalnızca seçili bölüm çalışır,
+# "Sekmeler" modunda (st.tabs) hepsi her rerun'da çalışır.
 
 # -------- Hastalar --------
-with tab_hasta:
+def render_patients(sel_iso:str, sel_disp:str):
     st.subheader(f"{sel_disp} — Hasta Listesi")
     pts=list_patients(sel_iso)
     st.table([{"ID":p[0],"Ad":p[1],"Soyad":p[2],"Cinsiyet":p[4] or "","Yaş":p[3] or "","Alarm":p[6] or "-"} for p in pts])
+    if is_archived_day(sel_iso):
+        st.info("🗄️ Arşivlenmiş gün — salt okunur."); return
 
     st.markdown("### ➕ Hızlı Ekle")
     pkgs_all = list_packages()
@@ -424,15 +212,12 @@ with tab_hasta:
             parts=fullname.split()
             fn=" ".join(parts[:-1]) if len(parts)>1 else parts[0]
             ln=parts[-1] if len(parts)>1 else "-"
+            pkg_ids=[k for k,_ in sel_pkgs]
             try:
-                add_patient(fn, ln, int(age), gender, sel_iso)
+                admit_patient(fn, ln, int(age), gender, sel_iso, pkg_ids)
             except sqlite3.IntegrityError:
                 init_db()
-                add_patient(fn, ln, int(age), gender, sel_iso)
-            pts2=list_patients(sel_iso)
-            new_id=max([p[0] for p in pts2]) if pts2 else None
-            if new_id and sel_pkgs:
-                for pid_pkg,_ in sel_pkgs: apply_package_to_patient(pid_pkg, new_id)
+                admit_patient(fn, ln, int(age), gender, sel_iso, pkg_ids)
             st.success("Hasta eklendi" + (f" (+ {len(sel_pkgs)} paket)" if sel_pkgs else ""))
             st.rerun()
 
@@ -442,7 +227,26 @@ with tab_hasta:
         if st.button("Sil"): delete_patient(choice[0]); st.success("Silindi"); st.rerun()
 
 # -------- Tetkik Takibi --------
-with tab_tetkik:
+LIVE_POLL_S = 5    # varsayılan canlı güncelleme aralığı (sn)
+LIVE_BATCH = 500   # tek yoklamada okunan en fazla değişiklik
+def auto_notify(pid:int, default_phone:str):
+    # Ayarlarda açıksa durum değişikliği varsayılan alıcıya kuyruktan gider (birikenler tek mesajda birleşir)
+    if default_phone and get_setting("auto_notify","0")=="1":
+        enqueue_patient_status(pid, [default_phone])
+
+def render_archived_tests(sel_iso:str, sel_disp:str):
+    pts=list_patients(sel_iso)
+    if not pts: st.info("Bu tarihte arşivlenmiş hasta yok."); return
+    st.info("🗄️ Arşivlenmiş gün — salt okunur.")
+    sel=st.selectbox("Hasta", [(p[0], f"{p[1]} {p[2]}") for p in pts], format_func=lambda x:x[1], key="pt_for_tests_arch")
+    trs=list_patient_tests(sel[0], archived=True)
+    if not trs: st.info("Tetkik yok.")
+    for _tid,_pid,name,status,upd in trs:
+        st.markdown(f"{'✅' if status=='tamamlandi' else '⏳'} **{name}** — {upd}")
+
+def render_tests(sel_iso:str, sel_disp:str):
+    if is_archived_day(sel_iso): render_archived_tests(sel_iso, sel_disp); return
+    reset_live_state()  # tam çalıştırmada her şey taze okunur; fragment yoklamaları buradan devam eder
     pts_today=list_patients(sel_iso)
     if not pts_today: st.info("Bu tarihte hasta yok.")
     else:
@@ -494,51 +298,156 @@ with tab_tetkik:
                     st.markdown('</div>', unsafe_allow_html=True)
 
         st.markdown("#### Tetkikler")
-        trs=list_patient_tests(pid)
-        if not trs: st.info("Tetkik yok.")
-        else:
-            done=[t[2] for t in trs if t[3]=="tamamlandi"]
-            rem=[t[2] for t in trs if t[3]=="bekliyor"]
-            tpl=get_setting("wa_template","Hasta: {patient} ({date})\nTamamlanan: {done}\nKalan: {remaining}")
-            msg=tpl.format(patient=patient_name, date=sel_disp,
-                           done=", ".join(done) if done else "-", remaining=", ".join(rem) if rem else "-")
-            active_people=list_personnel(active_only=True)
-            receivers=[(p[2], f"{p[1]} — {p[2]}") for p in active_people]
-            default_phone=get_setting("default_recipient", receivers[0][0] if receivers else "")
-            cwa,cics=st.columns([2,2])
-            with cwa:
-                st.markdown("**💬 WhatsApp**")
-                if default_phone:
-                    st.link_button("Gönder (varsayılan)", make_whatsapp_link(default_phone, msg), use_container_width=True)
-                if receivers:
-                    recv=st.selectbox("Başka alıcı", receivers, format_func=lambda x:x[1], key="wa_alt")
-                    st.link_button("Bu kişiye gönder", make_whatsapp_link(recv[0], msg), use_container_width=True)
-                    multi=st.multiselect("Çoklu alıcı", receivers, format_func=lambda x:x[1], key="wa_multi")
-                    for ph,label in multi: st.link_button(f"{label}’a gönder", make_whatsapp_link(ph, msg))
-                with st.popover("Mesajı kopyala"): st.code(msg, language=None)
-            with cics:
-                if visit_hhmm:
-                    rem_min=st.selectbox("Alarm süresi", [5,10,15,30], index=1)
-                    ics=build_ics(patient_name, sel_iso, visit_hhmm, remind_min=rem_min)
-                    st.download_button("🔔 Takvime ekle (.ics)", data=ics,
-                                       file_name=f"checkup_{patient_name.replace(' ','_')}_{sel_iso}_{visit_hhmm}.ics",
-                                       mime="text/calendar")
-                    st.link_button("🗓️ Google Calendar", google_calendar_link(patient_name, sel_iso, visit_hhmm))
-                else:
-                    st.info("Alarm saati yok. Tetkik eklerken 'Alarm kur' ile belirleyebilirsin.")
-            st.divider()
-            for tid,_pid,name,status,upd in trs:
-                icon="✅" if status=="tamamlandi" else "⏳"
-                c1,c2,c3,c4=st.columns([6,1,1,1])
-                c1.markdown(f"{icon} **{name}** — {upd}")
-                if status=="bekliyor":
-                    if c2.button("Tamamla", key=f"done_{tid}"): update_patient_test_status(tid,"tamamlandi"); st.rerun()
-                else:
-                    if c3.button("Geri Al", key=f"undo_{tid}"): update_patient_test_status(tid,"bekliyor"); st.rerun()
-                if c4.button("Sil", key=f"del_{tid}"): delete_patient_test(tid); st.rerun()
+        poll=int(get_setting("live_poll_s", str(LIVE_POLL_S)) or 0)
+        st.fragment(run_every=poll or None)(render_test_list)(pid, patient_name, visit_hhmm, sel_iso, sel_disp)
+        render_bulk_status(sel_iso)
+
+def reset_live_state():
+    st.session_state.live_cursor=change_cursor(); st.session_state.live_tests={}
+
+def poll_changes(sel_iso:str)->bool:
+    """Oturum imlecinden sonraki değişiklikleri okur, etkilenen hastaların oturumdaki tetkik listesini düşürür.
+    Seçili günde hasta eklenmiş/silinmiş ya da saati değişmişse True döner (hasta listesi de yenilenmeli)."""
+    ss=st.session_state
+    if "live_cursor" not in ss: reset_live_state(); return False
+    changes=changes_since(ss.live_cursor, LIVE_BATCH)
+    if not changes: return False
+    if len(changes)>=LIVE_BATCH:  # uzun süre yoklanmamış: hepsini tazele
+        reset_live_state(); return True
+    ss.live_cursor=changes[-1][0]
+    for _seq,cpid,_day,_kind in changes: ss.live_tests.pop(cpid, None)
+    return any(kind==CHANGE_PATIENT and day==sel_iso for _seq,_pid,day,kind in changes)
+
+def session_patient_tests(pid:int)->list[tuple]:
+    ss=st.session_state
+    if METRICS_ENABLED: metrics().cache("session_tests", pid in ss.live_tests)
+    if pid not in ss.live_tests: ss.live_tests[pid]=list_patient_tests(pid)
+    return ss.live_tests[pid]
+
+def recipients()->tuple[list[tuple[str,str]],str]:
+    """Aktif kişiler [(telefon, etiket)] ve varsayılan alıcı."""
+    receivers=[(p[2], f"{p[1]} — {p[2]}") for p in list_personnel(active_only=True)]
+    return receivers, get_setting("default_recipient", receivers[0][0] if receivers else "")
+
+def set_test_status(pid:int, tid:int, status:str|None):
+    """Tetkik butonlarının on_click'i: fragment yeniden çalışmadan önce yazar; status=None → sil."""
+    if status is None: delete_patient_test(tid)
+    else:
+        update_patient_test_status(tid, status)
+        auto_notify(pid, recipients()[1])
+    st.session_state.live_tests.pop(pid, None)
+
+def set_patient_tests_done(pid:int, tids:list[int]):
+    """'Tümünü tamamla' on_click'i: hastanın bekleyen tetkikleri tek işlemde."""
+    set_test_statuses([(tid,"tamamlandi") for tid in tids])
+    auto_notify(pid, recipients()[1])
+    st.session_state.live_tests.pop(pid, None)
+
+@timed_run("fragment:test_list")
+def render_test_list(pid:int, patient_name:str, visit_hhmm:str|None, sel_iso:str, sel_disp:str):
+    """Tetkik listesi; WhatsApp ve ICS panelleri içinde ayrı fragment'lardır.
+    Buton tıklaması yalnızca bu fragment'ı yeniden çalıştırır: tek sorgu (list_patient_tests) + mesaj."""
+    if poll_changes(sel_iso): st.rerun(scope="app")
+    trs=session_patient_tests(pid)
+    if not trs: st.info("Tetkik yok."); return
+    cwa,cics=st.columns([2,2])
+    with cwa: render_whatsapp_panel(pid, patient_name, sel_disp)
+    with cics: render_ics_panel(pid, patient_name, sel_iso, visit_hhmm)
+    st.divider()
+    pending=[t[0] for t in trs if t[3]=="bekliyor"]
+    if len(pending)>1:
+        st.button(f"✅ Tümünü tamamla ({len(pending)})", key=f"alldone_{pid}", on_click=set_patient_tests_done, args=(pid,pending))
+    for tid,_pid,name,status,upd in trs:
+        icon="✅" if status=="tamamlandi" else "⏳"
+        c1,c2,c3,c4=st.columns([6,1,1,1])
+        c1.markdown(f"{icon} **{name}** — {upd}")
+        if status=="bekliyor": c2.button("Tamamla", key=f"done_{tid}", on_click=set_test_status, args=(pid,tid,"tamamlandi"))
+        else: c3.button("Geri Al", key=f"undo_{tid}", on_click=set_test_status, args=(pid,tid,"bekliyor"))
+        c4.button("Sil", key=f"del_{tid}", on_click=set_test_status, args=(pid,tid,None))
+
+STATUS_LABELS = {"tamamlandi":"✅ Tamamlandı", "bekliyor":"⏳ Bekliyor"}
+
+def render_bulk_status(sel_iso:str):
+    """Toplu durum: bir tetkik adını günün tüm hastalarında (tek UPDATE) ya da tablodan seçilenleri (tek executemany) günceller."""
+    rows=day_tests(sel_iso)
+    if not rows: return
+    res=st.session_state.pop("bulk_result", None)
+    with st.expander("🧾 Toplu durum güncelle", expanded=res is not None):
+        if res:
+            msg,detail=res
+            st.success(msg)
+            if detail: st.dataframe(detail, hide_index=True, use_container_width=True)
+        names=sorted({r[4] for r in rows}, key=str.casefold)
+        cn,cs=st.columns([3,2])
+        name=cn.selectbox("Tetkik (günün tüm hastaları)", names, key="bulk_name")
+        status=cs.selectbox("Yeni durum", list(STATUS_LABELS), format_func=STATUS_LABELS.get, key="bulk_status")
+        n=sum(1 for r in rows if r[4]==name and r[5]!=status)
+        if st.button(f"Hepsine uygula ({n} tetkik)", key="bulk_by_name", disabled=not n):
+            changed=set_day_test_status(sel_iso, name, status)
+            notify_patients({pid for _,pid in changed})
+            st.session_state.bulk_result=(f"'{name}': {len(changed)} tetkik → {STATUS_LABELS[status]}", None)
+            st.rerun()
+
+        st.markdown("**Tablodan seç**")
+        gen=st.session_state.get("bulk_gen", 0)  # kaydedince tablo düzenlemeleri sıfırlansın
+        edited=st.data_editor([{"Hasta":f"{fn} {ln}", "Tetkik":t, "Tamamlandı":s_=="tamamlandi"} for _t,_p,fn,ln,t,s_ in rows],
+                              key=f"bulk_grid_{gen}", hide_index=True, disabled=["Hasta","Tetkik"], use_container_width=True)
+        changes=[(r[0], "tamamlandi" if e["Tamamlandı"] else "bekliyor")
+                 for r,e in zip(rows, edited) if e["Tamamlandı"]!=(r[5]=="tamamlandi")]
+        if st.button(f"Değişiklikleri kaydet ({len(changes)})", key="bulk_by_grid", disabled=not changes):
+            by_id={r[0]:r for r in rows}
+            results=set_test_statuses(changes)
+            notify_patients({by_id[tid][1] for tid,r in results if r==BULK_UPDATED})
+            detail=[{"Hasta":f"{by_id[tid][2]} {by_id[tid][3]}", "Tetkik":by_id[tid][4],
+                     "Durum":STATUS_LABELS[s_], "Sonuç":r} for (tid,s_),(_tid,r) in zip(changes, results)]
+            ok=sum(1 for _,r in results if r==BULK_UPDATED)
+            st.session_state.bulk_result=(f"{ok}/{len(results)} tetkik güncellendi.", detail)
+            st.session_state.bulk_gen=gen+1
+            st.rerun()
+
+def notify_patients(pids):
+    default_phone=recipients()[1]
+    for pid in pids: auto_notify(pid, default_phone)
+
+@st.fragment
+@timed_run("fragment:whatsapp")
+def render_whatsapp_panel(pid:int, patient_name:str, sel_disp:str):
+    trs=session_patient_tests(pid)
+    tpl=get_setting("wa_template","Hasta: {patient} ({date})\nTamamlanan: {done}\nKalan: {remaining}")
+    msg=format_status_message(tpl, patient_name, sel_disp, trs)
+    receivers,default_phone=recipients()
+    st.markdown("**💬 WhatsApp**")
+    if default_phone:
+        st.link_button("Gönder (varsayılan)", make_whatsapp_link(default_phone, msg), use_container_width=True)
+    if receivers:
+        recv=st.selectbox("Başka alıcı", receivers, format_func=lambda x:x[1], key="wa_alt")
+        st.link_button("Bu kişiye gönder", make_whatsapp_link(recv[0], msg), use_container_width=True)
+        multi=st.multiselect("Çoklu alıcı", receivers, format_func=lambda x:x[1], key="wa_multi")
+        for ph,label in multi: st.link_button(f"{label}’a gönder", make_whatsapp_link(ph, msg))
+        targets=[ph for ph,_ in multi] or ([default_phone] if default_phone else [])
+        if targets and st.button(f"📤 Twilio kuyruğuna al ({len(targets)} alıcı)", use_container_width=True):
+            for ph in targets: enqueue_message(ph, msg, patient_id=pid)
+            st.success("Kuyruğa alındı.")
+        counts=outbox_counts()
+        if counts: st.caption(f"Kuyruk: {counts.get('pending',0)} bekliyor • {counts.get('sent',0)} gönderildi"
+                              + (f" • {counts['failed']} hatalı" if counts.get('failed') else ""))
+    with st.popover("Mesajı kopyala"): st.code(msg, language=None)
+
+@st.fragment
+@timed_run("fragment:ics")
+def render_ics_panel(pid:int, patient_name:str, sel_iso:str, visit_hhmm:str|None):
+    if visit_hhmm:
+        rem_min=st.selectbox("Alarm süresi", [5,10,15,30], index=1)
+        ics=build_ics(pid, patient_name, sel_iso, visit_hhmm, remind_min=rem_min)
+        st.download_button("🔔 Takvime ekle (.ics)", data=ics,
+                           file_name=f"checkup_{patient_name.replace(' ','_')}_{sel_iso}_{visit_hhmm}.ics",
+                           mime="text/calendar")
+        st.link_button("🗓️ Google Calendar", google_calendar_link(patient_name, sel_iso, visit_hhmm))
+    else:
+        st.info("Alarm saati yok. Tetkik eklerken 'Alarm kur' ile belirleyebilirsin.")
 
 # -------- Paketler --------
-with tab_paket:
+def render_packages(sel_iso:str, sel_disp:str):
     st.subheader("📦 Check-up Paketleri")
     pkgs=list_packages()
     col_a, col_b = st.columns([2,2])
@@ -593,67 +502,174 @@ with tab_paket:
             del_sel=st.selectbox("Silinecek paket", [(k,n) for k,n in pkgs], format_func=lambda x:x[1], key="pkg_del_sel")
             if st.button("Paketi Sil"): delete_package(del_sel[0]); st.success("Silindi"); st.rerun()
         st.markdown("### ↕️ Paket Dışa/İçe Aktar (CSV)")
-        def _csv_packages():
-            with closing(get_conn()) as conn, closing(conn.cursor()) as c:
-                c.execute("SELECT id,name FROM packages ORDER BY id"); pk=c.fetchall()
-                c.execute("SELECT package_id,test_name,ord FROM package_tests ORDER BY package_id,ord"); pt=c.fetchall()
-            mem=io.StringIO(); w=csv.writer(mem)
-            w.writerow(["type","id_or_package_id","name_or_test","ord"])
-            for i,n in pk: w.writerow(["package", i, n, ""])
-            for pid,t,o in pt: w.writerow(["item", pid, t, o])
-            return mem.getvalue().encode("utf-8")
-        st.download_button("Paketleri CSV İndir", _csv_packages(), "packages.csv", "text/csv")
-        up=st.file_uploader("CSV Yükle (type,id/name, name/test, ord)", type=["csv"])
-        if up and st.button("CSV'den Yükle"):
-            txt=up.read().decode("utf-8").splitlines(); rd=csv.DictReader(txt)
-            created={}
-            for r in rd:
-                if r["type"]=="package":
-                    created[r["name_or_test"]]=create_package(r["name_or_test"], [])
-                elif r["type"]=="item":
-                    try: pid=int(r["id_or_package_id"])
-                    except: pid=created.get(r["id_or_package_id"])
-                    if pid: add_test_to_package(pid, r["name_or_test"])
-            st.success("İçe aktarıldı"); st.rerun()
+        export_download("Paketleri CSV İndir", "packages", "packages.csv")
+        up=st.file_uploader("CSV Yükle (type,id/name, name/test, ord)", type=["csv","gz"])
+        if up:
+            # Önizleme dosya başına bir kez: doğrulama sonucu ve satır hataları yüklemeden önce görünür
+            if st.session_state.get("pkg_csv_check",(None,))[0]!=up.file_id:
+                st.session_state.pkg_csv_check=(up.file_id, import_packages_csv(up, dry_run=True))
+            chk=st.session_state.pkg_csv_check[1]
+            st.caption(f"{chk['packages']} paket ({chk['created']} yeni) • {chk['tests']} tetkik • {len(chk['errors'])} hatalı satır")
+            if chk["errors"]:
+                st.dataframe([{"Satır":l, "Hata":m} for l,m in chk["errors"][:500]], hide_index=True, use_container_width=True)
+                st.caption("Hatalı satırlar atlanır; geçerli satırlar yüklenir.")
+            if st.button("CSV'den Yükle", disabled=not chk["packages"]):
+                res=import_packages_csv(up)
+                st.session_state.pop("pkg_csv_check", None)
+                st.success(f"İçe aktarıldı: {res['packages']} paket ({res['created']} yeni), {res['tests']} tetkik"); st.rerun()
 
 # -------- Gün Özeti --------
-with tab_ozet:
+def render_summary(sel_iso:str, sel_disp:str):
     st.subheader(f"{sel_disp} — Gün Özeti")
-    pts=list_patients(sel_iso)
-    if not pts: st.info("Bu tarihte hasta yok.")
+    summary,total_done,total_rem=day_summary(sel_iso)
+    if not summary: st.info("Bu tarihte hasta yok.")
     else:
-        rows=[]; total_done=total_rem=0
-        for p in pts:
-            tests=list_patient_tests(p[0])
-            done=[f"✅ {t[2]}" for t in tests if t[3]=="tamamlandi"]
-            rem=[f"⏳ {t[2]}" for t in tests if t[3]=="bekliyor"]
-            total_done += len(done); total_rem += len(rem)
-            rows.append({"Hasta": f"{p[1]} {p[2]}", "Tamamlanan": ", ".join(done) if done else "-", "Kalan": ", ".join(rem) if rem else "-"})
+        rows=[]
+        for _pid,fn,ln,_hhmm,done,rem in summary:
+            rows.append({"Hasta": f"{fn} {ln}",
+                         "Tamamlanan": ", ".join(f"✅ {t}" for t in done) if done else "-",
+                         "Kalan": ", ".join(f"⏳ {t}" for t in rem) if rem else "-"})
         st.table(rows)
         st.caption(f"Toplam tamamlanan: {total_done} • Kalan: {total_rem}")
-        with_time=[p for p in pts if p[6] and any(t[3]=="bekliyor" for t in list_patient_tests(p[0]))]
-        if with_time:
-            mem=io.BytesIO()
-            with zipfile.ZipFile(mem,"w",zipfile.ZIP_DEFLATED) as z:
-                for p in with_time:
-                    pname=f"{p[1]} {p[2]}"; ics=build_ics(pname, sel_iso, p[6])
-                    z.writestr(f"{pname.replace(' ','_')}_{sel_iso}_{p[6]}.ics", ics)
-            mem.seek(0)
-            st.download_button("📦 Kalan tetkiki olanların randevuları (.zip)", mem,
-                               file_name=f"{sel_iso}_randevular_kalan.zip", mime="application/zip")
+        if any(s[3] and s[5] for s in summary):
+            st.download_button("📅 Kalan tetkiki olanların randevuları (.ics)", ics_feed(sel_iso)[0],
+                               file_name=f"{sel_iso}_randevular_kalan.ics", mime="text/calendar")
+            st.caption("Takvim aboneliği: webhook servisinde `/calendar.ics?token=…` (aralık: `from`, `to`) — "
+                       "randevular değişmedikçe istemciler 304 alır.")
+
+# -------- Pano --------
+DASHBOARD_RANGES = {"Son 7 gün":7, "Son 30 gün":30, "Son 12 hafta":84, "Son 12 ay":365}
+def render_dashboard(sel_iso:str, sel_disp:str):
+    st.subheader(f"{sel_disp} itibarıyla — Pano")
+    c1,c2=st.columns(2)
+    span=c1.selectbox("Aralık", list(DASHBOARD_RANGES), key="dash_range")
+    grain=c2.selectbox("Gruplama", list(STATS_GRAINS), index=1 if DASHBOARD_RANGES[span]>30 else 0, key="dash_grain")
+    from_iso=to_iso(date.fromisoformat(sel_iso)-timedelta(days=DASHBOARD_RANGES[span]-1))
+    rows=throughput(from_iso, sel_iso, grain)
+    if not any(r[2] for r in rows): st.info("Bu aralıkta tetkik yok.")
+    else:
+        pts,tests,done=(sum(r[i] for r in rows) for i in (1,2,3))
+        mins=sum(r[4]*r[3] for r in rows if r[4] is not None)
+        m1,m2,m3,m4=st.columns(4)
+        m1.metric("Hasta", pts); m2.metric("Tetkik", tests)
+        m3.metric("Tamamlanma", f"%{100*done/tests:.0f}")
+        m4.metric("Ort. tamamlanma", f"{mins/done:.0f} dk" if done else "-")
+        st.bar_chart({"Dönem":[r[0] for r in rows], "Tamamlanan":[r[3] for r in rows], "Kalan":[r[2]-r[3] for r in rows]},
+                     x="Dönem", y=["Tamamlanan","Kalan"])
+        ts=test_stats(from_iso, sel_iso)
+        st.markdown("#### Tetkikler")
+        st.dataframe([{"Tetkik":n, "Toplam":t, "Tamamlanan":d, "Oran %":round(100*d/t), "Ort. dk":m} for n,t,d,m in ts],
+                     hide_index=True, use_container_width=True)
+        pk=package_stats(from_iso, sel_iso)
+        if pk:
+            st.markdown("#### Paketler")
+            st.dataframe([{"Paket":n, "Tetkik":t, "Tamamlanan":d, "Oran %":round(100*d/t)} for n,t,d in pk],
+                         hide_index=True, use_container_width=True)
+            st.caption("Paket oranı, paketteki tetkiklerin aralıktaki toplamlarından hesaplanır.")
+    if st.button("🔄 İstatistikleri yeniden hesapla", help="Canlı ve arşiv kayıtlarından baştan toplar."):
+        st.success(f"{rebuild_stats()} gün yeniden hesaplandı.")
 
 # -------- Yedek --------
-with tab_yedek:
+def render_backup(sel_iso:str, sel_disp:str):
     st.subheader("Dışa Aktar (CSV)")
-    def _csv(q):
-        with closing(get_conn()) as conn, closing(conn.cursor()) as c:
-            c.execute(q); rows=c.fetchall(); headers=[d[0] for d in c.description]
-        buf=io.StringIO(); w=csv.writer(buf); w.writerow(headers); w.writerows(rows)
-        return buf.getvalue().encode("utf-8")
+    gz=st.toggle("gzip ile sıkıştır (.csv.gz)", key="export_gz")
+    c1,c2=st.columns(2)
+    with c1:
+        export_download("Hastalar CSV", "patients", "patients.csv", gz)
+        export_download("Tetkikler CSV", "patient_tests", "patient_tests.csv", gz)
+    with c2:
+        export_download("Kişiler CSV", "personnel", "personnel.csv", gz)
+        export_download("Paketler CSV (yalnızca başlıklar)", "packages_only", "packages_only.csv", gz)
+    with st.expander("🗄️ Arşiv"):
+        months=archive_months()
+        if not months: st.info("Arşiv boş.")
+        else:
+            st.table([{"Ay":m,"Hasta":n} for m,n in months])
+            export_download("Arşiv hastalar CSV", "archive_patients", "archive_patients.csv", gz)
+            export_download("Arşiv tetkikler CSV", "archive_patient_tests", "archive_patient_tests.csv", gz)
+
+    st.subheader("Veritabanı Yedeği (anlık görüntü)")
+    if DATABASE_URL:
+        st.info("Veriler PostgreSQL'de; yedek ve geri yükleme için sunucu tarafında `pg_dump` / `pg_restore` kullanın.")
+        return
+    st.caption("Tüm tabloların aynı andaki tutarlı kopyası; yazma işlemlerini bekletmeden alınır.")
+    if st.button("Yedek hazırla (.db.gz)"):
+        st.session_state.snapshot_data=snapshot_bytes()
+        st.session_state.snapshot_name=f"checkup_{now_tr():%Y%m%d_%H%M%S}.db.gz"
+    if st.session_state.get("snapshot_data"):
+        st.download_button("Yedeği indir", st.session_state.snapshot_data, st.session_state.snapshot_name,
+                           "application/gzip", key="snapshot_dl")
+
+    sched=start_snapshot_scheduler(DB_PATH)
     c1,c2=st.columns(2)
     with c1:
-        st.download_button("Hastalar CSV", _csv("SELECT * FROM patients"), "patients.csv","text/csv")
-        st.download_button("Tetkikler CSV", _csv("SELECT * FROM patient_tests"), "patient_tests.csv","text/csv")
+        st.markdown("**⏱️ Otomatik yedek**")
+        cur_h=float(get_setting("backup_interval_h","0") or 0)
+        hours=st.number_input("Aralık (saat, 0 = kapalı)", 0.0, 168.0, cur_h, step=1.0)
+        if st.button("Aralığı Kaydet"): set_setting("backup_interval_h", str(hours)); st.success("Kaydedildi")
+        if st.button("Şimdi diske yedekle"): st.success(f"Kaydedildi: {write_snapshot()}")
+        if sched.last_error: st.warning(f"Son otomatik yedek hatası: {sched.last_error}")
+        snaps=list_snapshots()
+        st.caption(f"`{BACKUP_DIR}/` içinde {len(snaps)} yedek (en fazla {BACKUP_KEEP})"
+                   + (f" — son: {os.path.basename(snaps[0])}" if snaps else ""))
     with c2:
-        st.download_button("Kişiler CSV", _csv("SELECT * FROM personnel"), "personnel.csv","text/csv")
-        st.download_button("Paketler CSV (yalnızca başlıklar)", _csv("SELECT * FROM packages"), "packages_only.csv","text/csv")
\ No newline at end of file
+        st.markdown("**♻️ Geri yükle**")
+        up=st.file_uploader("Yedek dosyası (.db / .db.gz)", type=["db","gz"], key="restore_up")
+        sure=st.checkbox("Mevcut verilerin üzerine yazılacağını anlıyorum", key="restore_ok")
+        if up and sure and st.button("Geri Yükle"):
+            try: restore_snapshot(up.getvalue()); st.success("Geri yüklendi"); st.rerun()
+            except (ValueError, sqlite3.Error) as e: st.error(f"Hata: {e}")
+
+# -------- Tanılama (CHECKUP_METRICS=1 iken ?diag=1) --------
+def render_diagnostics():
+    m=metrics(); runs=list(m.runs)
+    with st.expander("🩺 Tanılama", expanded=True):
+        if not runs: st.caption("Henüz ölçüm yok (bu sayfa yüklenmesi bittiğinde kaydedilir)."); return
+        last=runs[-1]; walls=sorted(r["wall_ms"] for r in runs if r["kind"]=="rerun")
+        c1,c2,c3=st.columns(3)
+        c1.metric(f"Son çalıştırma ({last['kind']})", f"{last['wall_ms']:.0f} ms")
+        c2.metric("SQL (son)", f"{last['sql']} ifade • {last['sql_ms']:.1f} ms")
+        c3.metric(f"Rerun p50 / p95 ({len(walls)})", f"{percentile(walls,50):.0f} / {percentile(walls,95):.0f} ms")
+        cl,cr=st.columns(2)
+        cl.markdown("**Bölümler (son)**")
+        cl.dataframe([{"Bölüm":k, "ms":v} for k,v in last["sections"].items()], hide_index=True, use_container_width=True)
+        cr.markdown("**En pahalı SQL (son)**")
+        cr.dataframe([{"SQL":q, "adet":n, "ms":ms} for q,n,ms in last["top_sql"]], hide_index=True, use_container_width=True)
+        st.markdown("**Son çalıştırmalar**")
+        st.dataframe([{"zaman":r["at"], "tür":r["kind"], "ms":r["wall_ms"], "sql":r["sql"], "sql ms":r["sql_ms"],
+                       "en yavaş bölüm":next(iter(r["sections"]), "")} for r in reversed(runs[-50:])],
+                     hide_index=True, use_container_width=True)
+        with m._lock: caches=dict(m.caches)
+        if caches: st.caption("Önbellek isabeti: "+" • ".join(f"{k} {h}/{h+x}" for k,(h,x) in caches.items()))
+        d1,d2=st.columns(2)
+        d1.download_button("JSON lines", m.jsonl(), "checkup_metrics.jsonl", "application/x-ndjson")
+        d2.download_button("Prometheus", m.prometheus(), "checkup_metrics.prom", "text/plain")
+
+SECTIONS=[("🧑‍⚕️ Hastalar",render_patients),("🧪 Tetkik Takibi",render_tests),("📦 Paketler",render_packages),
+          ("📊 Gün Özeti",render_summary),("📈 Pano",render_dashboard),("💾 Yedek",render_backup)]
+
+@timed_run("rerun")
+def main():
+    st.set_page_config(page_title="Check-up Takip", page_icon="🩺", layout="wide")
+    st.markdown(BASE_CSS, unsafe_allow_html=True)
+    if "auth" not in st.session_state:
+        st.session_state.auth={"logged_in": (not AUTH_ENABLED), "user":"admin"}
+    if AUTH_ENABLED and not st.session_state.auth["logged_in"]:
+        do_login_ui(); st.stop()
+    apply_theme(get_setting("theme","Sistemle Uyumlu"))
+    reminders=start_reminder_scheduler(DB_PATH)
+    with timed("sidebar"): sel_iso, sel_disp = render_sidebar(reminders)
+
+    st.title("🩺 Check-up Takip Sistemi")
+    if get_setting("nav_mode",NAV_MODES[0])==NAV_MODES[1]:
+        for tab,(label,render) in zip(st.tabs([s[0] for s in SECTIONS]), SECTIONS):
+            with tab, timed(f"section:{label}"): render(sel_iso, sel_disp)
+    else:
+        section=st.radio("Bölüm", [s[0] for s in SECTIONS], horizontal=True,
+                         key="nav_section", label_visibility="collapsed")
+        with timed(f"section:{section}"): dict(SECTIONS)[section](sel_iso, sel_disp)
+    if METRICS_ENABLED and st.query_params.get("diag")=="1": render_diagnostics()
+
+# streamlit run app.py betiği __main__ olarak çalıştırır; import edildiğinde (webhook vb.) arayüz kurulmaz
+if __name__=="__main__":
+    main()
@@ -0,0 +1,258 @@
+# bench.py
+# Ölçüm düzeneği: geçici dizindeki checkup.db ayarlanabilir hacimlerle doldurulur, core.py'nin veri erişim fonksiyonları
+# arayüzsüz ölçülür (yeni süreçte import ve ilk sorgu süresi dahil), ardından streamlit.testing AppTest ile tam rerun'lar
+# koşulur. Gecikme yüzdelikleri ve işlem başına SQL sayısı (CHECKUP_METRICS ölçümünden) saklı bir tabanla karşılaştırılabilir.
+# Kullanım: python bench.py [--patients 150] [--packages 8] [--tests 12] [--days 30] [--personnel 10]
+#           python bench.py --save-baseline bench_baseline.json      → tabanı kaydet
+#           python bench.py --baseline bench_baseline.json           → karşılaştır (gerileme varsa çıkış kodu 1)
+#           python bench.py --compare                                → eski yollar: N+1 gün özeti, satır başına CSV içe aktarma
+import argparse, csv, io, json, os, random, sqlite3, subprocess, sys, tempfile, time
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+NOISE_MS = 1.0   # bunun altındaki p50 farkları gerileme sayılmaz
+P95_MIN_N = 20   # daha az örnekte en yakın sıra p95 zaten en büyük değerdir; yazılmaz (max sütununa bakılır)
+
+def _load_core(workdir:str):
+    # core.DB_PATH göreli ("checkup.db"): geçici dizinde çalışarak gerçek DB'ye dokunmayız.
+    # Ölçüm açık: işlem başına SQL sayısı Metrics kaydından okunur.
+    os.environ["CHECKUP_METRICS"]="1"
+    os.chdir(workdir); sys.path.insert(0, HERE)
+    import core
+    return core
+
+# ================== VERİ ==================
+def seed(core, v:dict, rng:random.Random)->dict:
+    """Personel, paketler, bugünün hastaları ve v['days'] günlük geçmiş (arşive taşınmış) oluşturur."""
+    with core.closing(core.get_conn()) as conn, conn, core.closing(conn.cursor()) as c:
+        c.executemany("INSERT INTO personnel(name,phone,active) VALUES(?,?,?)",
+                      [(f"Personel {i}", f"+90555{i:07d}", int(i%4!=0)) for i in range(v["personnel"])])
+    names=[f"Tetkik {j}" for j in range(v["tests"]*2)]  # paketler arasında örtüşen adlar: tekilleştirme de ölçülür
+    ids=core.storage().import_packages([(f"Paket {k}", rng.sample(names, v["tests"])) for k in range(v["packages"])])
+    core.ref_cache().invalidate("packages","package_tests")
+    pkg_ids=list(ids.values())
+    with core.closing(core.get_conn()) as conn, core.closing(conn.cursor()) as c:
+        c.execute("SELECT package_id,test_id FROM package_tests ORDER BY package_id,ord,id")
+        pkg_tests=c.fetchall()
+    today=core.today_tr_date()
+    for d in range(v["days"], 0, -1): seed_day(core, core.to_iso(today-core.timedelta(days=d)), v["patients"], pkg_ids, pkg_tests, rng)
+    if v["days"]: core.cleanup_old_patients(force=True)  # geçmiş günler arşive
+    seed_day(core, core.to_iso(today), v["patients"], pkg_ids, pkg_tests, rng)
+    return {"pkg_ids":pkg_ids, "pkg_tests":pkg_tests}
+
+def seed_day(core, day_iso:str, n_patients:int, pkg_ids, pkg_tests, rng:random.Random):
+    with core.closing(core.get_conn()) as conn, conn, core.closing(conn.cursor()) as c:
+        for i in range(n_patients):
+            c.execute("""INSERT INTO patients(first_name,last_name,age,gender,visit_date,department,visit_time,created_at,phone)
+                         VALUES(?,?,?,?,?,?,?,?,?)""",
+                      (f"Ad{i}", f"Soyad{i}", 20+i%60, "Kadın" if i%2 else "Erkek", day_iso, "Genel",
+                       f"{8+i%10:02d}:{(i*5)%60:02d}" if i%2 else None, core.now_str(), f"+90532{i:07d}"))
+            pid=c.lastrowid
+            picked=set(rng.sample(pkg_ids, min(2,len(pkg_ids))))
+            tids=dict.fromkeys(t for k,t in pkg_tests if k in picked)
+            c.executemany("INSERT INTO patient_tests(patient_id,test_id,status,updated_at) VALUES(?,?,?,?)",
+                          [(pid,t,"tamamlandi" if rng.random()<0.35 else "bekliyor",core.now_str()) for t in tids])
+
+def package_catalog(n_lines:int, per_pkg:int=20, prefix:str="Katalog")->bytes:
+    buf=io.StringIO(); w=csv.writer(buf); w.writerow(["type","id_or_package_id","name_or_test","ord"])
+    for k in range(max(1, n_lines//(per_pkg+1))):
+        w.writerow(["package", k+1, f"{prefix} {k}", ""])
+        for j in range(per_pkg): w.writerow(["item", k+1, f"Tetkik {j}", j])
+    return buf.getvalue().encode()
+
+# ================== ARAYÜZSÜZ ÖLÇÜMLER ==================
+def measure(core, name:str, fn, repeat:int, setup=None)->dict:
+    """fn'i repeat kez çalıştırır; setup süreye katılmaz, None dışında bir şey dönerse fn'e argüman olur.
+    Süreler ms, sql: çalıştırma başına ifade sayısı."""
+    m=core.metrics(); ms=[]; sql=[]
+    for _ in range(repeat):
+        arg=setup() if setup else None
+        t0=time.perf_counter()
+        with m.run(f"bench:{name}"): fn() if arg is None else fn(arg)
+        ms.append((time.perf_counter()-t0)*1000); sql.append(m.runs[-1]["sql"])
+    return {"ms":ms, "sql":sql}
+
+def headless(core, v:dict, data:dict, rng:random.Random)->dict:
+    day=core.to_iso(core.today_tr_date()); yesterday=core.to_iso(core.today_tr_date()-core.timedelta(days=1))
+    pids=[p[0] for p in core.list_patients(day)]
+    def fresh_patient(): return core.add_patient("Yeni", "Hasta", 40, "Kadın", day)
+    def yesterday_batch(): seed_day(core, yesterday, v["patients"], data["pkg_ids"], data["pkg_tests"], rng)
+    catalog=package_catalog(v["catalog"])
+    ops=[
+        ("list_patients", lambda: core.list_patients(day), None),
+        ("list_patient_tests", lambda: core.list_patient_tests(rng.choice(pids)), None),
+        ("day_summary", lambda: core.day_summary(day), None),
+        ("apply_package_to_patient", lambda pid: core.apply_package_to_patient(data["pkg_ids"][0], pid), fresh_patient),
+        ("cleanup_old_patients", lambda: core.cleanup_old_patients(force=True), yesterday_batch),
+        ("build_ics_feed (gün)", lambda: core.build_ics_feed(day, day), None),
+        ("ics_feed (önbellekli)", lambda: core.ics_feed(day), None),
+        ("pano: throughput (30 gün, hafta)", lambda: core.throughput(core.to_iso(core.today_tr_date()-core.timedelta(days=29)), day, "Hafta"), None),
+        ("pano: test_stats (30 gün)", lambda: core.test_stats(core.to_iso(core.today_tr_date()-core.timedelta(days=29)), day), None),
+        ("search_patients", lambda: core.search_patients("ad{0} soyad{0}".format(rng.randrange(v["patients"]))), None),
+        *[(f"export_csv:{k}", lambda k=k: core.export_csv(k), None)
+          for k in ("patients","patient_tests","packages","archive_patient_tests")],
+        ("import_packages_csv", lambda: core.import_packages_csv(io.BytesIO(catalog)), None),
+    ]
+    out={}
+    for name,fn,setup in ops:
+        # Dışa aktarım / içe aktarım / temizlik ağır: daha az tekrar
+        out[name]=measure(core, name, fn, max(3, v["repeat"]//4) if name.startswith(("export","import","cleanup")) else v["repeat"], setup)
+    return out
+
+def compare_old_paths(core, v:dict):
+    """Eski akışlar (yalnızca bilgi): hasta başına list_patient_tests ile gün özeti, satır başına CSV içe aktarma."""
+    day=core.to_iso(core.today_tr_date())
+    def n_plus_1():
+        for p in core.list_patients(day): core.list_patient_tests(p[0]); core.list_patient_tests(p[0])
+    created={}
+    def per_row():
+        for r in csv.DictReader(package_catalog(1000, prefix="Eski").decode().splitlines()):
+            if r["type"]=="package": created[r["id_or_package_id"]]=core.create_package(r["name_or_test"], [])
+            else: core.add_test_to_package(created[r["id_or_package_id"]], r["name_or_test"])
+    def like_scan():
+        with core.closing(core.get_conn()) as conn, core.closing(conn.cursor()) as c:
+            for t in ("patients","archive_patients"):
+                c.execute(f"SELECT id,first_name,last_name,visit_date FROM {t} WHERE last_name LIKE ? LIMIT 50", ("%soyad7%",))
+                c.fetchall()
+    return {"day_summary (N+1, eski)":measure(core, "n+1", n_plus_1, 5),
+            "CSV satır başına, 1000 satır (eski)":measure(core, "per_row", per_row, 1),
+            "hasta araması LIKE '%…%' (eski)":measure(core, "like", like_scan, 5)}
+
+# ================== SOĞUK BAŞLANGIÇ ==================
+# Arayüzsüz süreçlerin (webhook, outbox işçisi, betikler) açılışı; her ölçüm yeni bir Python sürecinde.
+COLD_START = """import sys, time
+t0=time.perf_counter(); import core; t1=time.perf_counter()
+core.list_patients(core.to_iso(core.today_tr_date())); t2=time.perf_counter()
+print((t1-t0)*1000, (t2-t1)*1000, "streamlit" in sys.modules)"""
+
+def cold_start(workdir:str, repeat:int)->dict:
+    """import core (Streamlit yüklenmemeli) ve ilk sorgu (şema sürümü kontrolü, havuz, günlük temizlik kontrolü)."""
+    env={**os.environ, "PYTHONPATH":HERE}; env.pop("CHECKUP_METRICS", None)
+    out={"soğuk: import core":{"ms":[], "sql":[]}, "soğuk: ilk sorgu":{"ms":[], "sql":[]}}
+    for _ in range(repeat):
+        p=subprocess.run([sys.executable, "-c", COLD_START], cwd=workdir, env=env, capture_output=True, text=True)
+        if p.returncode: raise RuntimeError(p.stderr[-2000:])
+        imp,first,ui=p.stdout.split()
+        if ui=="True": raise RuntimeError("import core Streamlit'i yükledi")
+        for name,ms in zip(out, (imp, first)): out[name]["ms"].append(float(ms)); out[name]["sql"].append(0)
+    return out
+
+# ================== APPTEST (tam rerun) ==================
+def apptest_worker(workdir:str, reruns:int, tabs:bool)->dict:
+    # Ayrı süreçte çalışır: ölçüm süreci core'u zaten yüklemiş; AppTest rerun'larının önbellek ve ölçüm kaydı karışmasın
+    os.chdir(workdir)
+    log=os.path.join(workdir, "metrics.jsonl")
+    os.environ.update(CHECKUP_METRICS="1", CHECKUP_METRICS_LOG=log)
+    with sqlite3.connect("checkup.db") as conn:
+        conn.execute("""INSERT INTO app_settings(key,val) VALUES('nav_mode',?)
+                        ON CONFLICT(key) DO UPDATE SET val=excluded.val""", ("Sekmeler (klasik)" if tabs else "Tek bölüm (hızlı)",))
+    from streamlit.testing.v1 import AppTest
+    at=AppTest.from_file(os.path.join(HERE, "app.py"), default_timeout=120)
+    out={}
+    def run(name, step):
+        open(log, "w").close()
+        t0=time.perf_counter(); step(); dt=(time.perf_counter()-t0)*1000
+        if at.exception: raise RuntimeError(f"{name}: {at.exception}")
+        with open(log, encoding="utf-8") as f: recs=[json.loads(l) for l in f]
+        r=out.setdefault(name, {"ms":[], "sql":[]})
+        r["ms"].append(dt); r["sql"].append(sum(x["sql"] for x in recs if x["kind"]=="rerun"))
+    run("rerun: ilk yükleme"+(" (sekmeler)" if tabs else ""), at.run)
+    if tabs:
+        for _ in range(reruns): run("rerun: sekmeler (tümü)", at.run)
+        return out
+    for label in [o for o in at.radio(key="nav_section").options]:
+        run(f"rerun: {label}", lambda: at.radio(key="nav_section").set_value(label).run())
+        for _ in range(reruns-1): run(f"rerun: {label}", at.run)
+    return out
+
+def apptest(workdir:str, reruns:int)->dict:
+    out={}
+    for tabs in (False, True):
+        p=subprocess.run([sys.executable, os.path.abspath(__file__), "--apptest-worker", workdir,
+                          "--reruns", str(reruns)]+(["--tabs"] if tabs else []), capture_output=True, text=True)
+        if p.returncode: raise RuntimeError(p.stderr[-2000:])
+        out.update(json.loads(p.stdout.strip().splitlines()[-1]))
+    return out
+
+# ================== RAPOR ==================
+def summarize(core, raw:dict)->dict:
+    out={}
+    for k,r in raw.items():
+        ms=sorted(r["ms"])
+        p95=round(core.percentile(ms,95),3) if len(ms)>=P95_MIN_N else None
+        out[k]={"n":len(ms), "p50":round(core.percentile(ms,50),3), "p95":p95,
+                "max":round(ms[-1],3), "sql":max(r["sql"])}
+    return out
+
+def report(results:dict, baseline:dict|None, tolerance:float)->list[str]:
+    """Tabloyu yazar; gerileyen işlemlerin listesini döner (p50 tolerans + gürültü eşiğini aşan ya da daha çok SQL)."""
+    base=(baseline or {}).get("results", {}); regressions=[]
+    print(f"{'işlem':<40} {'n':>4} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'sql':>5}" + ("   taban p50    Δ%  sql" if base else ""))
+    for name,r in results.items():
+        p95=f"{r['p95']:>9.2f}" if r["p95"] is not None else f"{'—':>9}"
+        line=f"{name:<40} {r['n']:>4} {r['p50']:>9.2f} {p95} {r['max']:>9.2f} {r['sql']:>5}"
+        b=base.get(name)
+        if b:
+            delta=(r["p50"]-b["p50"])/b["p50"]*100 if b["p50"] else 0.0
+            slow=r["p50"]>b["p50"]*(1+tolerance) and r["p50"]-b["p50"]>NOISE_MS
+            more_sql=r["sql"]>b["sql"]
+            flag=" ◀ yavaşladı" if slow else ""
+            if more_sql: flag+=f" ◀ sql {b['sql']}→{r['sql']}"
+            if flag: regressions.append(name)
+            line+=f"   {b['p50']:>9.2f} {delta:>+6.0f}% {b['sql']:>4}{flag}"
+        print(line)
+    return regressions
+
+def main(argv=None)->int:
+    ap=argparse.ArgumentParser(description="Check-up Takip ölçüm düzeneği")
+    ap.add_argument("--patients", type=int, default=150, help="gün başına hasta")
+    ap.add_argument("--packages", type=int, default=8)
+    ap.add_argument("--tests", type=int, default=12, help="paket başına tetkik")
+    ap.add_argument("--days", type=int, default=30, help="arşivdeki geçmiş gün sayısı")
+    ap.add_argument("--personnel", type=int, default=10)
+    ap.add_argument("--catalog", type=int, default=10000, help="içe aktarılan paket CSV satırı")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--reruns", type=int, default=5, help="AppTest: bölüm başına rerun")
+    ap.add_argument("--no-apptest", action="store_true")
+    ap.add_argument("--compare", action="store_true", help="eski yolları da ölç")
+    ap.add_argument("--workdir", help="tohumlanmış DB burada kalır (varsayılan: geçici dizin)")
+    ap.add_argument("--baseline"); ap.add_argument("--save-baseline")
+    ap.add_argument("--tolerance", type=float, default=0.5, help="p50 için izin verilen göreli artış")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--apptest-worker", help=argparse.SUPPRESS); ap.add_argument("--tabs", action="store_true", help=argparse.SUPPRESS)
+    a=ap.parse_args(argv)
+    if a.apptest_worker:
+        print(json.dumps(apptest_worker(a.apptest_worker, a.reruns, a.tabs))); return 0
+
+    v={k:getattr(a,k) for k in ("patients","packages","tests","days","personnel","catalog","repeat","reruns")}
+    baseline=None
+    if a.baseline:
+        with open(a.baseline, encoding="utf-8") as f: baseline=json.load(f)
+        if baseline.get("volumes")!=v: print(f"Uyarı: taban farklı hacimlerle alınmış: {baseline.get('volumes')}")
+    baseline_path=os.path.abspath(a.save_baseline) if a.save_baseline else None
+    tmp=None if a.workdir else tempfile.TemporaryDirectory()
+    workdir=os.path.abspath(a.workdir or tmp.name); os.makedirs(workdir, exist_ok=True)
+    try:
+        core=_load_core(workdir); rng=random.Random(a.seed)
+        t0=time.perf_counter(); data=seed(core, v, rng)
+        print(f"Tohum: {v['patients']} hasta/gün × {v['days']} gün geçmiş, {v['packages']} paket × {v['tests']} tetkik, "
+              f"{v['personnel']} personel ({time.perf_counter()-t0:.1f} sn) → {workdir}")
+        raw=headless(core, v, data, rng)
+        raw.update(cold_start(workdir, max(3, v["repeat"]//4)))
+        if not a.no_apptest: raw.update(apptest(workdir, a.reruns))
+        results=summarize(core, raw)
+        regressions=report(results, baseline, a.tolerance)
+        if a.compare:
+            print("\nEski yollar (karşılaştırma):"); report(summarize(core, compare_old_paths(core, v)), None, a.tolerance)
+        if baseline_path:
+            with open(baseline_path, "w", encoding="utf-8") as f:
+                json.dump({"volumes":v, "python":sys.version.split()[0], "sqlite":sqlite3.sqlite_version,
+                           "results":results}, f, ensure_ascii=False, indent=1)
+            print(f"Taban kaydedildi: {baseline_path}")
+        if regressions: print(f"\n{len(regressions)} gerileme: {', '.join(regressions)}")
+        return 1 if regressions else 0
+    finally:
+        os.chdir(HERE)
+        if tmp: tmp.cleanup()
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,15 @@
+# check_query_plans.py
+# Sıcak sorgularda indeks regresyonu kontrolü (EXPLAIN QUERY PLAN).
+# Kullanım: python check_query_plans.py   → tam tarama varsa çıkış kodu 1
+import sys
+from core import HOT_QUERIES, query_plan_problems
+
+def main()->int:
+    problems=query_plan_problems()
+    for name,detail in problems:
+        print(f"FAIL {name}: {detail}")
+    print(f"{len(HOT_QUERIES)} sorgu kontrol edildi, {len(problems)} sorun.")
+    return 1 if problems else 0
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# check_storage.py
+# Depolama arayüzü uyum denetimi: aynı senaryo seçili arka uçta çalıştırılır, dönüş biçimleri karşılaştırılır.
+# Kullanım: python check_storage.py                                   → geçici dizinde SQLite
+#           DATABASE_URL=postgresql://localhost/checkup_test python check_storage.py   → PostgreSQL (boş test DB'si)
+import inspect, io, os, sys, tempfile, time
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+
+def missing_methods(core, store)->list[str]:
+    names=[n for n,_ in inspect.getmembers(core.Storage, inspect.isfunction) if not n.startswith("_")]
+    return [n for n in names if not callable(getattr(store, n, None))]
+
+def scenario(core)->list[str]:
+    errors=[]
+    def check(name, cond):
+        if not cond: errors.append(name)
+    day=core.to_iso(core.today_tr_date()); tag=str(time.time_ns())[-8:]
+    vals=list(range(1,101))
+    check("percentile", [core.percentile(vals[:10],50), core.percentile(vals[:20],95), core.percentile(vals[:2],50),
+                         core.percentile(vals,95), core.percentile(vals,7), core.percentile(vals,100), core.percentile(vals[:1],0)]==[5,19,1,95,7,100,1])
+
+    core.set_setting(f"t_{tag}", "1"); check("setting", core.get_setting(f"t_{tag}")=="1")
+    ppl=core.upsert_personnel(f"Personel {tag}", f"+90555{tag[:7]}", 1)
+    check("upsert_personnel", any(p[0]==ppl for p in core.list_personnel()))
+    check("upsert_personnel (aynı telefon)", core.upsert_personnel("Yeni ad", f"+90555{tag[:7]}", 0)==ppl)
+    check("list_personnel(active_only)", all(p[0]!=ppl for p in core.list_personnel(active_only=True)))
+
+    k1=core.create_package(f"Paket A {tag}", ["Hemogram","EKG"]); k2=core.create_package(f"Paket B {tag}", ["ekg ","Göz"])
+    core.add_test_to_package(k2, "Efor")
+    check("get_package_tests", [t[1] for t in core.get_package_tests(k2)]==["EKG","Göz","Efor"])
+    pid,n=core.admit_patient("Ayşe", f"Yılmaz{tag}", 40, "Kadın", day, [k1,k2], phone=f"+90532{tag[:7]}")
+    check("admit_patient (tekilleştirme)", n==4)
+    check("get_patient", core.get_patient(pid)[:4]==(pid,"Ayşe",f"Yılmaz{tag}",day))
+    check("find_patient_by_phone", core.find_patient_by_phone(f"+90532{tag[:7]}", day)[0]==pid)
+    tests=core.list_patient_tests(pid)
+    check("list_patient_tests", sorted(t[2] for t in tests)==["EKG","Efor","Göz","Hemogram"] and len(tests[0])==5)
+    cur=core.change_cursor()
+    core.update_patient_test_status(tests[0][0], "tamamlandi")
+    check("changes_since", [(c[1],c[2],c[3]) for c in core.changes_since(cur)]==[(pid,day,core.CHANGE_TESTS)])
+    res=core.set_test_statuses([(tests[0][0],"tamamlandi"), (tests[1][0],"tamamlandi"), (-1,"tamamlandi")])
+    check("set_test_statuses", [r for _,r in res]==[core.BULK_UNCHANGED, core.BULK_UPDATED, core.BULK_MISSING])
+    check("set_day_test_status", core.set_day_test_status(day, tests[2][2])==[(tests[2][0],pid)])
+    check("day_tests", sorted(r[4] for r in core.day_tests(day) if r[1]==pid)==sorted(t[2] for t in tests))
+    core.set_test_statuses([(tests[1][0],"bekliyor"), (tests[2][0],"bekliyor")])
+    core.add_patient_test(pid, "Ek tetkik")
+    core.set_patient_alarm_time(pid, "09:30")
+    rows,done,rem=core.day_summary(day)
+    mine=[r for r in rows if r[0]==pid]
+    check("day_summary", mine and mine[0][3]=="09:30" and mine[0][4]==[tests[0][2]] and len(mine[0][5])==4)
+    check("reminder_rows", any(r[0]==pid and r[4]=="09:30" for r in core.storage().reminder_rows(day, [pid])))
+    check("calendar_rows", any(r[0]==pid and r[4]=="09:30" and r[6] for r in core.storage().calendar_rows(day, day)))
+    core.delete_patient_test(tests[1][0]); check("delete_patient_test", len(core.list_patient_tests(pid))==4)
+    check("list_patients", any(p[0]==pid and len(p)==7 for p in core.list_patients(day)))
+    srows=core.storage().stats_rows(day, day)
+    check("stats_rows", srows and srows[0][0]==day and srows[0][1]>=1 and srows[0][2]>=4)
+    check("test_stats_rows", any(r[0]=="Ek tetkik" and r[1]>=1 for r in core.storage().test_stats_rows(day, day)))
+    lease=f"check_{tag}"; st=core.storage()
+    check("claim_lease", st.claim_lease(lease,"a",60) and not st.claim_lease(lease,"b",60) and st.claim_lease(lease,"a",60)
+          and st.claim_lease(lease,"a",-1) and st.claim_lease(lease,"b",60))
+    check("package_stats_rows", any(r[0]==f"Paket B {tag}" and r[1]>=2 for r in core.storage().package_stats_rows(day, day)))
+    before=[r[:4] for r in srows]
+    check("rebuild_stats", core.rebuild_stats()>=1 and [r[:4] for r in core.storage().stats_rows(day, day)]==before)
+    check("search_patients", any(h[0]==pid and h[3]==day for h in core.search_patients(f"ayse yilmaz{tag}")))
+
+    token=core.table_token(["patients","patient_tests"])
+    csv_bytes=core.export_csv("patients"); check("export_csv", f"Yılmaz{tag}".encode() in csv_bytes)
+    check("export_csv(packages)", f"Paket B {tag}".encode() in core.export_csv("packages", gz=False))
+    core.delete_patient(pid)
+    check("table_token", core.table_token(["patients","patient_tests"])!=token)
+    check("delete_patient", core.get_patient(pid) is None)
+    core.rename_package(k1, f"Paket A2 {tag}"); check("rename_package", (k1,f"Paket A2 {tag}") in core.list_packages())
+    res=core.import_packages_csv(io.BytesIO(f"type,id_or_package_id,name_or_test,ord\npackage,1,Paket B {tag},\n"
+                                           f"item,1,Kan,1\nitem,1,Göz,0\nitem,x{tag},EKG,\n".encode()))
+    k3={n:k for k,n in core.list_packages()}.get(f"x{tag}")
+    check("import_packages", res["created"]==0 and k3 is None and [t[1] for t in core.get_package_tests(k2)]==["Göz","Kan"]
+          and [ln for ln,_ in res["errors"]]==[5])
+    pkgs=[k for k in (k1,k2,k3) if k]
+    for k in pkgs: core.delete_package(k)
+    core.delete_personnel(ppl)
+    check("delete_package", all(p[0] not in pkgs for p in core.list_packages()))
+    return errors
+
+def main()->int:
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp); sys.path.insert(0, HERE)
+        import core
+        store=core.storage()
+        print(f"Arka uç: {type(store).__name__}")
+        errors=[f"eksik yöntem: {n}" for n in missing_methods(core, store)] or scenario(core)
+        for e in errors: print(f"FAIL {e}")
+        print(f"{len(errors)} sorun.")
+        return 1 if errors else 0
+
+if __name__=="__main__":
+    sys.exit(main())
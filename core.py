@@ -0,0 +1,1801 @@
+# core.py
+# Check-up Takip Sistemi — arayüzsüz çekirdek: şema, depolama, hasta/tetkik/paket yardımcıları, dışa aktarım,
+# yedek, outbox, hatırlatma ve takvim. Streamlit'e bağlı değildir; içe aktarmak DB'ye dokunmaz, şema ve günlük
+# temizlik ilk veri erişiminde (storage()/get_conn()) çalışır. Arayüz app.py, webhook/işçiler/betikler bu modülü kullanır.
+import sqlite3, csv, functools, hashlib, io, json, math, os, re, sys, glob, zipfile, gzip, heapq, queue, threading, time, unicodedata
+from datetime import datetime, date, timedelta
+from collections import deque
+from contextlib import closing, contextmanager, nullcontext
+from typing import Protocol
+from urllib.parse import quote_plus
+from zoneinfo import ZoneInfo
+
+# ================== CONFIG ==================
+DB_PATH = "checkup.db"
+TR_TZ = ZoneInfo("Europe/Istanbul")
+
+def now_tr(): return datetime.now(TR_TZ)
+def today_tr_date(): n=now_tr(); return date(n.year, n.month, n.day)
+def to_iso(d:date)->str: return d.strftime("%Y-%m-%d")
+def to_display(d:date)->str: return d.strftime("%d/%m/%Y")
+def now_str()->str: return now_tr().strftime("%Y-%m-%d %H:%M:%S")
+def normalize_phone(p:str)->str:
+    p=(p or "").strip().replace(" ","").replace("-","")
+    if p and not p.startswith("+"): p="+"+p
+    return p
+
+def cache_resource(maxsize:int|None=None):
+    """Süreç geneli önbellek (havuz, depolama, zamanlayıcılar, tek seferlik kurulum). Aynı argümanlar için değer
+    bir kez üretilir; eşzamanlı ilk çağrılar bekler. Modül süreçte bir kez yüklendiğinden rerun'lar aynı değeri görür."""
+    def deco(fn):
+        cached=functools.lru_cache(maxsize)(fn); lock=threading.RLock()
+        @functools.wraps(fn)
+        def wrapper(*args):
+            with lock: return cached(*args)
+        wrapper.clear=cached.cache_clear
+        return wrapper
+    return deco
+
+# ================== DB ==================
+DB_POOL_SIZE = 4           # süreç başına en fazla açık bağlantı
+DB_BUSY_TIMEOUT_MS = 5000  # kilitli DB / dolu havuz için bekleme sınırı
+
+class PooledConn:
+    """Havuzdan alınmış bağlantı; close() bağlantıyı kapatmaz, havuza iade eder."""
+    __slots__=("_conn","_pool")
+    def __init__(self, conn, pool): self._conn=conn; self._pool=pool
+    def __getattr__(self, name): return getattr(self._conn, name)
+    def __enter__(self): self._conn.__enter__(); return self
+    def __exit__(self, *exc): return self._conn.__exit__(*exc)
+    @property
+    def raw(self)->sqlite3.Connection: return self._conn  # backup() hedefi gerçek bağlantı ister
+    def cursor(self):
+        m=self._pool.metrics
+        if m is None: return self._conn.cursor()
+        cur=self._conn.cursor(TimedCursor); cur.metrics=m
+        return cur
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None: self._pool.release(conn)
+
+class ConnPool:
+    """Sınırlı SQLite bağlantı havuzu — PRAGMA'lar bağlantı başına yalnızca bir kez."""
+    def __init__(self, path:str, size:int=DB_POOL_SIZE, busy_timeout_ms:int=DB_BUSY_TIMEOUT_MS, metrics=None):
+        self.path=path; self.size=size; self.busy_timeout_ms=busy_timeout_ms; self.metrics=metrics
+        self._idle=queue.LifoQueue(); self._lock=threading.Lock(); self._opened=0
+        self.stats={"opened":0,"checkouts":0,"waits":0,"wait_ms":0.0,"timeouts":0}
+    def _open(self):
+        conn=sqlite3.connect(self.path, check_same_thread=False, timeout=self.busy_timeout_ms/1000)
+        try:
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error:
+            pass
+        return conn
+    def acquire(self)->PooledConn:
+        try:
+            conn=self._idle.get_nowait()
+        except queue.Empty:
+            conn=None
+            with self._lock:
+                if self._opened<self.size:
+                    self._opened+=1; self.stats["opened"]+=1; opening=True
+                else:
+                    opening=False
+            if opening:
+                try: conn=self._open()
+                except Exception:
+                    with self._lock: self._opened-=1
+                    raise
+            else:
+                # Havuz dolu: iade edilen ilk bağlantıyı bekle
+                t0=time.perf_counter()
+                try:
+                    conn=self._idle.get(timeout=self.busy_timeout_ms/1000)
+                except queue.Empty:
+                    with self._lock: self.stats["timeouts"]+=1
+                    raise sqlite3.OperationalError("Veritabanı bağlantı havuzu dolu (zaman aşımı)")
+                finally:
+                    with self._lock:
+                        self.stats["waits"]+=1
+                        self.stats["wait_ms"]+=(time.perf_counter()-t0)*1000
+        with self._lock: self.stats["checkouts"]+=1
+        return PooledConn(conn, self)
+    def release(self, conn):
+        try:
+            if conn.in_transaction: conn.rollback()
+        except sqlite3.Error:
+            # Bozuk bağlantıyı havuza geri koyma
+            with self._lock: self._opened-=1
+            try: conn.close()
+            except sqlite3.Error: pass
+            return
+        self._idle.put(conn)
+    def snapshot(self)->dict:
+        with self._lock:
+            return {**self.stats, "open":self._opened, "idle":self._idle.qsize(), "size":self.size}
+
+@cache_resource()
+def get_pool(path:str=DB_PATH)->ConnPool:
+    """Süreç genelinde tek havuz."""
+    return ConnPool(path, metrics=get_metrics(path) if METRICS_ENABLED else None)
+
+def get_conn():
+    """Yerel SQLite bağlantısı (havuzdan); ilk çağrıda şema kurulur."""
+    ensure_db(DB_PATH, DATABASE_URL)
+    return get_pool(DB_PATH).acquire()
+
+def db_pool_stats()->dict:
+    return get_pool(DB_PATH).snapshot()
+
+# ================== INSTRUMENTATION ==================
+# İsteğe bağlı ölçüm (CHECKUP_METRICS=1): rerun/fragment süresi, bölüm süreleri, get_conn() üzerinden
+# çalışan her SQL ifadesinin sayısı/süresi ve önbellek isabetleri. Kapalıyken imleçler sarmalanmaz.
+# Panel: ?diag=1 · JSON lines: CHECKUP_METRICS_LOG=dosya · Prometheus (textfile collector): CHECKUP_METRICS_PROM=dosya
+METRICS_ENABLED = os.environ.get("CHECKUP_METRICS","") not in ("","0")
+METRICS_LOG = os.environ.get("CHECKUP_METRICS_LOG","")
+METRICS_PROM = os.environ.get("CHECKUP_METRICS_PROM","")
+METRICS_KEEP = 200                                   # panelde tutulan son çalıştırma sayısı
+METRICS_BUCKETS_S = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class TimedCursor(sqlite3.Cursor):
+    """execute/executemany süresini ölçer (SQLite'ta ilk adım burada; kalan satırlar fetch ile okunur).
+    metrics nesnesi havuzdan gelir: arka plan iş parçacıkları da aynı süreç geneli kayda yazar."""
+    def execute(self, sql, params=()):
+        t0=time.perf_counter()
+        try: return super().execute(sql, params)
+        finally: self.metrics.sql(sql, time.perf_counter()-t0)
+    def executemany(self, sql, seq):
+        t0=time.perf_counter()
+        try: return super().executemany(sql, seq)
+        finally: self.metrics.sql(sql, time.perf_counter()-t0)
+
+class Metrics:
+    """Süreç geneli ölçüm deposu. Etkin çalıştırma kaydı iş parçacığına bağlıdır: her oturumun betiği kendi
+    iş parçacığında çalışır; arka plan iş parçacıklarının SQL'i yalnızca toplamlara yazılır."""
+    def __init__(self, keep:int=METRICS_KEEP):
+        self._lock=threading.Lock(); self._local=threading.local()
+        self.runs=deque(maxlen=keep)
+        self.run_hist={}      # tür → [kova sayıları..., toplam sayı, toplam s]
+        self.sections={}      # bölüm → [sayı, s]
+        self.statements={}    # ifade → [sayı, s]
+        self.caches={}        # önbellek → [isabet, ıska]
+
+    @contextmanager
+    def run(self, kind:str):
+        """Bir rerun ya da fragment çalıştırması; zaten bir çalıştırmanın içindeyse bölüm olarak sayılır."""
+        if getattr(self._local, "cur", None) is not None:
+            with self.section(kind): yield
+            return
+        cur=self._local.cur={"at":now_str(), "kind":kind, "sections":{}, "sql":0, "sql_ms":0.0, "stmts":{}, "cache":{}}
+        t0=time.perf_counter()
+        try: yield
+        finally:
+            self._local.cur=None
+            self._finish(cur, time.perf_counter()-t0)
+
+    @contextmanager
+    def section(self, name:str):
+        t0=time.perf_counter()
+        try: yield
+        finally:
+            dt=time.perf_counter()-t0; cur=getattr(self._local, "cur", None)
+            if cur is not None: cur["sections"][name]=cur["sections"].get(name,0.0)+dt*1000
+            with self._lock:
+                agg=self.sections.setdefault(name,[0,0.0]); agg[0]+=1; agg[1]+=dt
+
+    def sql(self, sql:str, dt:float):
+        stmt=" ".join(sql.split())[:160]
+        cur=getattr(self._local, "cur", None)
+        if cur is not None:
+            cur["sql"]+=1; cur["sql_ms"]+=dt*1000
+            agg=cur["stmts"].setdefault(stmt,[0,0.0]); agg[0]+=1; agg[1]+=dt*1000
+        with self._lock:
+            agg=self.statements.setdefault(stmt,[0,0.0]); agg[0]+=1; agg[1]+=dt
+
+    def cache(self, name:str, hit:bool):
+        cur=getattr(self._local, "cur", None)
+        if cur is not None: cur["cache"].setdefault(name,[0,0])[0 if hit else 1]+=1
+        with self._lock: self.caches.setdefault(name,[0,0])[0 if hit else 1]+=1
+
+    def _finish(self, cur:dict, dt:float):
+        top=sorted(cur.pop("stmts").items(), key=lambda kv:-kv[1][1])[:5]
+        rec={**cur, "wall_ms":round(dt*1000,2), "sql_ms":round(cur["sql_ms"],2),
+             "sections":{k:round(v,2) for k,v in sorted(cur["sections"].items(), key=lambda kv:-kv[1])},
+             "top_sql":[[q,n,round(ms,2)] for q,(n,ms) in top]}
+        with self._lock:
+            self.runs.append(rec)
+            h=self.run_hist.setdefault(cur["kind"].split(":")[0], [0]*(len(METRICS_BUCKETS_S)+2)+[0.0])
+            for i,b in enumerate(METRICS_BUCKETS_S):
+                if dt<=b: h[i]+=1
+            h[-3]+=1; h[-2]+=1; h[-1]+=dt  # +Inf kovası, sayı, toplam
+        if METRICS_LOG:
+            with open(METRICS_LOG, "a", encoding="utf-8") as f: f.write(json.dumps(rec, ensure_ascii=False)+"\n")
+        if METRICS_PROM:
+            tmp=METRICS_PROM+".tmp"
+            with open(tmp, "w", encoding="utf-8") as f: f.write(self.prometheus())
+            os.replace(tmp, METRICS_PROM)  # toplayıcı yarım dosya görmesin
+
+    def jsonl(self)->str:
+        with self._lock: return "".join(json.dumps(r, ensure_ascii=False)+"\n" for r in self.runs)
+
+    def prometheus(self)->str:
+        esc=lambda v: str(v).replace("\\","\\\\").replace('"','\\"')
+        out=["# TYPE checkup_run_seconds histogram"]
+        with self._lock:
+            for kind,h in self.run_hist.items():
+                for b,n in zip(METRICS_BUCKETS_S, h): out.append(f'checkup_run_seconds_bucket{{kind="{kind}",le="{b}"}} {n}')
+                out+= [f'checkup_run_seconds_bucket{{kind="{kind}",le="+Inf"}} {h[-3]}',
+                       f'checkup_run_seconds_count{{kind="{kind}"}} {h[-2]}', f'checkup_run_seconds_sum{{kind="{kind}"}} {h[-1]:.6f}']
+            out.append("# TYPE checkup_section_seconds_total counter")
+            out+=[f'checkup_section_seconds_total{{section="{esc(k)}"}} {v[1]:.6f}' for k,v in self.sections.items()]
+            out.append("# TYPE checkup_section_runs_total counter")
+            out+=[f'checkup_section_runs_total{{section="{esc(k)}"}} {v[0]}' for k,v in self.sections.items()]
+            verbs={}
+            for q,(n,t) in self.statements.items():
+                v=verbs.setdefault(q.split(" ",1)[0].upper(),[0,0.0]); v[0]+=n; v[1]+=t
+            out.append("# TYPE checkup_sql_statements_total counter")
+            out+=[f'checkup_sql_statements_total{{verb="{k}"}} {v[0]}' for k,v in verbs.items()]
+            out.append("# TYPE checkup_sql_seconds_total counter")
+            out+=[f'checkup_sql_seconds_total{{verb="{k}"}} {v[1]:.6f}' for k,v in verbs.items()]
+            out.append("# TYPE checkup_cache_requests_total counter")
+            for k,(hit,miss) in self.caches.items():
+                out+=[f'checkup_cache_requests_total{{cache="{k}",result="hit"}} {hit}',
+                      f'checkup_cache_requests_total{{cache="{k}",result="miss"}} {miss}']
+        out.append("# TYPE checkup_db_pool gauge")
+        out+=[f'checkup_db_pool{{stat="{k}"}} {v}' for k,v in db_pool_stats().items()]
+        return "\n".join(out)+"\n"
+
+@cache_resource()
+def get_metrics(path:str=DB_PATH)->Metrics:
+    return Metrics()
+
+def metrics()->Metrics:
+    return get_metrics(DB_PATH)
+
+def percentile(values, q:float)->float:
+    """En yakın sıra yöntemi (⌈q/100·n⌉. değer); values sıralı olmalı."""
+    if not values: return 0.0
+    n=len(values)
+    return values[max(0, min(n-1, math.ceil(q*n/100)-1))]
+
+def timed(name:str):
+    """Ölçüm açıksa bölüm süresini kaydeden bağlam; kapalıyken boş."""
+    return metrics().section(name) if METRICS_ENABLED else nullcontext()
+
+def timed_run(kind:str):
+    """Fragment gibi kendi başına yeniden çalışan fonksiyonlar için: çalıştırma kaydı (tam rerun içindeyse bölüm)."""
+    def deco(fn):
+        if not METRICS_ENABLED: return fn
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            with metrics().run(kind): return fn(*a, **kw)
+        return wrapper
+    return deco
+
+def column_exists(conn,t,c)->bool:
+    with closing(conn.cursor()) as cur:
+        cur.execute(f"PRAGMA table_info({t})")
+        return any(r[1]==c for r in cur.fetchall())
+
+# Şema göçleri: (sürüm, adım). Her adım yalnızca bir kez çalışır; sürüm app_settings'te tutulur.
+# Sürümsüz eski kurulumlar 0'dan başlar, bu yüzden adımlar mevcut tablo/sütunlara toleranslıdır.
+def _mig_base_tables(conn, c):
+    c.execute("""CREATE TABLE IF NOT EXISTS personnel(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL, phone TEXT NOT NULL UNIQUE,
+        active INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')))""")
+    c.execute("""CREATE TABLE IF NOT EXISTS patients(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT NOT NULL, last_name TEXT NOT NULL,
+        age INTEGER, gender TEXT,
+        visit_date TEXT NOT NULL,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')))""")
+    c.execute("""CREATE TABLE IF NOT EXISTS patient_tests(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER NOT NULL,
+        test_name TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'bekliyor',
+        updated_at TEXT NOT NULL DEFAULT (datetime('now')),
+        FOREIGN KEY(patient_id) REFERENCES patients(id))""")
+    c.execute("""CREATE TABLE IF NOT EXISTS packages(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')))""")
+    c.execute("""CREATE TABLE IF NOT EXISTS package_tests(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        package_id INTEGER NOT NULL,
+        test_name TEXT NOT NULL,
+        ord INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY(package_id) REFERENCES packages(id))""")
+
+def _mig_patient_columns(conn, c):
+    if not column_exists(conn,"patients","department"):
+        c.execute("ALTER TABLE patients ADD COLUMN department TEXT")
+        c.execute("UPDATE patients SET department='Genel' WHERE department IS NULL")
+    if not column_exists(conn,"patients","visit_time"):
+        c.execute("ALTER TABLE patients ADD COLUMN visit_time TEXT")
+    c.execute("UPDATE patients SET created_at = COALESCE(created_at, datetime('now')) WHERE created_at IS NULL")
+
+def _migrate_patient_tests_if_needed(conn, cur):
+    if not column_exists(conn,"patient_tests","status"):
+        cur.execute("ALTER TABLE patient_tests ADD COLUMN status TEXT NOT NULL DEFAULT 'bekliyor'")
+    if not column_exists(conn,"patient_tests","updated_at"):
+        cur.execute("ALTER TABLE patient_tests ADD COLUMN updated_at TEXT")
+        cur.execute("UPDATE patient_tests SET updated_at = COALESCE(updated_at, datetime('now'))")
+
+def _mig_patient_test_columns(conn, c):
+    _migrate_patient_tests_if_needed(conn, c)
+
+def _mig_hot_indexes(conn, c):
+    # Gün listesi: WHERE visit_date=? ORDER BY last_name,first_name — kapsayan indeks
+    # (visit_date öneki cleanup'taki visit_date < ? aramasına da hizmet eder)
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_patients_day
+                 ON patients(visit_date,last_name,first_name,age,gender,department,visit_time)""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_patient_tests_patient ON patient_tests(patient_id,updated_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_package_tests_pkg ON package_tests(package_id,ord)")
+
+# Tablo başına değişiklik sayacı: dışa aktarım önbelleği bu jetonla geçersizleşir
+VERSIONED_TABLES = ("patients","patient_tests","personnel","packages","package_tests")
+def _add_version_triggers(c, tables):
+    for t in tables:
+        c.execute("INSERT OR IGNORE INTO table_versions(name,version) VALUES(?,0)", (t,))
+        for op in ("INSERT","UPDATE","DELETE"):
+            c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{t}_{op.lower()}_ver AFTER {op} ON {t}
+                          BEGIN UPDATE table_versions SET version=version+1 WHERE name='{t}'; END""")
+
+def _mig_table_versions(conn, c):
+    c.execute("CREATE TABLE IF NOT EXISTS table_versions(name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+    _add_version_triggers(c, VERSIONED_TABLES)
+
+# Arşiv: geçmiş günler silinmek yerine buraya taşınır (id'ler korunur, AUTOINCREMENT tekrar etmez).
+# visit_date önekli indeks ay aralıklarını bitişik tutar; gün/ay sorguları indeksten okunur.
+def _mig_archive_tables(conn, c):
+    c.execute("""CREATE TABLE IF NOT EXISTS archive_patients(
+        id INTEGER PRIMARY KEY,
+        first_name TEXT NOT NULL, last_name TEXT NOT NULL,
+        age INTEGER, gender TEXT, department TEXT,
+        visit_date TEXT NOT NULL, visit_time TEXT,
+        created_at TEXT, archived_at TEXT NOT NULL)""")
+    c.execute("""CREATE TABLE IF NOT EXISTS archive_patient_tests(
+        id INTEGER PRIMARY KEY,
+        patient_id INTEGER NOT NULL,
+        test_name TEXT NOT NULL, status TEXT NOT NULL, updated_at TEXT)""")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_archive_patients_day
+                 ON archive_patients(visit_date,last_name,first_name,age,gender,department,visit_time)""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archive_patient_tests_patient ON archive_patient_tests(patient_id,updated_at)")
+    _add_version_triggers(c, ("archive_patients","archive_patient_tests"))
+
+def _mig_patient_phone(conn, c):
+    # WhatsApp webhook'u hastayı gönderen numaradan bulur
+    for t in ("patients","archive_patients"):
+        if not column_exists(conn,t,"phone"): c.execute(f"ALTER TABLE {t} ADD COLUMN phone TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_patients_phone ON patients(phone,visit_date)")
+
+# Giden WhatsApp kuyruğu (outbox.py işler). coalesce_key başına en fazla bir 'pending' satır:
+# aynı hasta/alıcı için art arda gelen durum değişiklikleri tek mesajda birleşir.
+def _mig_outbox(conn, c):
+    c.execute("""CREATE TABLE IF NOT EXISTS outbox(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipient TEXT NOT NULL, body TEXT NOT NULL,
+        patient_id INTEGER, coalesce_key TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        claimed_at REAL, last_error TEXT, provider_id TEXT,
+        created_at TEXT NOT NULL, updated_at TEXT NOT NULL, sent_at TEXT)""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status,next_attempt_at)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_coalesce ON outbox(coalesce_key) WHERE status='pending'")
+
+# Hatırlatma zamanlayıcısı yalnızca saati olan hastaları okur: (gün, saat) kısmi indeksi
+def _mig_alarm_index(conn, c):
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_patients_alarm
+                 ON patients(visit_date,visit_time) WHERE visit_time IS NOT NULL""")
+
+# Değişiklik akışı: yazan yardımcılar hasta başına bir satır ekler; oturumlar seq imleciyle yoklar
+def _mig_change_log(conn, c):
+    c.execute("""CREATE TABLE IF NOT EXISTS change_log(
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER, visit_date TEXT, kind TEXT NOT NULL, at TEXT NOT NULL)""")
+
+# Hasta araması: tüm günler + arşiv için FTS5 dizini (rowid = hasta id; arşive taşınırken id korunur).
+# unicode61 büyük/küçük harfi ve ş/ğ/ü/ö/ç/İ aksanlarını katlar; yalnızca ı ayrışmadığından tetikleyicide i yapılır.
+# Tetikleyiciler yalnızca ad/gün ve tetkik değişince çalışır — sık yapılan durum güncellemeleri dizine dokunmaz.
+# key: tetkiğin satırdaki sütunu — 13. göçe kadar test_name, sonrasında tests kataloğuna test_id.
+_SEARCH_FOLD = "replace({x},'ı','i')"
+def _search_tests_sql(t:str, pid:str, key:str)->str:
+    name,join=("x.test_name","") if key=="test_name" else ("n.name","JOIN tests n ON n.id=x.test_id")
+    return ("(SELECT "+_SEARCH_FOLD.format(x=f"COALESCE(GROUP_CONCAT({name},' '),'')")
+            +f" FROM {t} x {join} WHERE x.patient_id={pid})")
+def _patient_search_triggers(c, key:str):
+    for op in ("insert","delete","upd"): c.execute(f"DROP TRIGGER IF EXISTS trg_patient_tests_search_{op}")
+    for op,r in (("INSERT","new"),("DELETE","old")):
+        c.execute(f"""CREATE TRIGGER trg_patient_tests_search_{op.lower()} AFTER {op} ON patient_tests BEGIN
+            UPDATE patient_search SET tests={_search_tests_sql("patient_tests", f"{r}.patient_id", key)}
+            WHERE rowid={r}.patient_id AND archived=0; END""")
+    c.execute(f"""CREATE TRIGGER trg_patient_tests_search_upd AFTER UPDATE OF {key},patient_id ON patient_tests BEGIN
+        UPDATE patient_search SET tests={_search_tests_sql("patient_tests", "old.patient_id", key)}
+        WHERE rowid=old.patient_id AND archived=0;
+        UPDATE patient_search SET tests={_search_tests_sql("patient_tests", "new.patient_id", key)}
+        WHERE rowid=new.patient_id AND archived=0; END""")
+    # Mevcut kayıtlar (sürüm yükseltme / eski yedekten geri yükleme)
+    name=_SEARCH_FOLD.format(x="p.first_name||' '||p.last_name")
+    c.execute("DELETE FROM patient_search")
+    for t,tt,arch,where in (("patients","patient_tests",0,"WHERE p.id NOT IN (SELECT id FROM archive_patients)"),
+                            ("archive_patients","archive_patient_tests",1,"")):
+        c.execute(f"""INSERT INTO patient_search(rowid,name,tests,visit_date,archived)
+                      SELECT p.id,{name},{_search_tests_sql(tt, "p.id", key)},p.visit_date,{arch} FROM {t} p {where}""")
+def _mig_patient_search(conn, c):
+    c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS patient_search USING fts5(
+        name, tests, visit_date UNINDEXED, archived UNINDEXED,
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+    name=lambda r: _SEARCH_FOLD.format(x=f"{r}.first_name||' '||{r}.last_name")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_patients_search_ins AFTER INSERT ON patients BEGIN
+        INSERT INTO patient_search(rowid,name,tests,visit_date,archived) VALUES(new.id,{name('new')},'',new.visit_date,0); END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_patients_search_upd AFTER UPDATE OF first_name,last_name,visit_date ON patients BEGIN
+        UPDATE patient_search SET name={name('new')},visit_date=new.visit_date WHERE rowid=new.id AND archived=0; END""")
+    # Temizlik önce arşive kopyalar, sonra siler: arşivdeki satır (archived=1) silmeden etkilenmez
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_patients_search_del AFTER DELETE ON patients BEGIN
+        DELETE FROM patient_search WHERE rowid=old.id AND archived=0; END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_archive_patients_search_ins AFTER INSERT ON archive_patients BEGIN
+        UPDATE patient_search SET archived=1 WHERE rowid=new.id; END""")
+    _patient_search_triggers(c, "test_name")
+
+# Pano istatistikleri: gün ve (gün, tetkik) başına önceden toplanmış sayılar; tetikleyicilerle artımlı güncellenir.
+# done_min: tamamlanan tetkiklerde hasta kaydından (created_at) son güncellemeye (updated_at) geçen dakikaların toplamı.
+# Temizlik hastaları arşive taşırken/silerken geçmiş korunur: işlem boyunca app_settings'te stats_hold satırı durur.
+STATS_HOLD_KEY = "stats_hold"
+_STATS_ACTIVE = f"NOT EXISTS (SELECT 1 FROM app_settings WHERE key='{STATS_HOLD_KEY}')"
+_STATS_DONE_MIN = "CASE WHEN {t}.status='tamamlandi' THEN (julianday({t}.updated_at)-julianday(p.created_at))*1440 ELSE 0 END"
+_STATS_ADD = "tests=tests+excluded.tests,done=done+excluded.done,done_min=done_min+excluded.done_min"
+def _stats_upserts(r:str, sign:int, key:str)->str:
+    vals=f"{sign},{sign}*({r}.status='tamamlandi'),{sign}*{_STATS_DONE_MIN.format(t=r)}"
+    return f"""
+        INSERT INTO daily_stats(visit_date,tests,done,done_min)
+            SELECT p.visit_date,{vals} FROM patients p WHERE p.id={r}.patient_id
+            ON CONFLICT(visit_date) DO UPDATE SET {_STATS_ADD};
+        INSERT INTO test_stats(visit_date,{key},tests,done,done_min)
+            SELECT p.visit_date,{r}.{key},{vals} FROM patients p WHERE p.id={r}.patient_id
+            ON CONFLICT(visit_date,{key}) DO UPDATE SET {_STATS_ADD};"""
+# Tam yeniden hesap (canlı + arşiv); tetikleyicilerden kayma olursa ya da "sil" modunda geçmiş istenirse
+def _rebuild_stats_sql(key:str)->list[str]:
+    return ["DELETE FROM daily_stats", "DELETE FROM test_stats",
+        *[stmt for p,t in (("patients","patient_tests"),("archive_patients","archive_patient_tests")) for stmt in (
+            f"""INSERT INTO daily_stats(visit_date,patients) SELECT visit_date,COUNT(*) FROM {p} WHERE true GROUP BY visit_date
+                ON CONFLICT(visit_date) DO UPDATE SET patients=patients+excluded.patients""",
+            f"""INSERT INTO test_stats(visit_date,{key},tests,done,done_min)
+                SELECT p.visit_date,t.{key},COUNT(*),SUM(t.status='tamamlandi'),SUM({_STATS_DONE_MIN.format(t="t")})
+                FROM {p} p JOIN {t} t ON t.patient_id=p.id WHERE true GROUP BY p.visit_date,t.{key}
+                ON CONFLICT(visit_date,{key}) DO UPDATE SET {_STATS_ADD}""")],
+        """UPDATE daily_stats SET (tests,done,done_min)=(SELECT COALESCE(SUM(tests),0),COALESCE(SUM(done),0),COALESCE(SUM(done_min),0)
+                                                         FROM test_stats s WHERE s.visit_date=daily_stats.visit_date)"""]
+def _stats_triggers(c, key:str):
+    for op in ("insert","delete","update"): c.execute(f"DROP TRIGGER IF EXISTS trg_patient_tests_stats_{op}")
+    c.execute(f"""CREATE TRIGGER trg_patient_tests_stats_insert AFTER INSERT ON patient_tests
+        WHEN {_STATS_ACTIVE} BEGIN {_stats_upserts("new", 1, key)} END""")
+    c.execute(f"""CREATE TRIGGER trg_patient_tests_stats_delete AFTER DELETE ON patient_tests
+        WHEN {_STATS_ACTIVE} BEGIN {_stats_upserts("old", -1, key)} END""")
+    c.execute(f"""CREATE TRIGGER trg_patient_tests_stats_update
+        AFTER UPDATE OF patient_id,{key},status,updated_at ON patient_tests
+        WHEN {_STATS_ACTIVE} BEGIN {_stats_upserts("old", -1, key)} {_stats_upserts("new", 1, key)} END""")
+    for stmt in _rebuild_stats_sql(key): c.execute(stmt)
+def _mig_stats(conn, c):
+    c.execute("""CREATE TABLE IF NOT EXISTS daily_stats(
+        visit_date TEXT PRIMARY KEY,
+        patients INTEGER NOT NULL DEFAULT 0, tests INTEGER NOT NULL DEFAULT 0,
+        done INTEGER NOT NULL DEFAULT 0, done_min REAL NOT NULL DEFAULT 0)""")
+    c.execute("""CREATE TABLE IF NOT EXISTS test_stats(
+        visit_date TEXT NOT NULL, test_name TEXT NOT NULL,
+        tests INTEGER NOT NULL DEFAULT 0, done INTEGER NOT NULL DEFAULT 0, done_min REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY(visit_date,test_name))""")
+    for op,sign,r in (("INSERT",1,"new"),("DELETE",-1,"old")):
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_patients_stats_{op.lower()} AFTER {op} ON patients WHEN {_STATS_ACTIVE} BEGIN
+            INSERT INTO daily_stats(visit_date,patients) VALUES({r}.visit_date,{sign})
+            ON CONFLICT(visit_date) DO UPDATE SET patients=patients+excluded.patients; END""")
+    _stats_triggers(c, "test_name")
+
+# Tetkik kataloğu: her tetkik adı bir kez (norm = boşlukları sadeleştirilmiş, casefold edilmiş ad; ilk yazılış görünen ad).
+# ı/I/İ aramadaki gibi i'ye katlanır: casefold("İ") birleşik nokta bırakır, "İdrar" ile "idrar" ayrı kalırdı.
+_I_FOLD = str.maketrans("ıIİ","iii")
+# Paket ve hasta tetkikleri test_id tutar: paket uygulama id kopyasıdır, gruplama/özet tamsayı üzerinden yürür.
+def test_key(name:str)->str: return " ".join((name or "").split()).translate(_I_FOLD).casefold()
+UNNAMED_TEST = "(adsız tetkik)"  # 13. göçte adı boş/yalnız boşluk olan eski satırların bağlandığı katalog kaydı
+def _mig_test_catalog(conn, c):
+    c.execute("""CREATE TABLE IF NOT EXISTS tests(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL, norm TEXT NOT NULL UNIQUE)""")
+    # Eski adlar → katalog: paket sırası, sonra hasta ve arşiv tetkikleri; ilk görülen yazılış kalır.
+    # Boş adlar düşürülmez (JOIN dışında kalıp silinirlerdi), UNNAMED_TEST kaydına bağlanır.
+    names={}
+    for sql in ("SELECT test_name FROM package_tests ORDER BY package_id,ord,id",
+                "SELECT DISTINCT test_name FROM patient_tests", "SELECT DISTINCT test_name FROM archive_patient_tests"):
+        c.execute(sql)
+        for (n,) in c.fetchall(): names.setdefault(n, test_key(n) or test_key(UNNAMED_TEST))
+    c.executemany("INSERT INTO tests(name,norm) VALUES(?,?) ON CONFLICT(norm) DO NOTHING",
+                  [(" ".join(n.split()) or UNNAMED_TEST, k) for n,k in names.items()])
+    c.execute("CREATE TEMP TABLE test_name_map(name TEXT PRIMARY KEY, test_id INTEGER NOT NULL)")
+    c.executemany("INSERT INTO test_name_map(name,test_id) SELECT ?,id FROM tests WHERE norm=?", list(names.items()))
+    # Tablolar yeniden kurulur (test_name sütunu ve ona bağlı tetikleyiciler düşer); id'ler korunur
+    c.execute("""CREATE TABLE patient_tests_new(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER NOT NULL,
+        test_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'bekliyor',
+        updated_at TEXT NOT NULL DEFAULT (datetime('now')),
+        FOREIGN KEY(patient_id) REFERENCES patients(id),
+        FOREIGN KEY(test_id) REFERENCES tests(id))""")
+    c.execute("""CREATE TABLE package_tests_new(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        package_id INTEGER NOT NULL,
+        test_id INTEGER NOT NULL,
+        ord INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY(package_id) REFERENCES packages(id),
+        FOREIGN KEY(test_id) REFERENCES tests(id))""")
+    c.execute("""CREATE TABLE archive_patient_tests_new(
+        id INTEGER PRIMARY KEY,
+        patient_id INTEGER NOT NULL,
+        test_id INTEGER NOT NULL, status TEXT NOT NULL, updated_at TEXT)""")
+    for t,cols in (("patient_tests","patient_id,{k},status,updated_at"), ("package_tests","package_id,{k},ord"),
+                   ("archive_patient_tests","patient_id,{k},status,updated_at")):
+        c.execute(f"""INSERT INTO {t}_new(id,{cols.format(k='test_id')})
+                      SELECT t.id,{cols.format(k='m.test_id')}
+                      FROM {t} t JOIN test_name_map m ON m.name=t.test_name""")
+        c.execute(f"DROP TABLE {t}")
+        c.execute(f"ALTER TABLE {t}_new RENAME TO {t}")
+    c.execute("DROP TABLE test_name_map")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_patient_tests_patient ON patient_tests(patient_id,updated_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_package_tests_pkg ON package_tests(package_id,ord)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archive_patient_tests_patient ON archive_patient_tests(patient_id,updated_at)")
+    _add_version_triggers(c, ("patient_tests","package_tests","archive_patient_tests","tests"))
+    c.execute("""UPDATE table_versions SET version=version+1
+                 WHERE name IN ('patient_tests','package_tests','archive_patient_tests')""")  # önbellekteki dökümler eskidi
+    c.execute("DROP TABLE test_stats")
+    c.execute("""CREATE TABLE test_stats(
+        visit_date TEXT NOT NULL, test_id INTEGER NOT NULL,
+        tests INTEGER NOT NULL DEFAULT 0, done INTEGER NOT NULL DEFAULT 0, done_min REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY(visit_date,test_id))""")
+    _stats_triggers(c, "test_id")
+    _patient_search_triggers(c, "test_id")
+SQL_REBUILD_STATS = _rebuild_stats_sql("test_id")
+
+def _mig_package_stats_index(conn, c):
+    # Pano paket özeti test_stats aralığından paket tetkiklerine test_id ile iner
+    c.execute("CREATE INDEX IF NOT EXISTS idx_package_tests_test ON package_tests(test_id,package_id)")
+
+# Süreçler arası sahiplik: tek sürecin çalıştırması gereken işler (hatırlatma) süreli kira tutar.
+# app_settings yerine ayrı tablo: yenileme her birkaç saniyede bir olur, ayar önbelleğini geçersiz kılmamalı.
+def _mig_leases(conn, c):
+    c.execute("""CREATE TABLE IF NOT EXISTS leases(
+        name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)""")
+
+# Randevu sürümü: saat değişince updated_at/rev ilerler; takvim akışında DTSTAMP ve SEQUENCE bunlardan gelir
+def _mig_patient_rev(conn, c):
+    if not column_exists(conn,"patients","updated_at"): c.execute("ALTER TABLE patients ADD COLUMN updated_at TEXT")
+    if not column_exists(conn,"patients","rev"): c.execute("ALTER TABLE patients ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+
+MIGRATIONS = [
+    (1, _mig_base_tables),
+    (2, _mig_patient_columns),
+    (3, _mig_patient_test_columns),
+    (4, _mig_hot_indexes),
+    (5, _mig_table_versions),
+    (6, _mig_archive_tables),
+    (7, _mig_patient_phone),
+    (8, _mig_outbox),
+    (9, _mig_alarm_index),
+    (10, _mig_change_log),
+    (11, _mig_patient_search),
+    (12, _mig_stats),
+    (13, _mig_test_catalog),
+    (14, _mig_package_stats_index),
+    (15, _mig_leases),
+    (16, _mig_patient_rev),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(c)->int:
+    c.execute("SELECT val FROM app_settings WHERE key='schema_version'")
+    r=c.fetchone()
+    return int(r[0]) if r else 0
+
+def init_db()->int:
+    """Eksik göç adımlarını sırayla uygular; güncel şemada yalnızca sürüm okunur."""
+    with closing(get_pool(DB_PATH).acquire()) as conn, conn, closing(conn.cursor()) as c:
+        c.execute("CREATE TABLE IF NOT EXISTS app_settings(key TEXT PRIMARY KEY, val TEXT)")
+        if get_schema_version(c)>=SCHEMA_VERSION: return SCHEMA_VERSION
+        c.execute("BEGIN IMMEDIATE")  # başka süreç aynı anda göç etmesin
+        ver=get_schema_version(c)
+        for v,step in MIGRATIONS:
+            if v>ver:
+                step(conn,c)
+                c.execute("""INSERT INTO app_settings(key,val) VALUES('schema_version',?)
+                             ON CONFLICT(key) DO UPDATE SET val=excluded.val""",(str(v),))
+        return SCHEMA_VERSION
+
+HISTORY_MODES = {"archive":"Arşivle (salt okunur geçmiş)", "delete":"Sil (geçmiş tutulmaz)"}
+SQL_CLEANUP_TESTS = "DELETE FROM patient_tests WHERE patient_id IN (SELECT id FROM patients WHERE visit_date < ?)"
+
+# ================== REFERENCE CACHE ==================
+REF_CACHE_TTL_S = 60  # başka süreçlerin yazdıkları en geç bu kadar sonra görünür
+
+class RefCache:
+    """Ayarlar, paketler ve personel için süreç geneli önbellek.
+    Anahtarlar (grup, ...) biçiminde; değiştiren yardımcılar ilgili grubu geçersiz kılar."""
+    def __init__(self, ttl_s:float=REF_CACHE_TTL_S, metrics=None):
+        self.ttl_s=ttl_s; self._data={}; self._lock=threading.Lock(); self.metrics=metrics
+        self.stats={"hits":0,"misses":0,"invalidations":0}
+    def get(self, key:tuple, loader):
+        now=time.monotonic()
+        with self._lock:
+            hit=self._data.get(key)
+            fresh=bool(hit) and hit[0]>now
+            self.stats["hits" if fresh else "misses"]+=1
+        if self.metrics: self.metrics.cache("ref", fresh)
+        if fresh: return hit[1]
+        val=loader()
+        with self._lock: self._data[key]=(now+self.ttl_s, val)
+        return val
+    def invalidate(self, *groups:str):
+        with self._lock:
+            for k in [k for k in self._data if k[0] in groups]: del self._data[k]
+            self.stats["invalidations"]+=1
+    def clear(self):
+        with self._lock: self._data.clear()
+    def snapshot(self)->dict:
+        with self._lock: return {**self.stats, "entries":len(self._data), "ttl_s":self.ttl_s}
+
+@cache_resource()
+def get_ref_cache(path:str=DB_PATH)->RefCache:
+    return RefCache(metrics=get_metrics(path) if METRICS_ENABLED else None)
+
+def ref_cache()->RefCache:
+    return get_ref_cache(DB_PATH)
+
+# ================== STORAGE ==================
+# Hasta/tetkik/paket/personel/ayar verisi tek arayüzden okunur ve yazılır.
+# DATABASE_URL=postgresql://… verilirse PostgreSQL (pg_storage.py; birden çok Streamlit kopyası aynı DB'yi paylaşır),
+# yoksa yerel checkup.db. Outbox kuyruğu, yedek/geri yükleme ve sorgu planı kontrolü her durumda yerel SQLite'tadır.
+DATABASE_URL = os.environ.get("DATABASE_URL","")
+
+class Storage(Protocol):
+    """Satırlar tuple; tarihler 'YYYY-MM-DD', saatler 'HH:MM', zaman damgaları 'YYYY-MM-DD HH:MM:SS' metni."""
+    def init_schema(self)->int: ...
+    def cleanup_old_patients(self, force:bool=False)->int: ...
+    def load_setting(self, key:str)->str|None: ...
+    def set_setting(self, key:str, val:str)->None: ...
+    def claim_lease(self, name:str, owner:str, ttl_s:float)->bool: ...
+    def list_personnel(self, active_only:bool)->list[tuple]: ...
+    def upsert_personnel(self, name:str, phone:str, active:int)->int: ...
+    def set_personnel_active(self, pid:int, active:int)->None: ...
+    def delete_personnel(self, pid:int)->None: ...
+    def admit_patient(self, fn, ln, age, gender, visit_date_iso, package_ids=(), phone=None)->tuple[int,int]: ...
+    def get_patient(self, pid:int)->tuple|None: ...
+    def delete_patient(self, pid:int)->None: ...
+    def set_patient_alarm_time(self, pid:int, hhmm:str|None)->None: ...
+    def list_patients(self, visit_date_iso:str|None, archived:bool=False)->list[tuple]: ...
+    def find_patient_by_phone(self, phone:str, visit_date_iso:str)->tuple|None: ...
+    def add_patient_test(self, pid:int, test_name:str)->None: ...
+    def list_patient_tests(self, pid:int, archived:bool=False)->list[tuple]: ...
+    def update_patient_test_status(self, tid:int, status:str)->int|None: ...
+    def delete_patient_test(self, tid:int)->int|None: ...
+    def set_test_statuses(self, changes:list[tuple[int,str]])->list[tuple]: ...
+    def set_day_test_status(self, visit_date_iso:str, test_name:str, status:str)->list[tuple[int,int]]: ...
+    def day_tests(self, visit_date_iso:str)->list[tuple]: ...
+    def day_summary_rows(self, visit_date_iso:str, archived:bool=False)->list[tuple]: ...
+    def reminder_rows(self, from_iso:str|None=None, pids=None)->list[tuple]: ...
+    def calendar_rows(self, from_iso:str, to_iso:str)->list[tuple]: ...
+    def search_patients(self, terms:list[str], limit:int)->list[tuple]: ...
+    def stats_rows(self, from_iso:str, to_iso:str)->list[tuple]: ...
+    def test_stats_rows(self, from_iso:str, to_iso:str)->list[tuple]: ...
+    def package_stats_rows(self, from_iso:str, to_iso:str)->list[tuple]: ...
+    def rebuild_stats(self)->int: ...
+    def archive_months(self)->list[tuple[str,int]]: ...
+    def change_cursor(self)->int: ...
+    def changes_since(self, seq:int, limit:int=500)->list[tuple]: ...
+    def list_packages(self)->list[tuple]: ...
+    def get_package_tests(self, pkg_id:int)->list[tuple]: ...
+    def create_package(self, name:str, tests:list[str])->int: ...
+    def rename_package(self, pkg_id:int, new_name:str)->None: ...
+    def add_test_to_package(self, pkg_id:int, test_name:str, ord_hint:int|None=None)->None: ...
+    def delete_test_from_package(self, pt_id:int)->None: ...
+    def delete_package(self, pkg_id:int)->None: ...
+    def apply_packages_to_patient(self, package_ids, patient_id:int)->int: ...
+    def import_packages(self, catalog:list[tuple[str,list[str]|None]])->dict[str,int]: ...
+    def table_token(self, tables)->tuple: ...
+    def export_chunks(self, sql:str): ...  # önce sütun adları, sonra satır parçaları
+
+class SqliteStorage:
+    """Yerel checkup.db (ConnPool). Şema MIGRATIONS ile yönetilir."""
+    def __init__(self, pool:ConnPool): self.pool=pool
+    def _conn(self): return self.pool.acquire()
+
+    def init_schema(self)->int: return init_db()
+
+    def cleanup_old_patients(self, force:bool=False)->int:
+        today_iso = to_iso(today_tr_date())
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            if not force:
+                c.execute("SELECT val FROM app_settings WHERE key='last_cleanup_date'")
+                r=c.fetchone()
+                if r and r[0]>=today_iso: return 0
+            c.execute("INSERT OR IGNORE INTO app_settings(key,val) VALUES(?,'1')", (STATS_HOLD_KEY,))  # geçmiş istatistik kalsın
+            c.execute("SELECT val FROM app_settings WHERE key='history_mode'")
+            r=c.fetchone()
+            if (r[0] if r else "archive")=="archive":
+                # INSERT OR IGNORE: yarıda kalmış bir taşıma tekrar çalışırsa çift kayıt oluşmaz
+                c.execute("""INSERT OR IGNORE INTO archive_patients(id,first_name,last_name,age,gender,department,
+                                 visit_date,visit_time,created_at,phone,archived_at)
+                             SELECT id,first_name,last_name,age,gender,department,visit_date,visit_time,created_at,phone,?
+                             FROM patients WHERE visit_date < ?""", (now_str(), today_iso))
+                c.execute("""INSERT OR IGNORE INTO archive_patient_tests(id,patient_id,test_id,status,updated_at)
+                             SELECT t.id,t.patient_id,t.test_id,t.status,t.updated_at
+                             FROM patients p JOIN patient_tests t ON t.patient_id=p.id WHERE p.visit_date < ?""", (today_iso,))
+            c.execute(SQL_CLEANUP_TESTS, (today_iso,))
+            c.execute("DELETE FROM patients WHERE visit_date < ?", (today_iso,))
+            moved=c.rowcount
+            c.execute("DELETE FROM app_settings WHERE key=?", (STATS_HOLD_KEY,))
+            c.execute("DELETE FROM change_log WHERE at < ?", (today_iso,))
+            c.execute("""INSERT INTO app_settings(key,val) VALUES('last_cleanup_date',?)
+                         ON CONFLICT(key) DO UPDATE SET val=excluded.val""",(today_iso,))
+            return moved
+
+    # -------- ayarlar / personel --------
+    def load_setting(self, key):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute("SELECT val FROM app_settings WHERE key=?", (key,))
+            r=c.fetchone()
+            return r[0] if r else None
+    def set_setting(self, key, val):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("""INSERT INTO app_settings(key,val) VALUES(?,?)
+                         ON CONFLICT(key) DO UPDATE SET val=excluded.val""",(key,val))
+    def claim_lease(self, name, owner, ttl_s):
+        now=time.time()
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute(SQL_CLAIM_LEASE, (name, owner, now+ttl_s, now))
+            return c.rowcount==1
+    def list_personnel(self, active_only):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            q="SELECT id,name,phone,active FROM personnel"
+            if active_only: q+=" WHERE active=1"
+            q+=" ORDER BY name"
+            c.execute(q); return c.fetchall()
+    def upsert_personnel(self, name, phone, active):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("SELECT id FROM personnel WHERE phone=?", (phone,))
+            r=c.fetchone()
+            if r:
+                c.execute("UPDATE personnel SET name=?,active=? WHERE id=?",(name,active,r[0]))
+                return r[0]
+            c.execute("INSERT INTO personnel(name,phone,active) VALUES(?,?,?)",(name,phone,active))
+            return c.lastrowid
+    def set_personnel_active(self, pid, active):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("UPDATE personnel SET active=? WHERE id=?", (active,pid))
+    def delete_personnel(self, pid):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("DELETE FROM personnel WHERE id=?", (pid,))
+
+    # -------- hastalar / tetkikler --------
+    @staticmethod
+    def _log_change(c, pid, kind:str):
+        SqliteStorage._log_changes(c, [pid], kind)
+    @staticmethod
+    def _log_changes(c, pids, kind:str):
+        now=now_str()
+        c.executemany("""INSERT INTO change_log(patient_id,visit_date,kind,at)
+                         VALUES(?,(SELECT visit_date FROM patients WHERE id=?),?,?)""", [(p,p,kind,now) for p in pids])
+    def admit_patient(self, fn, ln, age, gender, visit_date_iso, package_ids=(), phone=None):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("""
+                INSERT INTO patients(
+                    first_name,last_name,age,gender,visit_date,
+                    department,visit_time,created_at,phone
+                ) VALUES (?,?,?,?,?,?,?,?,?)
+            """, (fn.strip(), ln.strip(), age, gender,
+                  visit_date_iso, "Genel", None, now_str(), normalize_phone(phone) or None))
+            pid=c.lastrowid
+            self._log_change(c, pid, CHANGE_PATIENT)
+            return pid, self._insert_package_tests(c, pid, package_ids)
+    def get_patient(self, pid):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_PATIENT, (pid,)); return c.fetchone()
+    def delete_patient(self, pid):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            self._log_change(c, pid, CHANGE_PATIENT)
+            c.execute("DELETE FROM patient_tests WHERE patient_id=?", (pid,))
+            c.execute("DELETE FROM patients WHERE id=?", (pid,))
+    def set_patient_alarm_time(self, pid, hhmm):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("UPDATE patients SET visit_time=?,updated_at=?,rev=rev+1 WHERE id=? AND visit_time IS NOT ?",
+                      (hhmm,now_str(),pid,hhmm))
+            self._log_change(c, pid, CHANGE_PATIENT)
+    def list_patients(self, visit_date_iso, archived=False):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            if visit_date_iso:
+                c.execute(SQL_ARCHIVE_DAY_PATIENTS if archived else SQL_DAY_PATIENTS,(visit_date_iso,))
+            else:
+                c.execute("""SELECT id,first_name,last_name,age,gender,department,visit_time
+                             FROM patients ORDER BY visit_date DESC,last_name""")
+            return c.fetchall()
+    def find_patient_by_phone(self, phone, visit_date_iso):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_PATIENT_BY_PHONE,(phone,visit_date_iso))
+            return c.fetchone()
+    @staticmethod
+    def _test_ids(c, names)->dict[str,int]:
+        """Adları katalog id'lerine çevirir; yeni adlar kataloğa eklenir. {verilen ad: test id}"""
+        keys={n:test_key(n) for n in names if test_key(n)}
+        c.executemany("INSERT INTO tests(name,norm) VALUES(?,?) ON CONFLICT(norm) DO NOTHING",
+                      [(" ".join(n.split()),k) for n,k in keys.items()])
+        c.execute(SQL_TESTS_BY_NORMS, (json.dumps(list(set(keys.values()))),))
+        ids=dict(c.fetchall())
+        return {n:ids[k] for n,k in keys.items()}
+    def add_patient_test(self, pid, test_name):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            tid=self._test_ids(c, [test_name])[test_name]
+            c.execute("""INSERT INTO patient_tests(patient_id,test_id,status,updated_at)
+                         VALUES(?,?,?,?)""", (pid, tid, 'bekliyor', now_str()))
+            self._log_change(c, pid, CHANGE_TESTS)
+    def list_patient_tests(self, pid, archived=False):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_ARCHIVE_PATIENT_TESTS if archived else SQL_PATIENT_TESTS,(pid,))
+            return c.fetchall()
+    def update_patient_test_status(self, tid, status):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("UPDATE patient_tests SET status=?,updated_at=? WHERE id=? RETURNING patient_id",(status,now_str(),tid))
+            r=c.fetchone()
+            if r: self._log_change(c, r[0], CHANGE_TESTS)
+            return r[0] if r else None
+    def delete_patient_test(self, tid):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("DELETE FROM patient_tests WHERE id=? RETURNING patient_id", (tid,))
+            r=c.fetchone()
+            if r: self._log_change(c, r[0], CHANGE_TESTS)
+            return r[0] if r else None
+    def set_test_statuses(self, changes):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            # Önce yazma kilidi: okunan eski durumlar UPDATE'e kadar değişemez
+            c.execute("BEGIN IMMEDIATE")
+            c.execute(SQL_TESTS_BY_IDS, (json.dumps([t for t,_ in changes]),))
+            cur={tid:(pid,st_) for tid,pid,st_ in c.fetchall()}
+            todo=[(s_,tid) for tid,s_ in changes if tid in cur and cur[tid][1]!=s_]
+            now=now_str()
+            c.executemany("UPDATE patient_tests SET status=?,updated_at=? WHERE id=?", [(s_,now,tid) for s_,tid in todo])
+            self._log_changes(c, {cur[tid][0] for _,tid in todo}, CHANGE_TESTS)
+            return [(tid, *cur.get(tid,(None,None))) for tid,_ in changes]
+    def set_day_test_status(self, visit_date_iso, test_name, status):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute(SQL_DAY_TEST_STATUS, (status, now_str(), status, test_key(test_name), visit_date_iso))
+            rows=c.fetchall()
+            self._log_changes(c, {pid for _,pid in rows}, CHANGE_TESTS)
+            return rows
+    def day_tests(self, visit_date_iso):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_DAY_TESTS, (visit_date_iso,)); return c.fetchall()
+    def day_summary_rows(self, visit_date_iso, archived=False):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_ARCHIVE_DAY_SUMMARY if archived else SQL_DAY_SUMMARY,(visit_date_iso,))
+            return [(pid,fn,ln,hhmm,
+                     done.split(_SUMMARY_SEP) if done else [],
+                     rem.split(_SUMMARY_SEP) if rem else [])
+                    for pid,fn,ln,hhmm,done,rem in c.fetchall()]
+    def reminder_rows(self, from_iso=None, pids=None):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            if pids is None: c.execute(SQL_REMINDERS_FROM, (from_iso,))
+            else: c.execute(_SQL_REMINDER_PATIENTS.format(where=f"p.id IN ({','.join('?'*len(pids))})"), list(pids))
+            return c.fetchall()
+    def calendar_rows(self, from_iso, to_iso):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_CALENDAR, (from_iso, to_iso)); return c.fetchall()
+    def search_patients(self, terms, limit):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_SEARCH_PATIENTS, (" ".join(f'"{t}"*' for t in terms), limit))
+            return c.fetchall()
+    def stats_rows(self, from_iso, to_iso):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_DAILY_STATS, (from_iso, to_iso)); return c.fetchall()
+    def test_stats_rows(self, from_iso, to_iso):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_TEST_STATS, (from_iso, to_iso)); return c.fetchall()
+    def package_stats_rows(self, from_iso, to_iso):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_PACKAGE_STATS, (from_iso, to_iso)); return c.fetchall()
+    def rebuild_stats(self):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("BEGIN IMMEDIATE")
+            for stmt in SQL_REBUILD_STATS: c.execute(stmt)
+            c.execute("SELECT COUNT(*) FROM daily_stats"); return c.fetchone()[0]
+    def archive_months(self):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute("""SELECT substr(visit_date,1,7) m, COUNT(*) FROM archive_patients
+                         GROUP BY m ORDER BY m DESC""")
+            return c.fetchall()
+    def change_cursor(self):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute("SELECT COALESCE(MAX(seq),0) FROM change_log"); return c.fetchone()[0]
+    def changes_since(self, seq, limit=500):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_CHANGES_SINCE, (seq, limit)); return c.fetchall()
+
+    # -------- paketler --------
+    def list_packages(self):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute("SELECT id,name FROM packages ORDER BY name"); return c.fetchall()
+    def get_package_tests(self, pkg_id):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(SQL_PACKAGE_TESTS,(pkg_id,))
+            return c.fetchall()
+    def create_package(self, name, tests):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("INSERT INTO packages(name) VALUES(?)",(name.strip(),))
+            pid=c.lastrowid
+            ids=self._test_ids(c, tests)
+            c.executemany("INSERT INTO package_tests(package_id,test_id,ord) VALUES(?,?,?)",
+                          [(pid,ids[t],i) for i,t in enumerate(tests) if t in ids])
+            return pid
+    def rename_package(self, pkg_id, new_name):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("UPDATE packages SET name=? WHERE id=?", (new_name.strip(), pkg_id))
+    def add_test_to_package(self, pkg_id, test_name, ord_hint=None):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            if ord_hint is None:
+                c.execute("SELECT COALESCE(MAX(ord),-1)+1 FROM package_tests WHERE package_id=?", (pkg_id,))
+                ord_hint=c.fetchone()[0]
+            c.execute("INSERT INTO package_tests(package_id,test_id,ord) VALUES(?,?,?)",
+                      (pkg_id,self._test_ids(c, [test_name])[test_name],ord_hint))
+    def delete_test_from_package(self, pt_id):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("DELETE FROM package_tests WHERE id=?", (pt_id,))
+    def delete_package(self, pkg_id):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.execute("DELETE FROM package_tests WHERE package_id=?", (pkg_id,))
+            c.execute("DELETE FROM packages WHERE id=?", (pkg_id,))
+    def _insert_package_tests(self, c, patient_id, package_ids)->int:
+        package_ids=[int(k) for k in package_ids]
+        if not package_ids: return 0
+        c.execute(SQL_APPLY_PACKAGES, (patient_id, now_str(), json.dumps(package_ids)))
+        n=c.rowcount
+        if n: self._log_change(c, patient_id, CHANGE_TESTS)
+        return n
+    def apply_packages_to_patient(self, package_ids, patient_id):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            return self._insert_package_tests(c, patient_id, package_ids)
+    def import_packages(self, catalog):
+        with closing(self._conn()) as conn, conn, closing(conn.cursor()) as c:
+            c.executemany("INSERT INTO packages(name) VALUES(?) ON CONFLICT(name) DO NOTHING", [(n,) for n,_ in catalog])
+            c.execute(SQL_PACKAGES_BY_NAMES, (json.dumps([n for n,_ in catalog]),))
+            ids={n:k for k,n in c.fetchall()}
+            c.executemany("DELETE FROM package_tests WHERE package_id=?", [(ids[n],) for n,t in catalog if t is not None])
+            tids=self._test_ids(c, {t for _,tests in catalog for t in tests or ()})
+            c.executemany("INSERT INTO package_tests(package_id,test_id,ord) VALUES(?,?,?)",
+                          [(ids[n],tids[t],i) for n,tests in catalog for i,t in enumerate(tests or ()) if t in tids])
+            return ids
+
+    # -------- dışa aktarım --------
+    def table_token(self, tables):
+        tables=list(tables); marks=",".join("?"*len(tables))
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(f"SELECT name,version FROM table_versions WHERE name IN ({marks}) ORDER BY name", tables)
+            return tuple(c.fetchall())
+    def export_chunks(self, sql):
+        with closing(self._conn()) as conn, closing(conn.cursor()) as c:
+            c.execute(sql); yield [d[0] for d in c.description]
+            while rows:=c.fetchmany(EXPORT_CHUNK_ROWS): yield rows
+
+@cache_resource()
+def get_storage(url:str="", path:str=DB_PATH)->Storage:
+    if url.startswith(("postgres://","postgresql://")):
+        from pg_storage import PostgresStorage  # psycopg2 yalnızca bu modda gerekir
+        return PostgresStorage(url, core=sys.modules[__name__])
+    return SqliteStorage(get_pool(path))
+
+def storage()->Storage:
+    """Seçili depolama; ilk erişimde şema kurulur, İstanbul günü başına bir kez eski günler temizlenir."""
+    ensure_db(DB_PATH, DATABASE_URL)
+    ensure_daily_cleanup(DB_PATH, to_iso(today_tr_date()))
+    return get_storage(DATABASE_URL, DB_PATH)
+
+def cleanup_old_patients(force:bool=False)->int:
+    """Dünkü ve öncesi hastaları (tetkikleriyle) canlı tablolardan çıkarır — paketler kalır.
+    history_mode='archive' (varsayılan) ise önce arşive taşır. İstanbul günü başına bir kez."""
+    return storage().cleanup_old_patients(force)
+
+# Şema/temizlik işi her çağrıda yapılmasın: süreç başına (ve gün başına) bir kez
+@cache_resource()
+def ensure_db(path:str=DB_PATH, url:str="")->int:
+    ver=init_db()  # yerel SQLite her durumda (outbox, yedekler)
+    return get_storage(url, path).init_schema() if url else ver
+
+@cache_resource(maxsize=2)
+def ensure_daily_cleanup(path:str, day_iso:str)->int:
+    return get_storage(DATABASE_URL, path).cleanup_old_patients()
+
+# ================== SETTINGS HELPERS ==================
+def get_setting(key, default=""):
+    val=ref_cache().get(("setting",key), lambda: storage().load_setting(key))
+    return default if val is None else val
+def set_setting(key,val):
+    storage().set_setting(key,val)
+    ref_cache().invalidate("setting")
+# Kira boşsa, süresi dolmuşsa ya da zaten bizdeyse alınır/uzatılır; aksi halde satır değişmez (rowcount 0)
+SQL_CLAIM_LEASE = """INSERT INTO leases(name,owner,expires_at) VALUES(?,?,?)
+                     ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+                     WHERE leases.owner=excluded.owner OR leases.expires_at<?"""
+
+# ================== PERSONNEL ==================
+def list_personnel(active_only=True):
+    return list(ref_cache().get(("personnel",bool(active_only)), lambda: storage().list_personnel(active_only)))
+def upsert_personnel(name,phone,active:int):
+    phone=normalize_phone(phone)
+    if phone and not phone.startswith("+"): raise ValueError("Telefon +90… formatında olmalı")
+    pid=storage().upsert_personnel(name.strip(),phone,active)
+    ref_cache().invalidate("personnel")
+    return pid
+def set_personnel_active(pid,active:int):
+    storage().set_personnel_active(pid,active)
+    ref_cache().invalidate("personnel")
+def delete_personnel(pid:int):
+    storage().delete_personnel(pid)
+    ref_cache().invalidate("personnel")
+
+# ================== PATIENTS / TESTS ==================
+# Hasta/tetkik değişikliği dinleyicileri (ör. hatırlatma zamanlayıcısı): hook(pids), pids=None → hepsi.
+@cache_resource()
+def patient_hooks(path:str=DB_PATH)->list: return []
+def _patient_changed(*pids):
+    for hook in patient_hooks(DB_PATH): hook(list(pids) or None)
+
+def add_patient(fn, ln, age, gender, visit_date_iso)->int:
+    """created_at’i de doldurarak ekler (IntegrityError fix)."""
+    return admit_patient(fn, ln, age, gender, visit_date_iso)[0]
+def admit_patient(fn, ln, age, gender, visit_date_iso, package_ids=(), phone=None)->tuple[int,int]:
+    """Hastayı ekler ve seçili paketleri tek işlemde (tek commit) açar → (hasta id, eklenen tetkik)."""
+    pid,n=storage().admit_patient(fn, ln, age, gender, visit_date_iso, package_ids, phone)
+    _patient_changed(pid)
+    return pid, n
+def delete_patient(pid:int):
+    storage().delete_patient(pid)
+    _patient_changed(pid)
+def set_patient_alarm_time(pid:int, hhmm:str|None):
+    storage().set_patient_alarm_time(pid, hhmm)
+    _patient_changed(pid)
+SQL_PATIENT = """SELECT id,first_name,last_name,visit_date,visit_time,phone FROM patients WHERE id=?"""
+def get_patient(pid:int):
+    """(id, ad, soyad, gün, saat, telefon) ya da None"""
+    return storage().get_patient(pid)
+_SQL_DAY_PATIENTS = """SELECT id,first_name,last_name,age,gender,department,visit_time
+                        FROM {p} WHERE visit_date=? ORDER BY last_name,first_name"""
+SQL_DAY_PATIENTS = _SQL_DAY_PATIENTS.format(p="patients")
+SQL_ARCHIVE_DAY_PATIENTS = _SQL_DAY_PATIENTS.format(p="archive_patients")
+def is_archived_day(visit_date_iso:str)->bool:
+    """Arşiv modunda bugünden önceki günler arşiv tablolarından, salt okunur gösterilir."""
+    return visit_date_iso<to_iso(today_tr_date()) and get_setting("history_mode","archive")=="archive"
+def list_patients(visit_date_iso:str|None=None):
+    return storage().list_patients(visit_date_iso, bool(visit_date_iso) and is_archived_day(visit_date_iso))
+
+def add_patient_test(pid:int, test_name:str):
+    test_name = (test_name or "").strip()
+    if not test_name:
+        raise ValueError("Tetkik adı boş olamaz.")
+    storage().add_patient_test(pid, test_name)
+    _patient_changed(pid)
+
+_SQL_PATIENT_TESTS = """SELECT t.id,t.patient_id,n.name,t.status,t.updated_at
+                         FROM {t} t JOIN tests n ON n.id=t.test_id WHERE t.patient_id=? ORDER BY t.updated_at DESC, t.id DESC"""
+SQL_PATIENT_TESTS = _SQL_PATIENT_TESTS.format(t="patient_tests")
+SQL_ARCHIVE_PATIENT_TESTS = _SQL_PATIENT_TESTS.format(t="archive_patient_tests")
+def list_patient_tests(pid:int, archived:bool=False):
+    return storage().list_patient_tests(pid, archived)
+def update_patient_test_status(tid:int, status:str):
+    pid=storage().update_patient_test_status(tid, status)
+    if pid is not None: _patient_changed(pid)
+def delete_patient_test(tid:int):
+    pid=storage().delete_patient_test(tid)
+    if pid is not None: _patient_changed(pid)
+
+# Toplu durum güncelleme: tek işlem, tek executemany / tek UPDATE; satır başına sonuç döner
+BULK_UPDATED, BULK_UNCHANGED, BULK_MISSING = "güncellendi", "zaten bu durumda", "bulunamadı"
+SQL_TESTS_BY_IDS = "SELECT id,patient_id,status FROM patient_tests WHERE id IN (SELECT value FROM json_each(?))"
+SQL_DAY_TEST_STATUS = """UPDATE patient_tests SET status=?,updated_at=?
+    WHERE status<>? AND test_id=(SELECT id FROM tests WHERE norm=?) AND patient_id IN (SELECT id FROM patients WHERE visit_date=?)
+    RETURNING id,patient_id"""
+# İç içe döngü: hastanın tetkikleri art arda, (patient_id,updated_at) indeksi sırasıyla gelir; ek sıralama yok
+SQL_DAY_TESTS = """SELECT t.id,p.id,p.first_name,p.last_name,n.name,t.status
+    FROM patients p JOIN patient_tests t ON t.patient_id=p.id JOIN tests n ON n.id=t.test_id WHERE p.visit_date=?
+    ORDER BY p.last_name,p.first_name,p.id,t.updated_at,t.id"""
+def set_test_statuses(changes:list[tuple[int,str]])->list[tuple[int,str]]:
+    """[(tetkik id, yeni durum)] → [(tetkik id, sonuç)]; sonuç BULK_UPDATED/BULK_UNCHANGED/BULK_MISSING."""
+    if not changes: return []
+    want=dict(changes)
+    rows=storage().set_test_statuses(list(want.items()))
+    pids={pid for tid,pid,old in rows if pid is not None and old!=want[tid]}
+    if pids: _patient_changed(*pids)
+    return [(tid, BULK_MISSING if pid is None else BULK_UNCHANGED if old==want[tid] else BULK_UPDATED)
+            for tid,pid,old in rows]
+def set_day_test_status(visit_date_iso:str, test_name:str, status:str="tamamlandi")->list[tuple[int,int]]:
+    """Günün tüm hastalarında adı test_name olan tetkikleri tek UPDATE ile günceller; [(tetkik id, hasta id)] döner."""
+    rows=storage().set_day_test_status(visit_date_iso, test_name, status)
+    if rows: _patient_changed(*{pid for _,pid in rows})
+    return rows
+def day_tests(visit_date_iso:str)->list[tuple]:
+    """Günün tüm tetkikleri: [(tetkik id, hasta id, ad, soyad, tetkik, durum)]"""
+    return storage().day_tests(visit_date_iso)
+
+# Gün özeti: hasta başına tamamlanan/kalan tetkikler tek sorguda (N+1 yerine).
+# Alt sorgular (patient_id,updated_at) indeksinden list_patient_tests ile aynı sırada okur.
+_SUMMARY_SEP = "\x1f"
+_SQL_DAY_SUMMARY = """
+    SELECT p.id,p.first_name,p.last_name,p.visit_time,
+      (SELECT GROUP_CONCAT(name, char(31)) FROM (
+         SELECT n.name FROM {t} t JOIN tests n ON n.id=t.test_id WHERE t.patient_id=p.id AND t.status='tamamlandi'
+         ORDER BY t.updated_at DESC, t.id DESC)),
+      (SELECT GROUP_CONCAT(name, char(31)) FROM (
+         SELECT n.name FROM {t} t JOIN tests n ON n.id=t.test_id WHERE t.patient_id=p.id AND t.status='bekliyor'
+         ORDER BY t.updated_at DESC, t.id DESC))
+    FROM {p} p WHERE p.visit_date=? ORDER BY p.last_name,p.first_name"""
+SQL_DAY_SUMMARY = _SQL_DAY_SUMMARY.format(p="patients", t="patient_tests")
+SQL_ARCHIVE_DAY_SUMMARY = _SQL_DAY_SUMMARY.format(p="archive_patients", t="archive_patient_tests")
+def day_summary(visit_date_iso:str):
+    """[(id, ad, soyad, alarm, tamamlananlar, kalanlar)], toplam tamamlanan, toplam kalan"""
+    rows=storage().day_summary_rows(visit_date_iso, is_archived_day(visit_date_iso))
+    return rows, sum(len(r[4]) for r in rows), sum(len(r[5]) for r in rows)
+
+# Hatırlatma zamanlayıcısı: saati olan hastalar + bekleyen tetkikleri
+_SQL_REMINDER_PATIENTS = """SELECT p.id,p.first_name,p.last_name,p.visit_date,p.visit_time,
+      (SELECT GROUP_CONCAT(n.name, ', ') FROM patient_tests t JOIN tests n ON n.id=t.test_id
+        WHERE t.patient_id=p.id AND t.status='bekliyor')
+    FROM patients p WHERE {where} AND p.visit_time IS NOT NULL"""
+SQL_REMINDERS_FROM = _SQL_REMINDER_PATIENTS.format(where="p.visit_date>=?")
+# Takvim akışı: kalan tetkikler sabit sırada (çıktı ve ETag deterministik olsun) + son güncelleme (DTSTAMP:
+# hastanın ya da tetkiklerinin en yenisi) + randevu sürümü (SEQUENCE)
+SQL_CALENDAR = """SELECT p.id,p.first_name,p.last_name,p.visit_date,p.visit_time,
+      (SELECT GROUP_CONCAT(name, ', ') FROM (
+         SELECT n.name FROM patient_tests t JOIN tests n ON n.id=t.test_id
+         WHERE t.patient_id=p.id AND t.status='bekliyor' ORDER BY t.updated_at, t.id)),
+      MAX(COALESCE(p.updated_at,''), COALESCE((SELECT MAX(updated_at) FROM patient_tests t WHERE t.patient_id=p.id),'')),
+      p.rev
+    FROM patients p WHERE p.visit_date BETWEEN ? AND ? AND p.visit_time IS NOT NULL
+    ORDER BY p.visit_date, p.visit_time"""
+SQL_PATIENT_BY_PHONE = """SELECT id,first_name,last_name,age,gender,department,visit_time
+                           FROM patients WHERE phone=? AND visit_date=? ORDER BY id DESC LIMIT 1"""
+def find_patient_by_phone(phone:str, visit_date_iso:str):
+    return storage().find_patient_by_phone(normalize_phone(phone), visit_date_iso)
+
+# Hasta araması (patient_search FTS5): ad/soyad ve tetkik adlarında önek eşleşmesi, bm25 ile (ad ağırlıklı) sıralı.
+# Dış döngü FTS dizinidir; ad/soyad birincil anahtarla canlı ya da arşiv tablosundan okunur.
+SEARCH_LIMIT = 50
+SQL_SEARCH_PATIENTS = """SELECT s.rowid,COALESCE(p.first_name,a.first_name),COALESCE(p.last_name,a.last_name),s.visit_date,s.archived
+    FROM patient_search s
+    LEFT JOIN patients p ON p.id=s.rowid AND s.archived=0
+    LEFT JOIN archive_patients a ON a.id=s.rowid AND s.archived=1
+    WHERE s.patient_search MATCH ? AND s.rank MATCH 'bm25(10.0, 1.0)' ORDER BY s.rank LIMIT ?"""
+def search_terms(query:str)->list[str]:
+    """Arama metnini aksansız, küçük harfli kelimelere ayırır: "Ayşe YILMAZ" → ["ayse","yilmaz"]."""
+    q=(query or "").translate(_I_FOLD)
+    q="".join(ch for ch in unicodedata.normalize("NFKD", q) if not unicodedata.combining(ch))
+    return re.findall(r"\w+", q.lower())
+def search_patients(query:str, limit:int=SEARCH_LIMIT)->list[tuple]:
+    """Tüm günlerde ve arşivde hasta arar → [(id, ad, soyad, gün, arşivde mi)], en iyi eşleşme önce."""
+    terms=search_terms(query)
+    return storage().search_patients(terms, limit) if terms else []
+
+def archive_months()->list[tuple[str,int]]:
+    """Arşivdeki aylar (YYYY-MM) ve hasta sayıları, yeniden eskiye."""
+    return storage().archive_months()
+
+# Değişiklik akışı (change_log): CHANGE_TESTS → yalnızca hastanın tetkik listesi, CHANGE_PATIENT → gün listesi
+CHANGE_TESTS = "tests"
+CHANGE_PATIENT = "patient"
+SQL_CHANGES_SINCE = "SELECT seq,patient_id,visit_date,kind FROM change_log WHERE seq>? ORDER BY seq LIMIT ?"
+def change_cursor()->int:
+    return storage().change_cursor()
+def changes_since(seq:int, limit:int=500)->list[tuple]:
+    """İmleçten sonraki değişiklikler: [(imleç, hasta id, gün, tür)] — birincil anahtar aralığı, tablo taranmaz.
+    İmleç SQLite'ta seq, PostgreSQL'de commit edilmiş işlemin kimliğidir; yeni imleç son satırın ilk alanıdır."""
+    return storage().changes_since(seq, limit)
+
+# ================== PACKAGES ==================
+def list_packages():
+    return list(ref_cache().get(("packages",), storage().list_packages))
+SQL_PACKAGE_TESTS = """SELECT pt.id,n.name,pt.ord FROM package_tests pt JOIN tests n ON n.id=pt.test_id
+                        WHERE pt.package_id=? ORDER BY pt.ord ASC, pt.id ASC"""
+# Paket uygulama: katalog id'lerinin kopyası. Paketler arasında aynı tetkik bir kez, paket ve tetkik sırasıyla eklenir.
+SQL_APPLY_PACKAGES = """INSERT INTO patient_tests(patient_id,test_id,status,updated_at)
+    SELECT ?,test_id,'bekliyor',? FROM (
+      SELECT pt.test_id,k.key pos,pt.ord,pt.id,
+             ROW_NUMBER() OVER (PARTITION BY pt.test_id ORDER BY k.key,pt.ord,pt.id) rn
+      FROM json_each(?) k JOIN package_tests pt ON pt.package_id=k.value)
+    WHERE rn=1 ORDER BY pos,ord,id"""
+SQL_TESTS_BY_NORMS = "SELECT norm,id FROM tests WHERE norm IN (SELECT value FROM json_each(?))"
+def get_package_tests(pkg_id:int):
+    return list(ref_cache().get(("package_tests",int(pkg_id)), lambda: storage().get_package_tests(pkg_id)))
+def create_package(name:str, tests:list[str]):
+    pid=storage().create_package(name, tests)
+    ref_cache().invalidate("packages","package_tests")
+    return pid
+def rename_package(pkg_id:int, new_name:str):
+    storage().rename_package(pkg_id, new_name)
+    ref_cache().invalidate("packages")
+def add_test_to_package(pkg_id:int, test_name:str, ord_hint:int|None=None):
+    storage().add_test_to_package(pkg_id, test_name, ord_hint)
+    ref_cache().invalidate("package_tests")
+def delete_test_from_package(pt_id:int):
+    storage().delete_test_from_package(pt_id)
+    ref_cache().invalidate("package_tests")
+def delete_package(pkg_id:int):
+    storage().delete_package(pkg_id)
+    ref_cache().invalidate("packages","package_tests")
+def apply_packages_to_patient(package_ids, patient_id:int)->int:
+    n=storage().apply_packages_to_patient(package_ids, patient_id)
+    if n: _patient_changed(patient_id)
+    return n
+def apply_package_to_patient(pkg_id:int, patient_id:int)->int:
+    return apply_packages_to_patient([pkg_id], patient_id)
+
+# Paket CSV içe aktarımı (dışa aktarımla aynı biçim): satırlar akış halinde doğrulanır,
+# geçerli olanlar tek işlemde yüklenir. Paketler ada göre eşlenir; dosyada tetkiki olan paketin içeriği dosyadakiyle değişir.
+PACKAGE_CSV_HEADER = ["type","id_or_package_id","name_or_test","ord"]
+SQL_PACKAGES_BY_NAMES = "SELECT id,name FROM packages WHERE name IN (SELECT value FROM json_each(?))"
+def parse_package_csv(rows, known:dict[int,str])->tuple[list[tuple[str,list[str]|None]], list[tuple[int,str]]]:
+    """csv.reader satırları (başlık dahil) → (katalog [(paket adı, sıralı tetkikler ya da None)], hatalar [(satır no, mesaj)]).
+    known: mevcut paketler {id: ad}; tetkik satırındaki sayısal referans önce dosyadaki paket id'sine, sonra bunlara bakar."""
+    rows=iter(rows); errors=[]
+    header=[h.strip() for h in next(rows, [])]
+    if header[:4]!=PACKAGE_CSV_HEADER:
+        return [], [(1, f"başlık {','.join(PACKAGE_CSV_HEADER)} olmalı")]
+    file_ids={}; names={}; items=[]  # names: ad → tetkik satırı var mı; items: (satır, referans, tetkik, sıra)
+    for line,r in enumerate(rows, start=2):
+        kind,ref,name,ord_=([x.strip() for x in r]+[""]*4)[:4]
+        if not (kind or ref or name): continue
+        if kind=="package":
+            if not name: errors.append((line,"paket adı boş")); continue
+            if ref: file_ids[ref]=name
+            names.setdefault(name, False)
+        elif kind=="item":
+            if not name: errors.append((line,"tetkik adı boş")); continue
+            if not ref: errors.append((line,"paket referansı boş")); continue
+            try: items.append((line, ref, " ".join(name.split()), int(ord_) if ord_ else None))
+            except ValueError: errors.append((line, f"geçersiz sıra: {ord_!r}"))
+        else:
+            errors.append((line, f"bilinmeyen tür: {kind!r}"))
+    # Referanslar dosya bitince çözülür: tetkik satırı paket satırından önce gelebilir
+    tests={}
+    for line,ref,name,ord_ in items:
+        # Sayısal olmayan referans dosyadaki ya da mevcut bir paketin adı olmalı; yazım hatası yeni paket açmaz
+        pkg=file_ids.get(ref) or (known.get(int(ref)) if ref.isdigit() else
+                                  ref if ref in names or ref in known.values() else None)
+        if pkg is None: errors.append((line, f"bilinmeyen paket {'id' if ref.isdigit() else 'adı'}: {ref}")); continue
+        names[pkg]=True; tests.setdefault(pkg, []).append((ord_ is None, ord_ or 0, line, name))
+    catalog=[]
+    for pkg,has_items in names.items():
+        if not has_items: catalog.append((pkg, None)); continue
+        seen=set(); ordered=[]
+        for _none,_ord,line,name in sorted(tests[pkg]):
+            if test_key(name) in seen: errors.append((line, f"'{pkg}' paketinde tekrarlanan tetkik: {name}")); continue
+            seen.add(test_key(name)); ordered.append(name)
+        catalog.append((pkg, ordered))
+    errors.sort()
+    return catalog, errors
+
+def import_packages_csv(fileobj, dry_run:bool=False)->dict:
+    """Paket CSV'si (ya da .csv.gz) → {"packages", "created", "tests", "errors"}; dry_run=True yalnızca doğrular."""
+    gz=fileobj.read(2)==b"\x1f\x8b"; fileobj.seek(0)
+    txt=io.TextIOWrapper(gzip.GzipFile(fileobj=fileobj) if gz else fileobj, encoding="utf-8-sig", newline="")
+    known=dict(list_packages())
+    try: catalog,errors=parse_package_csv(csv.reader(txt), known)
+    except (UnicodeDecodeError, csv.Error, OSError) as e: catalog,errors=[],[(0, f"dosya okunamadı: {e}")]
+    finally: txt.detach()  # yüklenen dosya nesnesi kapanmasın (önizleme + yükleme aynı nesneyi okur)
+    fileobj.seek(0)
+    existing=set(known.values())
+    if catalog and not dry_run:
+        storage().import_packages(catalog)
+        ref_cache().invalidate("packages","package_tests")
+    return {"packages":len(catalog), "created":sum(n not in existing for n,_ in catalog),
+            "tests":sum(len(t or ()) for _,t in catalog), "errors":errors}
+
+# ================== STATS (pano) ==================
+# Pano yalnızca daily_stats / test_stats satırlarını okur (gün başına 1, gün×tetkik başına 1 satır); ham tetkik taranmaz.
+STATS_GRAINS = {"Gün": lambda d: d, "Hafta": lambda d: to_iso(date.fromisoformat(d)-timedelta(days=date.fromisoformat(d).weekday())),
+                "Ay": lambda d: d[:7]}
+SQL_DAILY_STATS = """SELECT visit_date,patients,tests,done,done_min FROM daily_stats
+                      WHERE visit_date BETWEEN ? AND ? ORDER BY visit_date"""
+SQL_TEST_STATS = """SELECT n.name,SUM(s.tests),SUM(s.done),SUM(s.done_min) FROM test_stats s JOIN tests n ON n.id=s.test_id
+                     WHERE s.visit_date BETWEEN ? AND ? GROUP BY s.test_id"""
+# Paket başına tek gruplu sorgu: tarih aralığı → paket tetkikleri (test_id dizini) → paket. Pakete aynı tetkik
+# iki kez eklenmişse yalnızca ilk satırı sayılır.
+SQL_PACKAGE_STATS = """SELECT p.name,SUM(s.tests),SUM(s.done)
+                        FROM test_stats s JOIN package_tests pt ON pt.test_id=s.test_id JOIN packages p ON p.id=pt.package_id
+                        WHERE s.visit_date BETWEEN ? AND ?
+                          AND pt.id=(SELECT MIN(x.id) FROM package_tests x WHERE x.test_id=pt.test_id AND x.package_id=pt.package_id)
+                        GROUP BY p.id,p.name HAVING SUM(s.tests)>0"""
+def _avg_min(done:int, done_min:float)->float|None: return round(done_min/done, 1) if done else None
+def throughput(from_iso:str, to_iso:str, grain:str="Gün")->list[tuple]:
+    """[(dönem, hasta, tetkik, tamamlanan, ort. tamamlanma dk)]; dönem: gün, haftanın pazartesisi ya da YYYY-MM."""
+    key=STATS_GRAINS[grain]; acc={}
+    for day,pts,tests,done,mins in storage().stats_rows(from_iso, to_iso):
+        a=acc.setdefault(key(day), [0,0,0,0.0])
+        a[0]+=pts; a[1]+=tests; a[2]+=done; a[3]+=mins
+    return [(k,pts,tests,done,_avg_min(done,mins)) for k,(pts,tests,done,mins) in acc.items()]
+def test_stats(from_iso:str, to_iso:str)->list[tuple]:
+    """[(tetkik, toplam, tamamlanan, ort. tamamlanma dk)], en çok yapılan önce."""
+    rows=storage().test_stats_rows(from_iso, to_iso)
+    return sorted(((n,t,d,_avg_min(d,m)) for n,t,d,m in rows if t), key=lambda r:(-r[1], r[0]))
+def package_stats(from_iso:str, to_iso:str)->list[tuple]:
+    """[(paket, toplam, tamamlanan)] — hasta tetkikleri paket kaydı tutmadığından paketin tetkikleri (test_id)
+    üzerinden toplanır; birden çok pakette geçen tetkik her birine sayılır."""
+    return sorted(storage().package_stats_rows(from_iso, to_iso), key=lambda r:(-r[1], r[0]))
+def rebuild_stats()->int:
+    """İstatistik tablolarını canlı + arşiv kayıtlarından yeniden hesaplar; gün sayısını döner."""
+    return storage().rebuild_stats()
+
+# ================== EXPORTS ==================
+EXPORT_CHUNK_ROWS = 2000
+# ad → (sorgu, değişiklik jetonunu belirleyen tablolar). Tetkik dökümleri katalog adını test_name sütununda taşır.
+_SQL_EXPORT_TESTS = "SELECT t.id,t.patient_id,n.name AS test_name,t.status,t.updated_at FROM {t} t JOIN tests n ON n.id=t.test_id"
+EXPORTS = {
+    "patients": ("SELECT * FROM patients", ("patients",)),
+    "patient_tests": (_SQL_EXPORT_TESTS.format(t="patient_tests"), ("patient_tests","tests")),
+    "personnel": ("SELECT * FROM personnel", ("personnel",)),
+    "packages_only": ("SELECT * FROM packages", ("packages",)),
+    "archive_patients": ("SELECT * FROM archive_patients", ("archive_patients",)),
+    "archive_patient_tests": (_SQL_EXPORT_TESTS.format(t="archive_patient_tests"), ("archive_patient_tests","tests")),
+    "packages": (None, ("packages","package_tests","tests")),  # tip/satır biçimli paket dökümü (içe aktarılabilir)
+}
+SQL_EXPORT_PACKAGES = ("SELECT 'package',id,name,'' FROM packages ORDER BY id",
+                       """SELECT 'item',pt.package_id,n.name,pt.ord FROM package_tests pt JOIN tests n ON n.id=pt.test_id
+                          ORDER BY pt.package_id,pt.ord""")
+
+def table_token(tables)->tuple:
+    """Tabloların değişiklik sayaçları; herhangi bir yazma jetonu değiştirir."""
+    return storage().table_token(tables)
+
+def export_csv(kind:str, gz:bool=False)->bytes:
+    """Dışa aktarımı imleçten parça parça yazar; tüm tablo belleğe listelenmez."""
+    sql,_tables=EXPORTS[kind]
+    buf=io.BytesIO()
+    raw=gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) if gz else buf
+    txt=io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    w=csv.writer(txt)
+    with timed(f"export:{kind}"):
+        if sql is None: w.writerow(PACKAGE_CSV_HEADER)
+        for q in SQL_EXPORT_PACKAGES if sql is None else (sql,):
+            chunks=storage().export_chunks(q)
+            header=next(chunks)
+            if sql is not None: w.writerow(header)
+            for rows in chunks: w.writerows(rows)
+        txt.flush(); txt.detach()
+        if gz: raw.close()
+    return buf.getvalue()
+
+@functools.lru_cache(maxsize=16)
+def _cached_export(path:str, kind:str, token:tuple, gz:bool)->bytes:
+    if METRICS_ENABLED: metrics().cache("export", False)
+    return export_csv(kind, gz)
+
+def cached_export(kind:str, gz:bool=False)->bytes:
+    """Jeton değişmedikçe aynı dışa aktarım yeniden üretilmez."""
+    if not METRICS_ENABLED: return _cached_export(DB_PATH, kind, table_token(EXPORTS[kind][1]), gz)
+    m=metrics(); misses=m.caches.get("export",[0,0])[1]
+    data=_cached_export(DB_PATH, kind, table_token(EXPORTS[kind][1]), gz)
+    if m.caches.get("export",[0,0])[1]==misses: m.cache("export", True)
+    return data
+
+# ================== SNAPSHOTS ==================
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 7       # diskte tutulan en yeni yedek sayısı
+BACKUP_PAGES = 256    # backup() adımı başına sayfa; adımlar arasında yazıcılar kilidi alabilir
+BACKUP_TICK_S = 60
+
+def _as_rollback_image(data)->bytes:
+    # WAL bayraklı (başlık bayt 18-19 = 2) imaj bellekte açılamaz; klasik günlük moduna çevir
+    data=bytearray(data)
+    if data[18:20]==b"\x02\x02": data[18:20]=b"\x01\x01"
+    return bytes(data)
+
+def snapshot_bytes(gz:bool=True, pool:ConnPool|None=None)->bytes:
+    """Canlı DB'nin tutarlı anlık görüntüsü (SQLite backup API, sayfa gruplarıyla)."""
+    pool=pool or get_pool(DB_PATH)
+    with closing(sqlite3.connect(":memory:")) as dst:
+        with closing(pool.acquire()) as src:
+            src.backup(dst, pages=BACKUP_PAGES, sleep=0)
+        data=_as_rollback_image(dst.serialize())
+    return gzip.compress(data, compresslevel=6) if gz else data
+
+def list_snapshots(directory:str=BACKUP_DIR)->list[str]:
+    """En yeniden eskiye."""
+    return sorted(glob.glob(os.path.join(directory,"checkup_*.db.gz")), reverse=True)
+
+def write_snapshot(directory:str=BACKUP_DIR, keep:int=BACKUP_KEEP, pool:ConnPool|None=None)->str:
+    """Anlık görüntüyü klasöre yazar, en yeni `keep` tanesi dışındakileri siler."""
+    os.makedirs(directory, exist_ok=True)
+    # Mikrosaniye: aynı saniyedeki iki yedek çakışmaz; sabit genişlik ad sırasını (list_snapshots) zaman sırası tutar
+    path=os.path.join(directory, f"checkup_{now_tr():%Y%m%d_%H%M%S_%f}.db.gz")
+    with open(path+".tmp","wb") as f: f.write(snapshot_bytes(gz=True, pool=pool))
+    os.replace(path+".tmp", path)
+    for old in list_snapshots(directory)[keep:]: os.remove(old)
+    return path
+
+def restore_snapshot(data:bytes)->None:
+    """.db veya .db.gz yedeğini doğrular ve canlı veritabanının üzerine yazar."""
+    if data[:2]==b"\x1f\x8b": data=gzip.decompress(data)
+    if not data.startswith(b"SQLite format 3\x00"): raise ValueError("Geçersiz yedek dosyası.")
+    with closing(sqlite3.connect(":memory:")) as mem:
+        mem.deserialize(_as_rollback_image(data))
+        if mem.execute("PRAGMA integrity_check").fetchone()[0]!="ok":
+            raise ValueError("Yedek bütünlük kontrolünden geçmedi.")
+        if not mem.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='patients'").fetchone():
+            raise ValueError("Yedekte hasta tablosu yok.")
+        with closing(get_conn()) as dst:
+            mem.backup(dst.raw, pages=BACKUP_PAGES)
+    init_db()  # eski sürüm yedekler için eksik göçler
+    cleanup_old_patients(force=True)
+    ref_cache().clear(); _cached_export.cache_clear(); _cached_ics_feed.cache_clear(); _patient_changed()
+
+class SnapshotScheduler(threading.Thread):
+    """backup_interval_h ayarına göre diske dönen yedek alır (0 = kapalı).
+    Son yedeğin zamanı dosyadan okunur; birden çok süreç aynı klasörü paylaşabilir."""
+    def __init__(self, pool:ConnPool, directory:str=BACKUP_DIR, tick_s:float=BACKUP_TICK_S):
+        super().__init__(daemon=True, name="snapshot-scheduler")
+        self.pool=pool; self.directory=directory; self.tick_s=tick_s
+        self.stop_event=threading.Event(); self.last_path=None; self.last_error=None
+    def interval_h(self)->float:
+        with closing(self.pool.acquire()) as conn:
+            r=conn.execute("SELECT val FROM app_settings WHERE key='backup_interval_h'").fetchone()
+        try: return float(r[0]) if r else 0.0
+        except ValueError: return 0.0
+    def due(self)->bool:
+        hours=self.interval_h()
+        if hours<=0: return False
+        snaps=list_snapshots(self.directory)
+        return not snaps or time.time()-os.path.getmtime(snaps[0])>=hours*3600
+    def run(self):
+        while not self.stop_event.wait(self.tick_s):
+            try:
+                if self.due(): self.last_path=write_snapshot(self.directory, pool=self.pool); self.last_error=None
+            except Exception as e:
+                self.last_error=str(e)
+
+@cache_resource()
+def start_snapshot_scheduler(path:str=DB_PATH)->SnapshotScheduler:
+    s=SnapshotScheduler(get_pool(path)); s.start()
+    return s
+
+# ================== QUERY PLAN CHECK ==================
+# Sıcak sorgular: (ad, SQL, örnek parametreler). Planında tam tablo taraması (SCAN)
+# ya da geçici B-tree ile sıralama çıkan sorgu indeks regresyonu sayılır.
+HOT_QUERIES = [
+    ("list_patients(gün)", SQL_DAY_PATIENTS, ("2000-01-01",)),
+    ("list_patient_tests", SQL_PATIENT_TESTS, (1,)),
+    ("get_patient", SQL_PATIENT, (1,)),
+    ("get_package_tests", SQL_PACKAGE_TESTS, (1,)),
+    ("find_patient_by_phone", SQL_PATIENT_BY_PHONE, ("+90","2000-01-01")),
+    ("day_summary", SQL_DAY_SUMMARY, ("2000-01-01",)),
+    ("list_patients(arşiv günü)", SQL_ARCHIVE_DAY_PATIENTS, ("2000-01-01",)),
+    ("list_patient_tests(arşiv)", SQL_ARCHIVE_PATIENT_TESTS, (1,)),
+    ("day_summary(arşiv)", SQL_ARCHIVE_DAY_SUMMARY, ("2000-01-01",)),
+    ("cleanup_old_patients (tetkikler)", SQL_CLEANUP_TESTS, ("2000-01-01",)),
+    ("cleanup_old_patients", "DELETE FROM patients WHERE visit_date < ?", ("2000-01-01",)),
+    ("delete_patient (tetkikler)", "DELETE FROM patient_tests WHERE patient_id=?", (1,)),
+    ("add_test_to_package (sıra)", "SELECT COALESCE(MAX(ord),-1)+1 FROM package_tests WHERE package_id=?", (1,)),
+    ("delete_package (tetkikler)", "DELETE FROM package_tests WHERE package_id=?", (1,)),
+    ("update_patient_test_status", "UPDATE patient_tests SET status=?,updated_at=? WHERE id=?", ("bekliyor","",1)),
+    ("get_setting", "SELECT val FROM app_settings WHERE key=?", ("theme",)),
+    ("claim_lease", SQL_CLAIM_LEASE, ("reminders","x",0.0,0.0)),
+    ("claim_outbox", """SELECT id FROM outbox WHERE status='pending' AND next_attempt_at<=?
+                        ORDER BY next_attempt_at, id LIMIT ?""", (0.0, 50)),
+    ("upsert_personnel (telefon)", "SELECT id FROM personnel WHERE phone=?", ("+90",)),
+    ("hatırlatmalar", SQL_REMINDERS_FROM, ("2000-01-01",)),
+    ("takvim akışı", SQL_CALENDAR, ("2000-01-01","2000-01-14")),
+    ("changes_since", SQL_CHANGES_SINCE, (0, 500)),
+    ("search_patients", SQL_SEARCH_PATIENTS, ('"ayse"*', 50)),
+    ("pano (günler)", SQL_DAILY_STATS, ("2000-01-01","2000-12-31")),
+    ("pano (tetkikler)", SQL_TEST_STATS, ("2000-01-01","2000-12-31"), ("USE TEMP B-TREE FOR GROUP BY",)),
+    ("pano (paketler)", SQL_PACKAGE_STATS, ("2000-01-01","2000-12-31"), ("USE TEMP B-TREE FOR GROUP BY",)),
+    ("set_test_statuses (okuma)", SQL_TESTS_BY_IDS, ("[1,2]",)),
+    ("set_day_test_status", SQL_DAY_TEST_STATUS, ("tamamlandi","","tamamlandi","Hemogram","2000-01-01")),
+    # hastalar ad sırasıyla indeksten gelir; sıralama yalnızca bir ad grubunun (çoğunlukla tek hasta) tetkikleri içinde
+    ("day_tests", SQL_DAY_TESTS, ("2000-01-01",), ("USE TEMP B-TREE FOR RIGHT PART OF ORDER BY",)),
+    ("import_packages (adlar)", SQL_PACKAGES_BY_NAMES, ('["A"]',)),
+    ("tetkik kataloğu (adlar)", SQL_TESTS_BY_NORMS, ('["ekg"]',)),
+    # sıralama yalnızca seçilen paketlerin (dizinle bulunan) tetkik satırları üzerindedir
+    ("apply_packages_to_patient", SQL_APPLY_PACKAGES, (1,"",'[1,2]'), ("USE TEMP B-TREE FOR ORDER BY",)),
+]
+
+def query_plan_problems(conn=None)->list[tuple[str,str]]:
+    """HOT_QUERIES için EXPLAIN QUERY PLAN; (sorgu adı, sorunlu plan satırı) listesi döner. Girdinin isteğe bağlı
+    dördüncü alanı o sorguda beklenen plan satırlarıdır (ör. dizinli aralık üzerinde toplama için GROUP BY ağacı).
+    HOT_QUERIES'te bulunmayan SQL_* sabitleri de sorun sayılır.
+    conn verilmezse güncel şema boş bir bellek içi DB'de kurulur."""
+    own=conn is None
+    if own:
+        conn=sqlite3.connect(":memory:")
+        with closing(conn.cursor()) as c:
+            c.execute("CREATE TABLE app_settings(key TEXT PRIMARY KEY, val TEXT)")
+            for _v,step in MIGRATIONS: step(conn,c)
+    try:
+        # Yeni bir SQL_* sabiti buraya eklenmeden geçmesin
+        listed={q[1] for q in HOT_QUERIES}
+        problems=[(n,"HOT_QUERIES'te yok") for n,v in sorted(globals().items())
+                  if n.startswith("SQL_") and isinstance(v,str) and v not in listed]
+        with closing(conn.cursor()) as c:
+            for name,sql,params,*allowed in HOT_QUERIES:
+                c.execute("EXPLAIN QUERY PLAN "+sql, params)
+                for row in c.fetchall():
+                    detail=row[-1]
+                    # "SCAN (subquery-N)" tablo değil, alt sorgu çıktısının taranmasıdır
+                    # json_each: parametre olarak gelen id listesinin açılması; "VIRTUAL TABLE INDEX": FTS5 dizin araması
+                    table_scan=(detail.startswith("SCAN ") and not detail.startswith(("SCAN (","SCAN CONSTANT","SCAN json_each"))
+                                and "VIRTUAL TABLE INDEX" not in detail)
+                    if (table_scan or "TEMP B-TREE" in detail) and detail not in (allowed[0] if allowed else ()):
+                        problems.append((name,detail))
+        return problems
+    finally:
+        if own: conn.close()
+
+# ================== OUTBOX (giden WhatsApp kuyruğu) ==================
+# Durumlar: pending → sending → sent | pending (yeniden deneme) | failed
+DEFAULT_WA_TEMPLATE = "📌 Tetkik Güncellemesi\nHasta: {patient} ({date})\nTamamlanan: {done}\nKalan: {remaining}"
+OUTBOX_STALE_S = 300  # bu kadar süredir 'sending' kalan satır (çöken işçi) yeniden kuyruğa alınır
+
+def format_status_message(tpl:str, patient_name:str, date_disp:str, trs)->str:
+    done=[t[2] for t in trs if t[3]=="tamamlandi"]
+    rem=[t[2] for t in trs if t[3]=="bekliyor"]
+    return tpl.format(patient=patient_name, date=date_disp,
+                      done=", ".join(done) if done else "-", remaining=", ".join(rem) if rem else "-")
+
+def patient_status_message(pid:int)->str|None:
+    p=get_patient(pid)
+    if not p: return None
+    day=datetime.strptime(p[3],"%Y-%m-%d").date()
+    return format_status_message(get_setting("wa_template", DEFAULT_WA_TEMPLATE), f"{p[1]} {p[2]}",
+                                 to_display(day), list_patient_tests(pid))
+
+def _enqueue(c, recipient:str, body:str, patient_id:int|None, key:str|None)->int:
+    recipient=normalize_phone(recipient)
+    if not recipient: raise ValueError("Alıcı telefonu boş olamaz.")
+    ts=now_str()
+    c.execute("""INSERT INTO outbox(recipient,body,patient_id,coalesce_key,created_at,updated_at)
+                 VALUES(?,?,?,?,?,?)
+                 ON CONFLICT(coalesce_key) WHERE status='pending'
+                 DO UPDATE SET body=excluded.body, updated_at=excluded.updated_at
+                 RETURNING id""",
+              (recipient, body, patient_id, key, ts, ts))
+    return c.fetchone()[0]
+def enqueue_message(recipient:str, body:str, patient_id:int|None=None)->int:
+    """Mesajı kuyruğa ekler. patient_id verilirse aynı hasta+alıcı için bekleyen mesajın gövdesi güncellenir."""
+    key=f"{patient_id}:{normalize_phone(recipient)}" if patient_id is not None else None
+    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
+        return _enqueue(c, recipient, body, patient_id, key)
+
+def enqueue_patient_status(pid:int, recipients)->int:
+    msg=patient_status_message(pid)
+    if msg is None: return 0
+    recipients=[r for r in dict.fromkeys(normalize_phone(r) for r in recipients) if r]
+    for r in recipients: enqueue_message(r, msg, patient_id=pid)
+    return len(recipients)
+
+def claim_outbox(limit:int, now:float|None=None)->list[tuple]:
+    """Vadesi gelen en fazla `limit` mesajı 'sending' olarak işaretleyip döner: (id, alıcı, gövde, deneme)."""
+    now=time.time() if now is None else now
+    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
+        c.execute("""UPDATE outbox SET status='pending', claimed_at=NULL
+                     WHERE status='sending' AND claimed_at < ?""", (now-OUTBOX_STALE_S,))
+        c.execute("""UPDATE outbox SET status='sending', claimed_at=?, attempts=attempts+1, coalesce_key=NULL
+                     WHERE id IN (SELECT id FROM outbox WHERE status='pending' AND next_attempt_at<=?
+                                  ORDER BY next_attempt_at, id LIMIT ?)
+                     RETURNING id,recipient,body,attempts""", (now, now, limit))
+        return sorted(c.fetchall())
+
+def finish_outbox(sent:list[tuple[int,str]], retry:list[tuple[int,str,float]], failed:list[tuple[int,str]]):
+    """Bir gönderim turunun sonuçlarını tek işlemde yazar.
+    sent: (id, sağlayıcı id) · retry: (id, hata, sonraki deneme epoch) · failed: (id, hata)"""
+    ts=now_str()
+    with closing(get_conn()) as conn, conn, closing(conn.cursor()) as c:
+        c.executemany("""UPDATE outbox SET status='sent', provider_id=?, sent_at=?, updated_at=?, last_error=NULL
+                         WHERE id=?""", [(sid,ts,ts,i) for i,sid in sent])
+        c.executemany("""UPDATE outbox SET status='pending', last_error=?, next_attempt_at=?, updated_at=?, claimed_at=NULL
+                         WHERE id=?""", [(err,at,ts,i) for i,err,at in retry])
+        c.executemany("UPDATE outbox SET status='failed', last_error=?, updated_at=? WHERE id=?",
+                      [(err,ts,i) for i,err in failed])
+
+def outbox_counts()->dict:
+    with closing(get_conn()) as conn, closing(conn.cursor()) as c:
+        c.execute("SELECT status,COUNT(*) FROM outbox GROUP BY status")
+        return dict(c.fetchall())
+
+# ================== REMINDERS ==================
+# Saat (visit_time) verilmiş ve bekleyen tetkiki olan hastalar için bellek içi zamanlayıcı.
+# Hastalar açılışta bir kez, sonra yalnızca change_log'da görünen (webhook ve diğer süreçler dahil) değişikliklerde
+# okunur; yoklama birincil anahtar aralığıdır. Süreç içi kancalar yoklamayı beklemeden uyandırır.
+REMINDER_LEAD_MIN = 10       # varsayılan: saatten kaç dakika önce
+REMINDER_POLL_S = 15         # change_log yoklama aralığı (sıradaki hatırlatma daha yakınsa ona kadar uyunur)
+REMINDER_POLL_BATCH = 500
+REMINDER_COMPACT_MIN = 64    # heap bu boyutu aşıp yarısı eskimiş girdiyse yeniden kurulur
+# Her Streamlit süreci/kopyası bir zamanlayıcı başlatır; yalnızca "reminders" kirasını tutan planlar ve gönderir,
+# diğerleri her yoklamada kirayı dener (sahip düşerse süre dolunca devralınır). Kira her yoklamada uzatılır.
+REMINDER_LEASE = "reminders"
+REMINDER_LEASE_TTL_S = 4*REMINDER_POLL_S
+
+def reminder_due_at(visit_date_iso:str, hhmm:str, lead_min:float)->float|None:
+    """Hatırlatmanın epoch zamanı (TR saatiyle); saat okunamazsa None."""
+    try: t=datetime.strptime(f"{visit_date_iso} {hhmm}", "%Y-%m-%d %H:%M").replace(tzinfo=TR_TZ)
+    except (TypeError, ValueError): return None
+    return t.timestamp()-lead_min*60
+
+def outbox_reminder_sender(store:Storage, pool:ConnPool):
+    """Varsayılan gönderici: hatırlatmayı varsayılan alıcıya outbox üzerinden yollar (alıcı yoksa atlar)."""
+    def send(pid:int, text:str):
+        recipient=store.load_setting("default_recipient")
+        if not recipient: return
+        with closing(pool.acquire()) as conn, conn, closing(conn.cursor()) as c:
+            _enqueue(c, recipient, text, pid, None)
+    return send
+
+class ReminderScheduler(threading.Thread):
+    """heapq tabanlı zamanlayıcı. change_log'daki (ya da notify(pids) ile bildirilen) hastalar yeniden okunur.
+    Heap'te eskimiş girdiler silinmez, sırası gelince entries ile karşılaştırılıp atlanır (lazy deletion);
+    eskimişler yarıya ulaşınca heap entries'ten yeniden kurulur. Yalnızca REMINDER_LEASE sahibi süreç çalışır."""
+    def __init__(self, store:Storage, sender):
+        super().__init__(daemon=True, name="reminder-scheduler")
+        self.store=store; self.sender=sender
+        self.heap=[]; self.entries={}   # pid → due
+        self.cv=threading.Condition(); self.dirty=set(); self.reload_all=True; self.cursor=0
+        self.stop_event=threading.Event(); self.fired=0; self.last_error=None
+        self.owner_id=os.urandom(8).hex(); self.owner=False
+
+    def notify(self, pids=None):
+        with self.cv:
+            if pids is None: self.reload_all=True
+            else: self.dirty.update(pids)
+            self.cv.notify()
+
+    def stop(self):
+        self.stop_event.set(); self.notify([])
+
+    def scheduled(self)->int: return len(self.entries)
+
+    def _lead_min(self)->float:
+        val=self.store.load_setting("reminder_lead_min")
+        try: return float(val) if val else REMINDER_LEAD_MIN
+        except ValueError: return REMINDER_LEAD_MIN
+
+    def _rows(self, pids):
+        return self._lead_min(), self.store.reminder_rows(to_iso(today_tr_date()), pids)
+
+    def _refresh(self, pids):
+        lead,rows=self._rows(pids)
+        if pids is None: self.entries.clear(); self.heap.clear()
+        else:
+            for pid in pids: self.entries.pop(pid, None)
+        now=time.time()
+        for pid,_fn,_ln,day,hhmm,pending in rows:
+            due=reminder_due_at(day, hhmm, lead)
+            if pending and due is not None and due>now:
+                self.entries[pid]=due; heapq.heappush(self.heap, (due, pid))
+        if len(self.heap)>REMINDER_COMPACT_MIN and len(self.heap)>=2*len(self.entries):
+            self.heap=[(due,pid) for pid,due in self.entries.items()]; heapq.heapify(self.heap)
+
+    def _changed_pids(self)->set:
+        pids=set()
+        while True:
+            rows=self.store.changes_since(self.cursor, REMINDER_POLL_BATCH)
+            if rows: self.cursor=rows[-1][0]; pids.update(r[1] for r in rows if r[1] is not None)
+            if len(rows)<REMINDER_POLL_BATCH: return pids
+
+    def _fire(self, pids):
+        # Başka süreç (webhook) tetkiki tamamlamış olabilir: göndermeden önce DB'den son kez doğrula
+        _lead,rows=self._rows(pids)
+        for pid,fn,ln,_day,hhmm,pending in rows:
+            if not pending: continue
+            self.sender(pid, f"⏰ Hatırlatma: {fn} {ln} — saat {hhmm}\nKalan: {pending}")
+            self.fired+=1
+
+    def run(self):
+        while not self.stop_event.is_set():
+            with self.cv:
+                reload_all,dirty=self.reload_all,self.dirty
+                self.reload_all=False; self.dirty=set()
+            try:
+                was_owner=self.owner
+                self.owner=self.store.claim_lease(REMINDER_LEASE, self.owner_id, REMINDER_LEASE_TTL_S)
+                if not self.owner: self.entries.clear(); self.heap.clear()
+                elif reload_all or not was_owner: self.cursor=self.store.change_cursor(); self._refresh(None)
+                else:
+                    dirty|=self._changed_pids()
+                    if dirty: self._refresh(sorted(dirty))
+                now=time.time(); due=[]
+                while self.heap and self.heap[0][0]<=now:
+                    at,pid=heapq.heappop(self.heap)
+                    if self.entries.get(pid)==at: del self.entries[pid]; due.append(pid)
+                if due: self._fire(due)
+                self.last_error=None
+            except Exception as e:
+                self.last_error=str(e)
+            with self.cv:
+                if self.reload_all or self.dirty or self.stop_event.is_set(): continue
+                wait=min(REMINDER_POLL_S, self.heap[0][0]-time.time()) if self.heap else REMINDER_POLL_S
+                self.cv.wait(max(0.0, wait))
+
+@cache_resource()
+def start_reminder_scheduler(path:str=DB_PATH)->ReminderScheduler:
+    store=get_storage(DATABASE_URL, path)
+    s=ReminderScheduler(store, outbox_reminder_sender(store, get_pool(path))); s.start()
+    patient_hooks(path).append(s.notify)
+    return s
+
+# ================== CALENDAR / WHATSAPP LINKS ==================
+# UID hasta kimliği ve günden türetilir: aynı randevu her üretimde aynı olaydır, saat değişince takvim olayı
+# güncellenir (yenisi açılmaz), aynı adlı hastalar çakışmaz. Python'un hash()'i süreç başına tuzlu olduğundan kullanılmaz. Akışta DTSTAMP verideki son güncellemedir: çıktı deterministik, ETag sabit.
+ICS_FEED_DAYS = 14       # /calendar.ics varsayılan aralığı
+ICS_FEED_MAX_DAYS = 92
+def ics_uid(pid:int, visit_date_iso:str)->str:
+    return hashlib.sha1(f"{pid}|{visit_date_iso}".encode()).hexdigest()[:32]+"@checkup"
+def _ics_text(v:str)->str:
+    return v.replace("\\","\\\\").replace(";","\\;").replace(",","\\,").replace("\n","\\n")
+def _vevent(pid:int, patient_name:str, visit_date_iso:str, hhmm:str, dtstamp:datetime, duration_min:int=30,
+            remind_min:int=10, location:str="Klinik", description:str|None=None, sequence:int=0)->list[str]:
+    dt_local=datetime.strptime(f"{visit_date_iso} {hhmm}","%Y-%m-%d %H:%M").replace(tzinfo=TR_TZ)
+    dt_end=dt_local+timedelta(minutes=duration_min)
+    return ["BEGIN:VEVENT", f"UID:{ics_uid(pid, visit_date_iso)}",
+            f"DTSTAMP:{dtstamp.astimezone(ZoneInfo('UTC')).strftime('%Y%m%dT%H%M%SZ')}", f"SEQUENCE:{sequence}",
+            f"DTSTART;TZID=Europe/Istanbul:{dt_local.strftime('%Y%m%dT%H%M%S')}",
+            f"DTEND;TZID=Europe/Istanbul:{dt_end.strftime('%Y%m%dT%H%M%S')}",
+            f"SUMMARY:{_ics_text(f'Check-up Randevu – {patient_name}')}", f"LOCATION:{_ics_text(location)}",
+            f"DESCRIPTION:{_ics_text(description or f'{patient_name} randevusu.')}",
+            "BEGIN:VALARM", f"TRIGGER:-PT{remind_min}M", "ACTION:DISPLAY", "DESCRIPTION:Hatırlatma", "END:VALARM",
+            "END:VEVENT"]
+def _ics_fold(line:str)->str:
+    # RFC 5545: 75 oktetten uzun satırlar CRLF + boşlukla bölünür (UTF-8 karakteri ortadan bölünmez)
+    parts=[]; cur=""; n=0
+    for ch in line:
+        b=len(ch.encode("utf-8"))
+        if n+b>75: parts.append(cur); cur=" "; n=1
+        cur+=ch; n+=b
+    parts.append(cur)
+    return "\r\n".join(parts)
+# DTSTART/DTEND TZID=Europe/Istanbul ile yazılır; RFC 5545 tanımı takvimde ister. 2016'dan beri sabit +03:00, yaz saati yok.
+_VTIMEZONE_TR = ["BEGIN:VTIMEZONE","TZID:Europe/Istanbul","BEGIN:STANDARD","DTSTART:20160907T000000",
+                "TZOFFSETFROM:+0300","TZOFFSETTO:+0300","TZNAME:+03","END:STANDARD","END:VTIMEZONE"]
+def _vcalendar(events:list[list[str]], name:str|None=None)->bytes:
+    head=["BEGIN:VCALENDAR","VERSION:2.0","PRODID:-//checkup//streamlit//TR","CALSCALE:GREGORIAN"]
+    if name: head+=[f"X-WR-CALNAME:{_ics_text(name)}", "X-WR-TIMEZONE:Europe/Istanbul"]
+    body=head+_VTIMEZONE_TR+[l for e in events for l in e]+["END:VCALENDAR",""]
+    return "\r\n".join(_ics_fold(l) for l in body).encode("utf-8")
+def build_ics(pid:int, patient_name:str, visit_date_iso:str, hhmm:str,
+              duration_min:int=30, remind_min:int=10, location:str="Klinik")->bytes:
+    return _vcalendar([_vevent(pid, patient_name, visit_date_iso, hhmm, now_tr(), duration_min, remind_min, location)])
+
+def build_ics_feed(from_iso:str, to_iso:str, remind_min:int=10)->bytes:
+    """Aralıktaki saati belli ve bekleyen tetkiki olan randevuların tek VCALENDAR akışı."""
+    events=[]
+    for pid,fn,ln,day,hhmm,pending,last_upd,rev in storage().calendar_rows(from_iso, to_iso):
+        if not pending: continue
+        name=f"{fn} {ln}"
+        stamp=datetime.strptime(last_upd,"%Y-%m-%d %H:%M:%S").replace(tzinfo=TR_TZ)
+        events.append(_vevent(pid, name, day, hhmm, stamp, remind_min=remind_min,
+                              description=f"{name} randevusu.\nKalan: {pending}", sequence=rev))
+    title="Check-up randevuları"+(f" {from_iso}" if from_iso==to_iso else f" {from_iso} – {to_iso}")
+    return _vcalendar(events, title)
+
+@functools.lru_cache(maxsize=32)
+def _cached_ics_feed(path:str, from_iso:str, to_iso:str, remind_min:int, token:tuple)->tuple[bytes,str]:
+    body=build_ics_feed(from_iso, to_iso, remind_min)
+    return body, '"'+hashlib.sha1(body).hexdigest()+'"'
+def ics_feed(from_iso:str, to_iso:str|None=None, remind_min:int=10)->tuple[bytes,str]:
+    """(gövde, ETag). Hastalar/tetkikler değişmedikçe akış yeniden üretilmez (table_token)."""
+    return _cached_ics_feed(DB_PATH, from_iso, to_iso or from_iso, remind_min, table_token(["patients","patient_tests"]))
+def google_calendar_link(patient_name, visit_date_iso, hhmm, duration_min:int=30, location:str="Klinik"):
+    start_local=datetime.strptime(f"{visit_date_iso} {hhmm}","%Y-%m-%d %H:%M").replace(tzinfo=TR_TZ)
+    end_local=start_local+timedelta(minutes=duration_min)
+    fmt="%Y%m%dT%H%M%SZ"
+    s=start_local.astimezone(ZoneInfo("UTC")).strftime(fmt)
+    e=end_local.astimezone(ZoneInfo("UTC")).strftime(fmt)
+    return ("https://www.google.com/calendar/render?action=TEMPLATE"
+            f"&text={quote_plus('Check-up – '+patient_name)}"
+            f"&dates={s}/{e}&location={quote_plus(location)}&details={quote_plus('Check-up randevusu')}")
+
+def make_whatsapp_link(phone,text)->str:
+    return f"https://wa.me/{normalize_phone(phone).replace('+','')}?text={quote_plus(text)}"
@@ -0,0 +1,201 @@
+# outbox.py
+# Giden WhatsApp kuyruğunu (outbox tablosu) Twilio'ya gönderen işçi.
+# Hız sınırı (token bucket), eşzamanlı gönderim, üstel geri çekilmeli yeniden deneme.
+# Çalıştır:   python outbox.py run
+# Sahte API:  python outbox.py fake-twilio --port 8099   (TWILIO_API_BASE=http://127.0.0.1:8099 ile kullan)
+# Ölçüm:      python outbox.py bench 500 --rate 20
+import argparse, json, os, random, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+API_BASE = "https://api.twilio.com"
+RATE_PER_S = 1.0        # Twilio WhatsApp gönderici başına varsayılan ~1 mesaj/sn
+BURST = 5
+CONCURRENCY = 4
+BATCH = 20
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_S = 2.0
+BACKOFF_MAX_S = 600.0
+IDLE_SLEEP_S = 1.0
+
+class SendError(Exception):
+    """permanent=True: tekrar denemenin anlamı yok (geçersiz numara, yetki vb.)."""
+    def __init__(self, msg:str, permanent:bool=False, retry_after:float|None=None):
+        super().__init__(msg); self.permanent=permanent; self.retry_after=retry_after
+
+class TokenBucket:
+    """Thread-safe token bucket: saniyede `rate` jeton, en fazla `burst` birikir."""
+    def __init__(self, rate:float, burst:int=1):
+        self.rate=rate; self.burst=max(1,burst); self.tokens=float(self.burst)
+        self.last=time.monotonic(); self.lock=threading.Lock()
+    def acquire(self):
+        while True:
+            with self.lock:
+                now=time.monotonic()
+                self.tokens=min(self.burst, self.tokens+(now-self.last)*self.rate); self.last=now
+                if self.tokens>=1: self.tokens-=1; return
+                wait=(1-self.tokens)/self.rate
+            time.sleep(wait)
+
+# ================== GÖNDERİCİLER ==================
+class TwilioRestSender:
+    """Twilio Messages REST API (api_base değiştirilerek sahte sunucuya yönlendirilebilir)."""
+    def __init__(self, account_sid:str, auth_token:str, from_phone:str, api_base:str=API_BASE):
+        from twilio.http.http_client import TwilioHttpClient
+        self.http=TwilioHttpClient(pool_connections=True, timeout=15)
+        self.auth=(account_sid, auth_token)
+        self.from_=from_phone if from_phone.startswith("whatsapp:") else f"whatsapp:{from_phone}"
+        self.url=f"{api_base.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+    def send(self, to:str, body:str)->str:
+        try:
+            r=self.http.request("POST", self.url, data={"From":self.from_, "To":f"whatsapp:{to}", "Body":body}, auth=self.auth)
+        except Exception as e:  # bağlantı/zaman aşımı: geçici
+            raise SendError(f"bağlantı: {e}")
+        if r.status_code in (200,201):
+            return json.loads(r.text).get("sid","")
+        retry_after=r.headers.get("Retry-After") if r.headers else None
+        permanent=400<=r.status_code<500 and r.status_code!=429
+        raise SendError(f"HTTP {r.status_code}: {r.text[:200]}", permanent=permanent,
+                        retry_after=float(retry_after) if retry_after else None)
+
+class FakeSender:
+    """Ağsız ölçüm/deneme: gecikme ve hata oranı benzetimi. sent: (alıcı, gövde) listesi."""
+    def __init__(self, latency_s:float=0.05, fail_rate:float=0.0, seed:int=0):
+        self.latency_s=latency_s; self.fail_rate=fail_rate; self.rng=random.Random(seed)
+        self.sent=[]; self.lock=threading.Lock()
+    def send(self, to:str, body:str)->str:
+        time.sleep(self.latency_s)
+        with self.lock:
+            if self.rng.random()<self.fail_rate: raise SendError("HTTP 503: sahte hata")
+            self.sent.append((to,body)); return f"SMFAKE{len(self.sent):08d}"
+
+# ================== İŞÇİ ==================
+def backoff_s(attempts:int, rng=random)->float:
+    # 2, 4, 8 ... sn (üst sınırlı) ± %50 jitter: aynı anda düşen mesajlar aynı anda tekrar denenmesin
+    d=min(BACKOFF_MAX_S, BACKOFF_BASE_S*2**(attempts-1))
+    return d*(0.5+rng.random())
+
+class OutboxWorker:
+    def __init__(self, core, sender, rate:float=RATE_PER_S, burst:int=BURST, concurrency:int=CONCURRENCY,
+                 batch:int=BATCH, max_attempts:int=MAX_ATTEMPTS):
+        self.core=core; self.sender=sender; self.bucket=TokenBucket(rate, burst)
+        self.pool=ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="outbox")
+        self.batch=batch; self.max_attempts=max_attempts; self.stop=threading.Event()
+        self.stats={"sent":0,"retried":0,"failed":0}
+
+    def _send_one(self, row):
+        mid,to,body,attempts=row
+        self.bucket.acquire()
+        try: return ("sent", mid, self.sender.send(to, body), attempts, None)
+        except SendError as e: return ("error", mid, str(e), attempts, e)
+        except Exception as e: return ("error", mid, f"{type(e).__name__}: {e}", attempts, SendError(str(e)))
+
+    def run_once(self)->int:
+        """Vadesi gelen bir partiyi gönderir; işlenen mesaj sayısını döner."""
+        rows=self.core.claim_outbox(self.batch)
+        if not rows: return 0
+        sent,retry,failed=[],[],[]; now=time.time()
+        for kind,mid,info,attempts,err in self.pool.map(self._send_one, rows):
+            if kind=="sent": sent.append((mid,info))
+            elif err.permanent or attempts>=self.max_attempts: failed.append((mid,info))
+            else: retry.append((mid, info, now+max(err.retry_after or 0, backoff_s(attempts))))
+        self.core.finish_outbox(sent, retry, failed)
+        for k,v in (("sent",sent),("retried",retry),("failed",failed)): self.stats[k]+=len(v)
+        return len(rows)
+
+    def run_forever(self):
+        while not self.stop.is_set():
+            if not self.run_once(): self.stop.wait(IDLE_SLEEP_S)
+
+    def close(self): self.stop.set(); self.pool.shutdown(wait=True)
+
+# ================== SAHTE TWILIO API ==================
+def fake_twilio_api(latency_s:float=0.05, fail_rate:float=0.0, rate_limit_rate:float=0.0):
+    """Twilio Messages.json'u taklit eden yerel FastAPI uygulaması (yük testleri için).
+    fail_rate: 503 oranı · rate_limit_rate: 429 (Retry-After: 1) oranı."""
+    import asyncio
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+    api=FastAPI(title="Sahte Twilio"); api.state.messages=[]
+    @api.post("/2010-04-01/Accounts/{sid}/Messages.json")
+    async def create_message(sid:str, request:Request):
+        await asyncio.sleep(latency_s)
+        roll=random.random()
+        if roll<rate_limit_rate:
+            return JSONResponse({"code":20429,"message":"Too Many Requests"}, status_code=429, headers={"Retry-After":"1"})
+        if roll<rate_limit_rate+fail_rate:
+            return JSONResponse({"code":20500,"message":"Internal Server Error"}, status_code=503)
+        form=await request.form()
+        if not form.get("To") or not form.get("Body"):
+            return JSONResponse({"code":21604,"message":"'To' and 'Body' are required"}, status_code=400)
+        api.state.messages.append((form["To"], form["Body"]))
+        return JSONResponse({"sid":f"SM{len(api.state.messages):032d}", "status":"queued"}, status_code=201)
+    @api.get("/messages")
+    async def messages(): return {"count":len(api.state.messages)}
+    return api
+
+# ================== CLI ==================
+def _load_core(workdir:str|None=None):
+    # core.DB_PATH göreli: ölçümde geçici dizinde çalışıp gerçek DB'ye dokunmayız
+    here=os.path.dirname(os.path.abspath(__file__))
+    if workdir: os.chdir(workdir)
+    sys.path.insert(0, here)
+    import core
+    return core
+
+def _rest_sender(api_base:str|None):
+    from webhook import load_settings
+    cfg=load_settings()
+    return TwilioRestSender(cfg.get("TWILIO_ACCOUNT_SID","AC_local"), cfg.get("TWILIO_AUTH_TOKEN",""),
+                            cfg.get("TWILIO_WHATSAPP_FROM","+14155238886"),
+                            api_base or os.environ.get("TWILIO_API_BASE", API_BASE))
+
+def cmd_run(a):
+    core=_load_core(); w=OutboxWorker(core, _rest_sender(a.api_base), a.rate, a.burst, a.concurrency)
+    print(f"outbox işçisi: {a.rate}/sn, eşzamanlı {a.concurrency}")
+    try: w.run_forever()
+    except KeyboardInterrupt: pass
+    finally: w.close(); print(w.stats)
+
+def cmd_fake(a):
+    import uvicorn
+    uvicorn.run(fake_twilio_api(a.latency, a.fail_rate, a.rate_limit), host="127.0.0.1", port=a.port, log_level="warning")
+
+def cmd_bench(a):
+    with tempfile.TemporaryDirectory() as tmp:
+        core=_load_core(tmp)
+        # Her hastaya art arda 3 güncelleme: birleştirme sonrası hasta başına tek mesaj kalmalı
+        for i in range(a.n):
+            for k in range(3): core.enqueue_message(f"+90555{i:07d}", f"Hasta {i} güncelleme {k}", patient_id=i)
+        queued=core.outbox_counts().get("pending",0)
+        sender=_rest_sender(a.api_base) if a.api_base else FakeSender(a.latency, a.fail_rate)
+        global BACKOFF_BASE_S; BACKOFF_BASE_S=0.05  # ölçümde beklememek için
+        w=OutboxWorker(core, sender, a.rate, a.burst, a.concurrency)
+        t0=time.perf_counter()
+        while True:
+            counts=core.outbox_counts()
+            if not counts.get("pending") and not counts.get("sending"): break
+            if not w.run_once(): time.sleep(0.02)
+        dt=time.perf_counter()-t0; w.close()
+        print(f"{a.n*3} güncelleme → {queued} mesaj (birleştirme), {dt:.2f} sn, "
+              f"{w.stats['sent']/dt:.1f} mesaj/sn (sınır {a.rate}/sn, burst {a.burst})")
+        print(f"gönderildi={w.stats['sent']} yeniden_deneme={w.stats['retried']} başarısız={w.stats['failed']}")
+
+def main(argv=None):
+    ap=argparse.ArgumentParser(description="Giden WhatsApp kuyruğu")
+    sub=ap.add_subparsers(dest="cmd", required=True)
+    for name in ("run","bench"):
+        p=sub.add_parser(name)
+        p.add_argument("--rate", type=float, default=RATE_PER_S); p.add_argument("--burst", type=int, default=BURST)
+        p.add_argument("--concurrency", type=int, default=CONCURRENCY)
+        p.add_argument("--api-base", default=None, help="ör. http://127.0.0.1:8099 (sahte Twilio)")
+    b=sub.choices["bench"]
+    b.add_argument("n", type=int, nargs="?", default=200)
+    b.add_argument("--latency", type=float, default=0.05); b.add_argument("--fail-rate", type=float, default=0.05)
+    f=sub.add_parser("fake-twilio")
+    f.add_argument("--port", type=int, default=8099); f.add_argument("--latency", type=float, default=0.05)
+    f.add_argument("--fail-rate", type=float, default=0.0); f.add_argument("--rate-limit", type=float, default=0.0)
+    a=ap.parse_args(argv)
+    {"run":cmd_run, "bench":cmd_bench, "fake-twilio":cmd_fake}[a.cmd](a)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,28 @@
+# stats.py
+# Pano istatistikleri (daily_stats / test_stats) için komut satırı.
+# Yeniden hesapla: python stats.py rebuild          → canlı + arşiv kayıtlarından baştan toplar
+# Özet:            python stats.py show --days 30 --grain Hafta
+import argparse, sys
+import core
+
+def cmd_rebuild(a):
+    print(f"{core.rebuild_stats()} gün yeniden hesaplandı.")
+
+def cmd_show(a):
+    to=core.to_iso(core.today_tr_date()); frm=core.to_iso(core.today_tr_date()-core.timedelta(days=a.days-1))
+    print(f"{'dönem':<12}{'hasta':>8}{'tetkik':>8}{'tamam':>8}{'ort. dk':>9}")
+    for k,pts,tests,done,avg in core.throughput(frm, to, a.grain):
+        print(f"{k:<12}{pts:>8}{tests:>8}{done:>8}{'-' if avg is None else avg:>9}")
+
+def main(argv=None):
+    ap=argparse.ArgumentParser(description="Pano istatistikleri")
+    sub=ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild")
+    s=sub.add_parser("show")
+    s.add_argument("--days", type=int, default=30); s.add_argument("--grain", choices=list(core.STATS_GRAINS), default="Gün")
+    a=ap.parse_args(argv)
+    {"rebuild":cmd_rebuild, "show":cmd_show}[a.cmd](a)
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# webhook.py
+# Twilio WhatsApp webhook'u — FastAPI (async). Hasta/tetkik yardımcıları core.py'den gelir (Streamlit yüklenmez).
+# Çalıştır: uvicorn webhook:api --host 127.0.0.1 --port 8000
+import hmac, os, tomllib
+from datetime import datetime, timedelta
+from starlette.concurrency import run_in_threadpool
+from fastapi import FastAPI, Query, Request, HTTPException, Response
+from twilio.request_validator import RequestValidator
+from twilio.twiml.messaging_response import MessagingResponse
+import core
+
+SECRETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+
+HELP_TEXT = ("Komutlar:\n"
+             "KAYIT Ad Soyad; +905xx...; Paket; YYYY-MM-DD\n"
+             "DURUM  (personel: DURUM Ad Soyad)\n"
+             "YAPILDI Tetkik  (personel: YAPILDI Ad Soyad; Tetkik)")
+
+def load_settings()->dict:
+    """secrets.toml + ortam değişkenleri (ortam değişkeni önceliklidir)."""
+    cfg={}
+    if os.path.exists(SECRETS_PATH):
+        with open(SECRETS_PATH,"rb") as f: cfg.update(tomllib.load(f))
+    for k in ("TWILIO_ACCOUNT_SID","TWILIO_AUTH_TOKEN","TWILIO_WHATSAPP_FROM","WEBHOOK_HOST","WEBHOOK_PUBLIC_URL","CALENDAR_TOKEN"):
+        if os.environ.get(k): cfg[k]=os.environ[k]
+    return cfg
+
+# ================== KOMUTLAR (senkron; thread havuzunda çalışır) ==================
+def _sender_phone(sender:str)->str:
+    return core.normalize_phone((sender or "").removeprefix("whatsapp:"))
+
+def _is_staff(phone:str)->bool:
+    return any(p[2]==phone for p in core.list_personnel(active_only=True))
+
+def _split_name(fullname:str)->tuple[str,str]:
+    parts=fullname.split()
+    return (" ".join(parts[:-1]), parts[-1]) if len(parts)>1 else (parts[0], "-")
+
+def _find_patient_by_name(fullname:str, day_iso:str):
+    key=" ".join(fullname.split()).casefold()
+    hits=[p for p in core.list_patients(day_iso) if f"{p[1]} {p[2]}".casefold()==key]
+    return hits[0] if len(hits)==1 else None
+
+def _status_text(patient, day_iso:str)->str:
+    trs=core.list_patient_tests(patient[0])
+    done=[t[2] for t in trs if t[3]=="tamamlandi"]; rem=[t[2] for t in trs if t[3]=="bekliyor"]
+    return (f"{patient[1]} {patient[2]} ({day_iso})\n"
+            f"Tamamlanan: {', '.join(done) or '-'}\nKalan: {', '.join(rem) or '-'}")
+
+def cmd_kayit(phone:str, args:str, day_iso:str)->str:
+    if not _is_staff(phone): return "KAYIT yalnızca kayıtlı personel tarafından yapılabilir."
+    fields=[f.strip() for f in args.split(";")]
+    if not fields[0]: return "Kullanım: KAYIT Ad Soyad; +905xx...; Paket; YYYY-MM-DD"
+    patient_phone=fields[1] if len(fields)>1 else ""
+    pkg_names=[n.strip().casefold() for n in (fields[2] if len(fields)>2 else "").split(",") if n.strip()]
+    visit=fields[3] if len(fields)>3 and fields[3] else day_iso
+    try: datetime.strptime(visit,"%Y-%m-%d")
+    except ValueError: return f"Geçersiz tarih: {visit} (YYYY-MM-DD)"
+    pkgs={n.casefold():k for k,n in core.list_packages()}
+    missing=[n for n in pkg_names if n not in pkgs]
+    if missing: return f"Paket bulunamadı: {', '.join(missing)}"
+    fn,ln=_split_name(fields[0])
+    pid,n_tests=core.admit_patient(fn, ln, None, None, visit, [pkgs[n] for n in pkg_names], phone=patient_phone)
+    return f"Kaydedildi: {fn} {ln} ({visit}) — {n_tests} tetkik. No: {pid}"
+
+def cmd_durum(phone:str, args:str, day_iso:str)->str:
+    if _is_staff(phone):
+        if args:
+            p=_find_patient_by_name(args, day_iso)
+            return _status_text(p, day_iso) if p else f"Bugün '{args}' adlı tek bir hasta bulunamadı."
+        rows,total_done,total_rem=core.day_summary(day_iso)
+        lines=[f"{fn} {ln}: {len(done)}/{len(done)+len(rem)}" for _pid,fn,ln,_t,done,rem in rows]
+        return f"{day_iso} — {len(rows)} hasta, tamamlanan {total_done}, kalan {total_rem}\n"+"\n".join(lines)
+    p=core.find_patient_by_phone(phone, day_iso)
+    return _status_text(p, day_iso) if p else "Bugün bu numaraya kayıtlı randevu yok."
+
+def cmd_yapildi(phone:str, args:str, day_iso:str)->str:
+    if _is_staff(phone) and ";" in args:
+        name,_,test=args.partition(";")
+        p=_find_patient_by_name(name, day_iso)
+        if not p: return f"Bugün '{name.strip()}' adlı tek bir hasta bulunamadı."
+    else:
+        test=args; p=core.find_patient_by_phone(phone, day_iso)
+        if not p: return "Bugün bu numaraya kayıtlı randevu yok."
+    test=" ".join(test.split()).casefold()
+    if not test: return "Kullanım: YAPILDI Tetkik"
+    pending=[t for t in core.list_patient_tests(p[0]) if t[3]=="bekliyor"]
+    hits=[t for t in pending if t[2].casefold()==test] or [t for t in pending if test in t[2].casefold()]
+    if not hits: return f"Bekleyen '{test}' tetkiki yok."
+    if len(hits)>1: return "Birden çok tetkik eşleşti: "+", ".join(t[2] for t in hits)
+    core.update_patient_test_status(hits[0][0], "tamamlandi")
+    return f"✅ {hits[0][2]} tamamlandı.\n"+_status_text(p, day_iso)
+
+COMMANDS = {"KAYIT":cmd_kayit, "DURUM":cmd_durum, "YAPILDI":cmd_yapildi}
+
+def handle_message(sender:str, body:str)->str:
+    head,_,args=" ".join((body or "").split()).partition(" ")
+    cmd=COMMANDS.get(head.upper())
+    if not cmd: return HELP_TEXT
+    return cmd(_sender_phone(sender), args.strip(), core.to_iso(core.today_tr_date()))
+
+# ================== HTTP ==================
+def twiml(text:str)->Response:
+    r=MessagingResponse(); r.message(text)
+    return Response(str(r), media_type="application/xml")
+
+def _calendar_range(from_iso:str|None, to_iso:str|None)->tuple[str,str]:
+    try:
+        start=datetime.strptime(from_iso,"%Y-%m-%d").date() if from_iso else core.today_tr_date()
+        end=datetime.strptime(to_iso,"%Y-%m-%d").date() if to_iso else start+timedelta(days=core.ICS_FEED_DAYS-1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Tarih biçimi YYYY-MM-DD olmalı")
+    if not 0<=(end-start).days<core.ICS_FEED_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Aralık 1–{core.ICS_FEED_MAX_DAYS} gün olmalı")
+    return core.to_iso(start), core.to_iso(end)
+
+def calendar_response(request:Request, from_iso:str, to_iso:str)->Response:
+    # Gövde ve ETag jetonla önbellekte: değişiklik yoksa yalnızca table_token sorgusu + 304
+    body,etag=core.ics_feed(from_iso, to_iso)
+    headers={"ETag":etag, "Cache-Control":"no-cache"}
+    if etag in [t.strip() for t in request.headers.get("If-None-Match","").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="text/calendar; charset=utf-8", headers=headers)
+
+def create_app(settings:dict|None=None)->FastAPI:
+    """settings: load_settings() biçiminde; TWILIO_AUTH_TOKEN yoksa imza doğrulanamaz ve istek reddedilir
+    (yalnızca yerel deneme için VALIDATE_SIGNATURE=False verilebilir)."""
+    settings=load_settings() if settings is None else settings
+    token=settings.get("TWILIO_AUTH_TOKEN","")
+    validate=settings.get("VALIDATE_SIGNATURE", True)
+    validator=RequestValidator(token) if token else None
+    public_url=(settings.get("WEBHOOK_PUBLIC_URL") or "").rstrip("/")
+    calendar_token=settings.get("CALENDAR_TOKEN","")
+    api=FastAPI(title="Check-up Takip WhatsApp Webhook")
+
+    @api.get("/health")
+    async def health():
+        return {"ok":True}
+
+    @api.post("/twilio/whatsapp")
+    async def whatsapp(request:Request):
+        form=await request.form(); params={k:v for k,v in form.items()}
+        if validate:
+            # ngrok arkasında Twilio'nun imzaladığı adres genel URL'dir
+            url=public_url+request.url.path if public_url else str(request.url)
+            sig=request.headers.get("X-Twilio-Signature","")
+            if validator is None or not validator.validate(url, params, sig):
+                raise HTTPException(status_code=403, detail="Geçersiz Twilio imzası")
+        reply=await run_in_threadpool(handle_message, params.get("From",""), params.get("Body",""))
+        return twiml(reply)
+
+    # Takvim aboneliği: hasta adları içerdiğinden CALENDAR_TOKEN olmadan kapalıdır
+    def check_calendar_token(token:str):
+        if not calendar_token or not hmac.compare_digest(token.encode(), calendar_token.encode()):
+            raise HTTPException(status_code=403, detail="Geçersiz takvim anahtarı")
+
+    @api.get("/calendar.ics")
+    async def calendar_feed(request:Request, token:str="", frm:str|None=Query(None, alias="from"),
+                            to:str|None=Query(None, alias="to")):
+        check_calendar_token(token)
+        frm,to=_calendar_range(frm, to)
+        return await run_in_threadpool(calendar_response, request, frm, to)
+
+    @api.get("/calendar/{day}.ics")
+    async def calendar_day(request:Request, day:str, token:str=""):
+        check_calendar_token(token)
+        frm,to=_calendar_range(day, day)
+        return await run_in_threadpool(calendar_response, request, frm, to)
+
+    return api
+
+class FakeTwilio:
+    """Yerel deneme: Twilio gibi imzalı form gönderir. http: fastapi.testclient.TestClient ya da httpx.Client."""
+    def __init__(self, http, auth_token:str, base_url:str="http://testserver"):
+        self.http=http; self.validator=RequestValidator(auth_token); self.base_url=base_url.rstrip("/")
+    def send(self, from_phone:str, body:str)->str:
+        url=self.base_url+"/twilio/whatsapp"
+        params={"From":f"whatsapp:{core.normalize_phone(from_phone)}", "Body":body}
+        r=self.http.post(url, data=params, headers={"X-Twilio-Signature":self.validator.compute_signature(url, params)})
+        r.raise_for_status()
+        return r.text
+
+api=create_app()
+
+if __name__=="__main__":
+    import uvicorn
+    uvicorn.run(api, host="127.0.0.1", port=8000)